@@ -67,7 +67,10 @@ CAPTCHA_TIMEOUT = 5  # минут
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # ← ДОБАВИТЬ ЭТУ СТРОКУ
-    'django.middleware.gzip.GZipMiddleware',
+    'shop.middleware.CacheInvalidationMiddleware',  # инвалидации из других воркеров
+    'shop.middleware.ReadReplicaMiddleware',  # GET вне админки читают с replica
+    'shop.middleware.CompressionMiddleware',  # gzip/Brotli, с готовыми вариантами из кеша страниц
+    'shop.middleware.RequestMetricsMiddleware',  # время, запросы к БД и размер ответа по view
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -80,9 +83,9 @@ ROOT_URLCONF = 'banyana_fresh.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates + гистограмма времени рендера (shop/template_backend.py)
+        'BACKEND': 'shop.template_backend.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],  # Шаблоны в корне
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -90,6 +93,14 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Шаблоны компилируются один раз на процесс (при DEBUG кеш
+            # сбрасывается автоперезагрузкой при правке файлов)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -137,12 +148,32 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']  # Статика в корне проекта
 STATIC_ROOT = BASE_DIR / 'staticfiles'
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# STATICFILES_STORAGE в Django 5.1+ не читается — хранилища задаются через STORAGES.
+# Бандлы страниц собирает build_bundles (shop/bundles.py) перед collectstatic.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'shop.storage.ManifestStaticFilesStorage',
+    },
+}
 
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Уменьшенные копии и WebP/AVIF для всех ImageField (см. shop/images.py)
+IMAGE_DERIVATIVES = {
+    'SIZES': (160, 480, 960, 1600),  # ширина копий, px
+    'FORMATS': ('avif', 'webp'),  # помимо исходного формата
+    'QUALITY': 80,
+    'WORKERS': 2,  # фоновые потоки генерации в каждом воркере
+}
+
+# Фотографий работ на одной странице галереи /works/
+WORKS_PAGE_SIZE = 24
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -153,29 +184,49 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # ОПТИМИЗАЦИЯ: КЕШИРОВАНИЕ
 # ============================================
 
-# Кеширование в памяти (для разработки и малых проектов)
+import os
+from importlib.util import find_spec
+
+# Двухуровневый кеш (см. shop/cache_backends.py): L1 в памяти процесса перед
+# общим для всех воркеров L2. L2 — Redis, если задан REDIS_URL и установлен
+# пакет redis, иначе файл SQLite рядом с проектом
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'banyana-cache',
+        'BACKEND': 'shop.cache_backends.TwoTierCache',
+        'LOCATION': 'shared',  # алиас L2
         'TIMEOUT': 300,  # 5 минут по умолчанию
         'OPTIONS': {
             'MAX_ENTRIES': 1000,
+            'MAX_BYTES': 32 * 1024 * 1024,  # 32 МБ в каждом воркере
+            'REVALIDATE_AFTER': 5,  # секунд, после которых L1 сверяется с L2
         }
-    }
+    },
+    'shared': {
+        'BACKEND': 'shop.cache_backends.SQLiteCache',
+        'LOCATION': str(BASE_DIR / 'cache.sqlite3'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        }
+    },
 }
 
-# Для продакшена рекомендуется Redis:
-# CACHES = {
-#     'default': {
-#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-#         'LOCATION': 'redis://127.0.0.1:6379/1',
-#         'OPTIONS': {
-#             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
-#         },
-#         'TIMEOUT': 300,
-#     }
-# }
+if REDIS_URL and find_spec('redis') is not None:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'TIMEOUT': 300,
+    }
+
+# L1 у каждого воркера свой, поэтому инвалидации рассылаются через
+# таблицу поколений в отдельном файле SQLite (см. shop/cache_bus.py)
+CACHE_BUS_PATH = BASE_DIR / 'cache_bus.sqlite3'
+
+# Прогрев кеша при старте воркера и после инвалидаций (см. shop/warmup.py)
+CACHE_WARMUP_PARALLEL = 4  # страниц одновременно
+CACHE_WARMUP_INTERVAL = 2  # секунд между проверками шины в фоне (None — без фонового прогрева)
 
 
 # ============================================
@@ -186,7 +237,43 @@ CACHES = {
 DATABASES['default']['OPTIONS'] = {
     'timeout': 20,
     'check_same_thread': False,
+    # Писатель сразу берёт блокировку записи: иначе при повышении блокировки
+    # чтения до записи SQLite отвечает «database is locked», не дожидаясь timeout
+    'transaction_mode': 'IMMEDIATE',
+}
+# Соединение живёт между запросами: PRAGMA ниже выполняются один раз на соединение
+DATABASES['default']['CONN_MAX_AGE'] = 600
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Публичные страницы читают через второе соединение к тому же файлу, открытое
+# только для чтения; записи и админка — через default (см. shop/routers.py).
+# Для PostgreSQL здесь будет реплика. В тестах replica — зеркало default.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': f"file:{DATABASES['default']['NAME']}?mode=ro",
+    # BEGIN IMMEDIATE берёт блокировку записи — соединению только для чтения она не нужна
+    'OPTIONS': {key: value for key, value in DATABASES['default']['OPTIONS'].items() if key != 'transaction_mode'},
+    'TEST': {'MIRROR': 'default'},
 }
+DATABASE_ROUTERS = ['shop.routers.ReadReplicaRouter']
+
+# PRAGMA для каждого нового соединения SQLite в процессе сервера (см. shop/sqlite_tuning.py)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # читатели не ждут писателя
+    'synchronous': 'NORMAL',  # в WAL без потери целостности, fsync только на контрольной точке
+    'cache_size': -32000,  # 32 МБ кеша страниц на соединение (отрицательное — в КиБ)
+    'mmap_size': 268435456,  # 256 МБ: чтение через отображение файла в память
+    'temp_store': 'MEMORY',
+    'journal_size_limit': 67108864,  # файл -wal усекается до 64 МБ после контрольной точки
+}
+# Раз в столько секунд: PRAGMA optimize и контрольная точка WAL (None — не запускать)
+SQLITE_MAINTENANCE_INTERVAL = 3600
+
+# Заявки (заказы, кредит) сначала пишутся в очередь в отдельном файле SQLite,
+# а в БД их пачками переносит фоновый поток (см. shop/ingest.py)
+INGEST_QUEUE_PATH = BASE_DIR / 'ingest_queue.sqlite3'
+INGEST_BATCH_SIZE = 200
+INGEST_LEASE = 60  # секунд до повтора строки, взятой упавшим воркером
 
 # Для продакшена PostgreSQL:
 # DATABASES = {
@@ -250,5 +337,33 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'shop': {
+            'handlers': ['file', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
+
+# ============================================
+# МЕТРИКИ
+# ============================================
+
+# Снимки метрик всех воркеров для /metrics/ (см. shop/metrics.py)
+METRICS_PATH = BASE_DIR / 'metrics.sqlite3'
+METRICS_FLUSH_INTERVAL = 10  # секунд между записями снимка воркера (None — не записывать)
+# /metrics/ доступен персоналу и по заголовку Authorization: Bearer <токен>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Бюджеты запросов к БД для view и списков админки (см. shop/query_budget.py):
+# 'raise' — исключение, 'log' — предупреждение в лог, None — не проверять
+QUERY_BUDGET_MODE = 'log' if DEBUG else None  # в тестах — 'raise' (shop/test_runner.py)
+
+
+# ============================================
+# ТЕСТЫ
+# ============================================
+
+# Шина, общий кеш, очередь заявок, метрики и media на время тестов —
+# во временном каталоге, а не в рабочих файлах (см. shop/test_runner.py)
+TEST_RUNNER = 'shop.test_runner.IsolatedTestRunner'
@@ -14,3 +14,16 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'banyana_fresh.settings')
 
 application = get_wsgi_application()
+
+# PRAGMA для соединений SQLite (WAL), перенос заявок из очереди в БД,
+# включая оставшиеся с прошлого запуска, периодическое обслуживание SQLite,
+# запись снимков метрик для /metrics/, прогрев кеша при старте и после
+# инвалидаций, сводки кеша для clear_cache stats
+from shop import cache_inspect, ingest, metrics, sqlite_tuning, warmup  # noqa: E402
+
+sqlite_tuning.enable()
+ingest.start_drainer()
+sqlite_tuning.start_maintenance()
+metrics.start_flusher()
+warmup.start_warmup()
+cache_inspect.enable_reports()
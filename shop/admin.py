@@ -1,18 +1,34 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.db.models import Count
+
+from . import ingest, search
+from .query_budget import QueryBudgetAdminMixin
+from .images import thumbnail_url
 from .models import (
     Product, ProductImage, ProductPrice, GlobalOption,
     WorkPhoto, OrderRequest, CompanyInfo, CreditRequest
 )
 
 
+class IndexedSearchMixin:
+    """Поиск в списке через полнотекстовый индекс (shop/search.py) вместо LIKE '%…%'"""
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip() or not search.is_available():
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=search.ids(self.search_kind, search_term)), False
+
+
 @admin.register(GlobalOption)
-class GlobalOptionAdmin(admin.ModelAdmin):
+class GlobalOptionAdmin(QueryBudgetAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
+    changelist_budget = (6, 100)
     list_display = ('name', 'category_display', 'formatted_price_display', 'preview_image', 'is_active', 'order')
     list_editable = ('is_active', 'order')
     list_filter = ('is_active', 'category')
     search_fields = ('name', 'description')
+    search_kind = 'option'
     list_per_page = 50
 
     fieldsets = (
@@ -41,7 +57,7 @@ class GlobalOptionAdmin(admin.ModelAdmin):
         if obj.image:
             return format_html(
                 '<img src="{}" style="max-height: 50px; max-width: 80px; border-radius: 4px;" loading="lazy"/>',
-                obj.image.url
+                thumbnail_url(obj.image, 160)
             )
         return '—'
 
@@ -68,7 +84,7 @@ class ProductImageInline(admin.TabularInline):
         if obj.image:
             return format_html(
                 '<img src="{}" style="max-height: 80px; border-radius: 4px;" loading="lazy"/>',
-                obj.image.url
+                thumbnail_url(obj.image, 160)
             )
         return "Нет изображения"
 
@@ -76,12 +92,14 @@ class ProductImageInline(admin.TabularInline):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(QueryBudgetAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
+    changelist_budget = (6, 100)
     list_display = (
     'title', 'price', 'is_featured', 'image_preview', 'images_count', 'prices_count')  # ← Добавлено is_featured
     list_editable = ('is_featured',)  # ← НОВОЕ: можно редактировать прямо в списке
     list_filter = ('is_featured',)  # ← НОВОЕ: фильтр по популярности
     search_fields = ('title', 'description')
+    search_kind = 'product'
     inlines = [ProductPriceInline, ProductImageInline]
     list_per_page = 50
 
@@ -103,7 +121,7 @@ class ProductAdmin(admin.ModelAdmin):
         if obj.image:
             return format_html(
                 '<img src="{}" style="width: 60px; height: auto; border-radius: 4px;"/>',
-                obj.image.url
+                thumbnail_url(obj.image, 160)
             )
         return '—'
 
@@ -122,7 +140,8 @@ class ProductAdmin(admin.ModelAdmin):
     prices_count.admin_order_field = '_prices_count'
 
 @admin.register(WorkPhoto)
-class WorkPhotoAdmin(admin.ModelAdmin):
+class WorkPhotoAdmin(QueryBudgetAdminMixin, admin.ModelAdmin):
+    changelist_budget = (8, 100)
     list_display = ('image_preview', 'created_at')
     list_display_links = ('image_preview', 'created_at')
     readonly_fields = ('created_at', 'image_preview_large')
@@ -134,7 +153,7 @@ class WorkPhotoAdmin(admin.ModelAdmin):
         if obj.image:
             return format_html(
                 '<img src="{}" style="max-height: 80px; border-radius: 4px;" loading="lazy"/>',
-                obj.image.url
+                thumbnail_url(obj.image, 160)
             )
         return "Нет изображения"
 
@@ -144,21 +163,41 @@ class WorkPhotoAdmin(admin.ModelAdmin):
         if obj.image:
             return format_html(
                 '<img src="{}" style="max-width: 300px; border-radius: 8px;" loading="lazy"/>',
-                obj.image.url
+                thumbnail_url(obj.image, 480)
             )
         return "Изображение ещё не загружено"
 
     image_preview_large.short_description = 'Превью изображения'
 
 
+class PendingSubmissionsMixin:
+    """Над списком заявок — заявки из очереди, ещё не перенесённые в БД (shop/ingest.py)"""
+    change_list_template = 'admin/shop/pending_change_list.html'
+    # Поля заявки, которые показываются в таблице очереди
+    pending_fields = ('fio', 'phone')
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['pending_submissions'] = [
+            {**submission, 'values': [submission['fields'].get(name, '') for name in self.pending_fields]}
+            for submission in ingest.pending(self.model._meta.label)
+        ]
+        extra_context['pending_headers'] = [
+            self.model._meta.get_field(name).verbose_name for name in self.pending_fields
+        ]
+        return super().changelist_view(request, extra_context)
+
+
 @admin.register(OrderRequest)
-class OrderRequestAdmin(admin.ModelAdmin):
+class OrderRequestAdmin(QueryBudgetAdminMixin, PendingSubmissionsMixin, admin.ModelAdmin):
+    changelist_budget = (8, 100)
     list_display = ('fio', 'phone', 'email', 'created_at', 'has_details')
     search_fields = ('fio', 'phone', 'email', 'order_details')
     readonly_fields = ('created_at',)
     list_filter = ('created_at',)
     date_hierarchy = 'created_at'
     list_per_page = 100
+    pending_fields = ('fio', 'phone', 'email')
 
     fieldsets = (
         ('Контактная информация', {
@@ -183,7 +222,8 @@ class OrderRequestAdmin(admin.ModelAdmin):
 from .models import CreditRequest
 
 @admin.register(CreditRequest)
-class CreditRequestAdmin(admin.ModelAdmin):
+class CreditRequestAdmin(QueryBudgetAdminMixin, PendingSubmissionsMixin, admin.ModelAdmin):
+    changelist_budget = (6, 100)
     list_display = ('fio', 'phone', 'created_at', 'status')
     list_filter = ('status', 'created_at')
     search_fields = ('fio', 'phone')
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from . import images, invalidation, metrics, search, utils
+        invalidation.connect_signals()
+        utils.observe(metrics.record_cache_request)
+        images.connect_signals()
+        search.connect_signals()
@@ -0,0 +1,507 @@
+# shop/benchmark.py
+"""
+Нагрузочный прогон публичных страниц и форм заявок
+
+Прогон идёт на временной копии окружения (scratch_environment): отдельный
+файл SQLite со всеми миграциями, свой MEDIA_ROOT и свои файлы шины кеша,
+очереди заявок и метрик. seed() заполняет базу синтетическим каталогом
+заданного размера, рабочая база и media не затрагиваются.
+
+Каждый сценарий из SCENARIOS прогоняется дважды:
+- cold — кеш очищается перед каждым запросом (во всех воркерах, через
+  cache_bus), измеряется полный рендер;
+- warm — тот же набор запросов повторяется, измеряется второй проход.
+
+Запросы отправляет ClientDriver (тестовый клиент Django в процессе
+команды) или HttpDriver (HTTP к локальному gunicorn). Время ответа
+измеряет сам драйвер, а число запросов к БД и попадания в кеш берутся из
+метрик shop/metrics.py: у gunicorn — с его /metrics/, то есть по всем
+воркерам. Результаты сохраняет и сравнивает команда views_benchmark.
+"""
+import copy
+import http.client
+import json
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from . import cache_bus, images, metrics, search
+
+# Различных исходных файлов изображений: записи ссылаются на них по кругу,
+# копии (shop/images.py) создаются один раз на файл
+DISTINCT_IMAGES = 8
+
+_TITLE_WORDS = ('Баня', 'Баня-бочка', 'Сауна', 'Парилка', 'Баня-дом', 'Мобильная баня')
+_MATERIALS = ('из кедра', 'из сосны', 'из лиственницы', 'из липы', 'из термоосины')
+_OPTION_WORDS = ('Печь', 'Полок', 'Окно', 'Дверь', 'Светильник', 'Бак', 'Лавка', 'Вагонка', 'Терраса')
+
+
+# ============================================
+# Окружение и данные
+# ============================================
+
+@contextmanager
+def scratch_environment(directory, **overrides):
+    """
+    Базы, media и служебные файлы во временном каталоге directory
+
+    Все алиасы БД переключаются на новый файл (replica — на него же только
+    для чтения), применяются миграции. overrides — дополнительные настройки.
+    """
+    directory = Path(directory)
+    db_path = str(directory / 'db.sqlite3')
+    original = {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+    connections.close_all()
+    for alias in connections:
+        readonly = 'mode=ro' in str(original[alias])
+        connections[alias].settings_dict['NAME'] = f'file:{db_path}?mode=ro' if readonly else db_path
+    try:
+        with override_settings(**{**scratch_settings(directory), **overrides}):
+            cache.clear()
+            call_command('migrate', verbosity=0, interactive=False)
+            yield db_path
+            cache.clear()
+    finally:
+        connections.close_all()
+        for alias, name in original.items():
+            connections[alias].settings_dict['NAME'] = name
+
+
+def scratch_paths(directory):
+    """Пути media и служебных файлов (шина и общий кеш, очередь, метрики) во временном каталоге"""
+    directory = Path(directory)
+    return {
+        'MEDIA_ROOT': directory / 'media',
+        'CACHE_BUS_PATH': directory / 'cache_bus.sqlite3',
+        'INGEST_QUEUE_PATH': directory / 'ingest_queue.sqlite3',
+        'METRICS_PATH': directory / 'metrics.sqlite3',
+        'CACHES': _scratch_caches(directory),
+    }
+
+
+def scratch_settings(directory):
+    """Настройки прогона: scratch_paths и любой Host у запросов к gunicorn"""
+    return {**scratch_paths(directory), 'ALLOWED_HOSTS': ['*']}
+
+
+def _scratch_caches(directory):
+    """CACHES, где файл общего кеша SQLite (shop/cache_backends.py) — во временном каталоге"""
+    result = copy.deepcopy(settings.CACHES)
+    for config in result.values():
+        if config['BACKEND'] == 'shop.cache_backends.SQLiteCache':
+            config['LOCATION'] = str(Path(directory) / 'cache.sqlite3')
+    return result
+
+
+def _image(rng, width=1600, height=1067):
+    """Градиент со случайным цветом: JPEG, похожий на фотографию по размеру копий"""
+    base = [rng.randrange(40, 200) for _ in range(3)]
+    gradient = Image.linear_gradient('L').resize((width, height))
+    picture = Image.merge('RGB', [gradient.point(lambda v, c=c: (v + c) % 256) for c in base])
+    buffer = BytesIO()
+    picture.save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def _image_names(rng, folder):
+    names = []
+    for index in range(DISTINCT_IMAGES):
+        name = default_storage.save(f'{folder}/bench-{index}.jpg', ContentFile(_image(rng)))
+        images.generate_derivatives(name)
+        names.append(name)
+    return names
+
+
+def seed(products=60, prices=4, images_per_product=5, options=120, works=3000, random_seed=0):
+    """
+    Синтетический каталог в пустой базе
+
+    bulk_create без сигналов: копии изображений создаются заранее для
+    DISTINCT_IMAGES файлов, поисковый индекс перестраивается в конце.
+    Возвращает {'product_ids': [...], 'price_ids': [...]} для сценариев.
+    """
+    from .models import (
+        CompanyInfo, GlobalOption, Product, ProductImage, ProductPrice, WorkPhoto,
+    )
+
+    rng = random.Random(random_seed)
+    product_images = _image_names(rng, 'products')
+    gallery_images = _image_names(rng, 'product_images')
+    work_images = _image_names(rng, 'works')
+
+    CompanyInfo.objects.create(
+        description='Производство бань под ключ', phone='+7 900 000-00-00',
+        email='info@example.com', address='Вологда',
+    )
+    created = Product.objects.bulk_create(
+        Product(
+            title=f'{rng.choice(_TITLE_WORDS)} {rng.choice(_MATERIALS)} №{index + 1}',
+            price=Decimal(rng.randrange(200, 900) * 1000),
+            description=' '.join(rng.choice(_MATERIALS + _TITLE_WORDS) for _ in range(60)),
+            image=product_images[index % DISTINCT_IMAGES],
+            is_featured=index < 6,
+        )
+        for index in range(products)
+    )
+    product_ids = [product.pk for product in created]
+
+    price_rows = []
+    for product_id in product_ids:
+        for index in range(prices):
+            length = Decimal(rng.choice(('3', '4', '4.5', '5', '5.5', '6', '7')))
+            row = ProductPrice(
+                product_id=product_id, name=f'{length} м', order=index,
+                price=Decimal(rng.randrange(200, 900) * 1000),
+                total_length=str(length), steam_room_length=rng.choice(('1.8', '2', '2.2/2.25', '2.5', '3')),
+                rest_room=rng.choice(('', '170/195', '2.4')), height='2.2', width='2.4',
+            )
+            row.normalize_dimensions()
+            price_rows.append(row)
+    price_ids = [row.pk for row in ProductPrice.objects.bulk_create(price_rows)]
+
+    ProductImage.objects.bulk_create(
+        ProductImage(product_id=product_id, image=gallery_images[(product_id + index) % DISTINCT_IMAGES], order=index)
+        for product_id in product_ids
+        for index in range(images_per_product)
+    )
+    categories = [value for value, _ in GlobalOption.CATEGORY_CHOICES]
+    GlobalOption.objects.bulk_create(
+        GlobalOption(
+            name=f'{rng.choice(_OPTION_WORDS)} {rng.choice(_MATERIALS)} {index + 1}',
+            price=Decimal(rng.randrange(1, 120) * 1000),
+            category=categories[index % len(categories)],
+            description=' '.join(rng.choice(_MATERIALS) for _ in range(12)),
+            order=index,
+        )
+        for index in range(options)
+    )
+    WorkPhoto.objects.bulk_create(
+        (WorkPhoto(image=work_images[index % DISTINCT_IMAGES]) for index in range(works)),
+        batch_size=500,
+    )
+    search.rebuild()
+    return {'product_ids': product_ids, 'price_ids': price_ids}
+
+
+# ============================================
+# Сценарии
+# ============================================
+
+def _order_data(dataset, index):
+    return {
+        'fio': f'Покупатель {index}', 'phone': '+7 900 000-00-00', 'email': f'buyer{index}@example.com',
+        'contact_method': 'phone', 'contact_time': 'anytime', 'message': 'Нагрузочный прогон',
+        # CAPTCHA_TEST_MODE: ответ PASSED принимается без картинки
+        'captcha_0': 'benchmark', 'captcha_1': 'PASSED',
+    }
+
+
+def _credit_data(dataset, index):
+    return {'fio': f'Покупатель {index}', 'phone': '+7 900 000-00-00', 'captcha_0': 'benchmark', 'captcha_1': 'PASSED'}
+
+
+def _order_path(dataset, index):
+    # Детали заказа считаются из выбранного размера, как при переходе из калькулятора
+    price_ids = dataset['price_ids']
+    return f"{reverse('order')}?{urlencode({'size': price_ids[index % len(price_ids)]})}"
+
+
+def _product_path(dataset, index):
+    product_ids = dataset['product_ids']
+    return reverse('product_detail', args=[product_ids[index % len(product_ids)]])
+
+
+# Имя -> (метод, функция(данные, номер) -> путь, функция(данные, номер) -> тело POST или None)
+SCENARIOS = {
+    'index': ('GET', lambda dataset, index: reverse('index'), None),
+    'catalog': ('GET', lambda dataset, index: reverse('catalog'), None),
+    'product_detail': ('GET', _product_path, None),
+    'works': ('GET', lambda dataset, index: reverse('works'), None),
+    'additional_services': ('GET', lambda dataset, index: reverse('additional_services'), None),
+    'order': ('POST', _order_path, _order_data),
+    'credit_request': ('POST', lambda dataset, index: reverse('credit_request'), _credit_data),
+}
+
+
+# ============================================
+# Драйверы
+# ============================================
+
+_SAMPLE_RE = re.compile(r'^(?P<name>\w+)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$')
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def metric_totals(text):
+    """
+    Суммы из текста Prometheus по всем view, кроме самого /metrics/
+
+    {'requests', 'queries', 'db_seconds', 'hit', 'stale', 'miss'}
+    """
+    totals = {'requests': 0, 'queries': 0.0, 'db_seconds': 0.0, 'hit': 0, 'stale': 0, 'miss': 0}
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line)
+        if match is None:
+            continue
+        labels = dict(_LABEL_RE.findall(match['labels'] or ''))
+        if labels.get('view') == 'metrics':
+            continue
+        name, value = match['name'], float(match['value'])
+        if name == 'shop_request_db_queries_count':
+            totals['requests'] += value
+        elif name == 'shop_request_db_queries_sum':
+            totals['queries'] += value
+        elif name == 'shop_request_db_seconds_sum':
+            totals['db_seconds'] += value
+        elif name == 'shop_cache_requests_total' and labels.get('result') in totals:
+            totals[labels['result']] += value
+    return totals
+
+
+class ClientDriver:
+    """Тестовый клиент Django в текущем процессе, запросы по одному"""
+
+    name = 'client'
+    concurrency = 1
+
+    def __init__(self):
+        self.client = Client(HTTP_ACCEPT_ENCODING='gzip')
+
+    def request(self, method, path, data=None):
+        """(код ответа, секунды) — со временем чтения тела, в том числе потокового"""
+        started = time.perf_counter()
+        response = self.client.post(path, data) if method == 'POST' else self.client.get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)  # сжатие идёт при чтении тела
+        return response.status_code, time.perf_counter() - started
+
+    def clear_cache(self):
+        cache.clear()
+
+    def totals(self):
+        return metric_totals(metrics.render_prometheus(metrics.aggregate([metrics.dump()])))
+
+
+class HttpDriver:
+    """HTTP к запущенному серверу; warm-фаза идёт в concurrency потоков"""
+
+    name = 'gunicorn'
+
+    def __init__(self, port, token, concurrency=8, flush_interval=1):
+        self.port = port
+        self.token = token
+        self.concurrency = concurrency
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._csrf = None
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        return conn
+
+    def _send(self, method, path, body=None, headers=None):
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body, headers={'Accept-Encoding': 'gzip', **(headers or {})})
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+        return response
+
+    def csrf_token(self):
+        """Токен CSRF из cookie формы заказа; один на весь прогон"""
+        if self._csrf is None:
+            cookie = self._send('GET', reverse('order')).getheader('Set-Cookie') or ''
+            match = re.search(rf'{settings.CSRF_COOKIE_NAME}=([^;]+)', cookie)
+            if match is None:
+                raise RuntimeError('Сервер не выдал cookie CSRF на странице заказа')
+            self._csrf = match.group(1)
+        return self._csrf
+
+    def request(self, method, path, data=None):
+        body, headers = None, {}
+        if method == 'POST':
+            token = self.csrf_token()
+            body = urlencode({**data, 'csrfmiddlewaretoken': token})
+            headers = {
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Cookie': f'{settings.CSRF_COOKIE_NAME}={token}',
+            }
+        started = time.perf_counter()
+        try:
+            status = self._send(method, path, body, headers).status
+        except (http.client.HTTPException, OSError):
+            status = 599
+        return status, time.perf_counter() - started
+
+    def clear_cache(self):
+        # Воркеры применят инвалидацию перед следующим запросом (CacheInvalidationMiddleware)
+        cache_bus.invalidate([cache_bus.ALL_KEYS])
+
+    def totals(self):
+        # Воркеры пишут снимки метрик раз в flush_interval секунд
+        time.sleep(self.flush_interval + 0.5)
+        response = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        response.request('GET', reverse('metrics'), headers={'Authorization': f'Bearer {self.token}'})
+        text = response.getresponse().read().decode()
+        response.close()
+        return metric_totals(text)
+
+
+def new_token():
+    return secrets.token_urlsafe(24)
+
+
+def server_settings_module(directory, db_path, token):
+    """Модуль настроек gunicorn: основные настройки с путями во временном каталоге"""
+    lines = [
+        'from banyana_fresh.settings import *  # noqa: F401,F403',
+        '',
+        f"DATABASES['default']['NAME'] = {db_path!r}",
+        f"DATABASES['replica']['NAME'] = {f'file:{db_path}?mode=ro'!r}",
+        *(f'{name} = {str(value) if isinstance(value, Path) else value!r}'
+          for name, value in scratch_settings(directory).items()),
+        'METRICS_FLUSH_INTERVAL = 1',
+        f'METRICS_TOKEN = {token!r}',
+        'CAPTCHA_TEST_MODE = True',
+    ]
+    path = Path(directory) / 'benchmark_settings.py'
+    path.write_text('\n'.join(lines) + '\n')
+    return path.stem
+
+
+def server_command(port, workers):
+    return [
+        sys.executable, '-m', 'gunicorn', 'banyana_fresh.wsgi:application',
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning',
+    ]
+
+
+# ============================================
+# Прогон
+# ============================================
+
+def _percentile(ordered, q):
+    """Квантиль по рангу (nearest-rank) в отсортированном списке"""
+    if not ordered:
+        return None
+    return ordered[max(0, min(len(ordered) - 1, round(q * len(ordered)) - 1))]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _summary(latencies, statuses, wall, before, after):
+    ordered = sorted(latencies)
+    served = after['requests'] - before['requests'] or len(latencies)
+    lookups = sum(after[key] - before[key] for key in ('hit', 'stale', 'miss'))
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 400),
+        'rps': round(len(latencies) / wall, 1) if wall else None,
+        'p50_ms': _ms(_percentile(ordered, 0.5)),
+        'p95_ms': _ms(_percentile(ordered, 0.95)),
+        'p99_ms': _ms(_percentile(ordered, 0.99)),
+        'queries_per_request': round((after['queries'] - before['queries']) / served, 2),
+        'db_ms_per_request': round((after['db_seconds'] - before['db_seconds']) * 1000 / served, 3),
+        'cache_hit_rate': (
+            round((after['hit'] + after['stale'] - before['hit'] - before['stale']) / lookups, 3)
+            if lookups else None
+        ),
+    }
+
+
+def run_scenario(driver, dataset, scenario, requests):
+    """{'cold': {...}, 'warm': {...}} для одного сценария"""
+    method, path, data = SCENARIOS[scenario]
+    calls = [
+        (method, path(dataset, index), data(dataset, index) if data else None)
+        for index in range(requests)
+    ]
+    result = {}
+
+    before = driver.totals()
+    latencies, statuses = [], []
+    started = time.perf_counter()
+    for call in calls:
+        driver.clear_cache()
+        status, seconds = driver.request(*call)
+        statuses.append(status)
+        latencies.append(seconds)
+    result['cold'] = _summary(latencies, statuses, time.perf_counter() - started, before, driver.totals())
+
+    for call in calls:  # прогрев: тот же набор запросов
+        driver.request(*call)
+    before = driver.totals()
+    started = time.perf_counter()
+    if driver.concurrency > 1:
+        with ThreadPoolExecutor(max_workers=driver.concurrency) as pool:
+            measured = list(pool.map(lambda call: driver.request(*call), calls))
+    else:
+        measured = [driver.request(*call) for call in calls]
+    wall = time.perf_counter() - started
+    result['warm'] = _summary(
+        [seconds for _, seconds in measured], [status for status, _ in measured], wall, before, driver.totals(),
+    )
+    return result
+
+
+# ============================================
+# Сравнение
+# ============================================
+
+# Метрика -> больше значит хуже
+COMPARED = {'p95_ms': True, 'p99_ms': True, 'rps': False, 'queries_per_request': True}
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Ухудшения относительно прошлого прогона: [(сервер, сценарий, фаза, метрика, было, стало)]
+
+    Время и пропускная способность — при изменении больше чем на threshold
+    (шум измерений), число запросов к БД детерминировано — при любом росте.
+    """
+    regressions = []
+    for server, scenarios in current.get('runs', {}).items():
+        for scenario, phases in scenarios.items():
+            for phase, stats in phases.items():
+                old = baseline.get('runs', {}).get(server, {}).get(scenario, {}).get(phase)
+                if not old:
+                    continue
+                for key, higher_is_worse in COMPARED.items():
+                    was, now = old.get(key), stats.get(key)
+                    if was is None or now is None:
+                        continue
+                    limit = 0 if key == 'queries_per_request' else threshold * was
+                    worse = now - was if higher_is_worse else was - now
+                    if worse > limit:
+                        regressions.append((server, scenario, phase, key, was, now))
+    return regressions
+
+
+def load(path):
+    return json.loads(Path(path).read_text())
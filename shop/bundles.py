@@ -0,0 +1,265 @@
+# shop/bundles.py
+"""
+Статические бандлы из встроенных в шаблоны <style> и <script>
+
+Блок {% bundle 'catalog' %}<style>…</style><script>…</script>{% endbundle %}
+(shop_bundles) описывает стили и скрипты страницы прямо в шаблоне.
+Команда build_bundles перед collectstatic собирает их в минифицированные
+static/bundles/<имя>.css и .js, а тег вместо встроенного кода выводит
+<link>/<script src> на файл с хешем в имени (ManifestStaticFilesStorage),
+который браузер кеширует навсегда. Первая строка файла — хеш исходника:
+если шаблон поменяли, а бандл не пересобрали, тег отдаёт код встроенным.
+
+У бандла может быть несколько блоков (стили в extra_head, скрипты в
+extra_scripts), но каждый тип кода — только в одном из них.
+"""
+import hashlib
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.template import Engine
+from django.template.utils import get_app_template_dirs
+
+BUNDLES_DIR = 'bundles'
+# Только встроенный код: <script src=...> в бандл не попадает
+_BLOCK_RE = re.compile(r'<(style|script)(?![^>]*\bsrc=)[^>]*>(.*?)</\1\s*>', re.S | re.I)
+_LEFTOVER_RE = re.compile(r'<!--.*?-->|\s+', re.S)
+
+_CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACE_RE = re.compile(r'\s+')
+_CSS_PUNCT_RE = re.compile(r'\s*([{};,>])\s*')
+_CSS_COLON_RE = re.compile(r':\s+')
+
+# После этих символов и слов '/' начинает регулярное выражение, а не деление
+_JS_REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^')
+_JS_REGEX_KEYWORDS = {
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw', 'yield', 'await',
+}
+_JS_WORD_RE = re.compile(r'[\w$]+$')
+
+
+class BundleError(ValueError):
+    pass
+
+
+def extract(text):
+    """HTML блока -> (css, js); кроме <style>/<script> допустимы пробелы и комментарии"""
+    css, js = [], []
+    leftover = _BLOCK_RE.sub('', text)
+    if _LEFTOVER_RE.sub('', leftover):
+        raise BundleError('в блоке bundle допустимы только <style> и встроенные <script>')
+    for match in _BLOCK_RE.finditer(text):
+        (css if match.group(1).lower() == 'style' else js).append(match.group(2).strip())
+    return '\n'.join(css), ';\n'.join(js)
+
+
+def digest(source):
+    return hashlib.sha1(source.encode()).hexdigest()[:16]
+
+
+def minify_css(css):
+    css = _CSS_COMMENT_RE.sub('', css)
+    css = _CSS_SPACE_RE.sub(' ', css)
+    css = _CSS_PUNCT_RE.sub(r'\1', css)
+    # Только после двоеточия: пробел перед ним в селекторе значим (a :hover)
+    css = _CSS_COLON_RE.sub(':', css)
+    return css.replace(';}', '}').strip()
+
+
+def _js_line_modes(js):
+    """
+    Для каждой строки js: (начинается в коде, заканчивается в коде)
+
+    Лексер знает ровно столько, чтобы отличить код от содержимого строк,
+    шаблонных строк (с вложенными ${…}), регулярных выражений и
+    комментариев /* */: строка, начатая или оконченная внутри них, не
+    трогается минификацией.
+    """
+    # Стек режимов: 'code' (с глубиной фигурных скобок), кавычка, '`', '/*', '//', 'regex'
+    stack = [['code', 0]]
+    modes = []
+    line_starts_in_code = True
+    previous = ''  # код до текущего символа без пробелов в конце — для различения '/' и регулярки
+    in_class = False
+    i, length = 0, len(js)
+    while i < length:
+        char = js[i]
+        mode = stack[-1][0]
+        if char == '\n':
+            if mode in ('//', "'", '"', 'regex'):
+                stack.pop()  # кавычка и регулярка без пары — ошибка в исходнике, не наша забота
+            modes.append((line_starts_in_code, stack[-1][0] == 'code' and mode != "'" and mode != '"'))
+            line_starts_in_code = stack[-1][0] == 'code'
+            i += 1
+            continue
+        pair = js[i:i + 2]
+        if mode == 'code':
+            if pair == '//':
+                stack.append(['//', 0])
+                i += 2
+                continue
+            if pair == '/*':
+                stack.append(['/*', 0])
+                i += 2
+                continue
+            if char == '/':
+                stripped = previous.rstrip()
+                word = _JS_WORD_RE.search(stripped)
+                if not stripped or stripped[-1] in _JS_REGEX_AFTER or (word and word.group() in _JS_REGEX_KEYWORDS):
+                    stack.append(['regex', 0])
+                    in_class = False
+            elif char in '\'"`':
+                stack.append([char, 0])
+            elif char == '{':
+                stack[-1][1] += 1
+            elif char == '}':
+                if stack[-1][1] == 0 and len(stack) > 1:
+                    stack.pop()  # конец ${…} — обратно в шаблонную строку
+                else:
+                    stack[-1][1] -= 1
+            previous = previous[-32:] + char
+        elif mode == '/*':
+            if pair == '*/':
+                stack.pop()
+                i += 2
+                continue
+        elif mode == '//':
+            pass
+        elif char == '\\':
+            i += 2  # экранированный символ, в том числе перевод строки
+            if js[i - 1:i] == '\n':
+                modes.append((line_starts_in_code, False))
+                line_starts_in_code = False
+            continue
+        elif mode == 'regex':
+            if char == '[':
+                in_class = True
+            elif char == ']':
+                in_class = False
+            elif char == '/' and not in_class:
+                stack.pop()
+                previous = 'x'  # после регулярки '/' — деление
+        elif mode == '`' and pair == '${':
+            stack.append(['code', 0])
+            previous = '{'
+            i += 2
+            continue
+        elif char == mode:
+            stack.pop()
+            previous = 'x'  # после строки '/' — деление
+        i += 1
+    modes.append((line_starts_in_code, stack[-1][0] in ('code', '//')))
+    return modes
+
+
+def minify_js(js):
+    """
+    Безопасная минификация без разбора JS: отступы, пустые строки и
+    строки-комментарии. Переводы строк сохраняются, поэтому автоподстановка
+    точек с запятой работает как в исходнике. Содержимое строк, шаблонных
+    строк и комментариев /* */ не меняется (см. _js_line_modes).
+    """
+    js = js.replace('\r\n', '\n')
+    lines = []
+    for line, (starts_in_code, ends_in_code) in zip(js.split('\n'), _js_line_modes(js)):
+        if starts_in_code:
+            line = line.lstrip()
+            if not line or line.startswith('//'):
+                continue
+        if ends_in_code:
+            line = line.rstrip()
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def bundle_path(name, kind):
+    return f'{BUNDLES_DIR}/{name}.{kind}'
+
+
+def header(source_digest):
+    return f'/*! bundle {source_digest} */\n'
+
+
+def render(source, kind):
+    """Содержимое файла бандла: строка с хешем исходника и минифицированный код"""
+    minify = minify_css if kind == 'css' else minify_js
+    return header(digest(source)) + minify(source) + '\n'
+
+
+def _read_header(path):
+    if staticfiles_storage.exists(path):
+        with staticfiles_storage.open(path) as fh:
+            return fh.readline().decode()
+    found = finders.find(path)
+    if found:
+        with open(found, encoding='utf-8') as fh:
+            return fh.readline()
+    return ''
+
+
+def is_built(name, kind, source):
+    """Собран ли бандл из этой версии исходника (проверяется один раз при компиляции шаблона)"""
+    if not source:
+        return False
+    return _read_header(bundle_path(name, kind)) == header(digest(source))
+
+
+# ============================================
+# Сборка (build_bundles) и проверка перед collectstatic
+# ============================================
+
+def output_dir():
+    """Каталог собранных бандлов среди исходной статики"""
+    return Path(settings.STATICFILES_DIRS[0]) / BUNDLES_DIR
+
+
+def _templates(engine):
+    """Имена шаблонов, в которых есть {% bundle %}"""
+    for directory in [*engine.dirs, *get_app_template_dirs('templates')]:
+        directory = Path(directory)
+        for path in sorted(directory.rglob('*.html')):
+            if '{% bundle' in path.read_text(encoding='utf-8'):
+                yield path.relative_to(directory).as_posix()
+
+
+def collect_sources():
+    """{(имя, 'css'|'js'): (исходник, шаблон)} по всем шаблонам"""
+    from .templatetags.shop_bundles import BundleNode
+
+    engine = Engine.get_default()
+    sources = {}
+    for template_name in _templates(engine):
+        template = engine.get_template(template_name)
+        for node in template.nodelist.get_nodes_by_type(BundleNode):
+            for kind, source in (('css', node.css), ('js', node.js)):
+                if not source:
+                    continue
+                key = (node.name, kind)
+                if key in sources and sources[key] != (source, template_name):
+                    raise BundleError(
+                        f'{kind} бандла "{node.name}" описан в нескольких блоках '
+                        f'({sources[key][1]}, {template_name})'
+                    )
+                sources[key] = (source, template_name)
+    return sources
+
+
+def expected_files(sources):
+    """{путь бандла: (содержимое файла, байт исходника, шаблон)}"""
+    return {
+        bundle_path(name, kind): (render(source, kind), len(source.encode()), template_name)
+        for (name, kind), (source, template_name) in sorted(sources.items())
+    }
+
+
+def outdated(expected):
+    """Пути бандлов, которых нет в каталоге сборки или которые собраны из другой версии"""
+    result = []
+    for path, (content, _, _) in expected.items():
+        target = output_dir().parent / path
+        if not target.exists() or target.read_text(encoding='utf-8') != content:
+            result.append(path)
+    return result
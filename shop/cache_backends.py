@@ -0,0 +1,363 @@
+# shop/cache_backends.py
+"""
+Двухуровневый кеш для нескольких воркеров gunicorn
+
+TwoTierCache — бэкенд CACHES['default']: L1 в памяти процесса (LRU с
+вытеснением по числу записей и суммарному размеру) перед общим для всех
+воркеров L2 — любым бэкендом Django из CACHES (LOCATION — его алиас):
+SQLiteCache в файле рядом с проектом или Redis, если он есть. Один воркер
+посчитал каталог — остальные берут его из L2, а горячие ключи вроде
+company_info читаются из памяти процесса без обращения к L2.
+
+Неизменяемые значения (числа, строки, байты, кортежи из них, frozen
+dataclass — DTO, упакованные DTO, страницы из кеша страниц) L1 хранит
+готовыми объектами и отдаёт без копирования. Изменяемые (словари,
+списки, экземпляры моделей) — в pickle, и каждое чтение получает свою
+копию, как у LocMemCache.
+
+Запись идёт в L2 и в L1 (write-through). Рядом со значением в L2 лежит
+штамп записи — случайный идентификатор версии значения — отдельным
+маленьким ключем <ключ>:stamp. Запись L1 считается проверенной
+REVALIDATE_AFTER секунд; после этого L1 читает из L2 только штамп и, если
+значение никто не перезаписал, продолжает отдавать своё. Удаления и
+очистки из шины инвалидации (shop/cache_bus.py) сбрасывают L1 сразу:
+общий L2 очистил процесс, опубликовавший инвалидацию, остальные вызывают
+только forget().
+"""
+import dataclasses
+import datetime
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# L1 по алиасу L2: общий для всех потоков процесса (Django создаёт
+# экземпляр бэкенда на поток, как и LocMemCache хранит данные вне экземпляра)
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+_IMMUTABLE_TYPES = (
+    type(None), bool, int, float, complex, str, bytes, Decimal,
+    datetime.date, datetime.time, datetime.timedelta,
+)
+
+
+def is_immutable(value):
+    """Значение нельзя изменить на месте: его можно отдавать всем читателям без копии"""
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return True
+    if isinstance(value, (tuple, frozenset)):
+        return all(is_immutable(item) for item in value)
+    params = getattr(type(value), '__dataclass_params__', None)
+    if params is not None and params.frozen:
+        return all(is_immutable(getattr(value, field.name)) for field in dataclasses.fields(value))
+    return False
+
+
+class _Entry:
+    """Запись L1: value — готовый неизменяемый объект или pickled — копия изменяемого"""
+
+    __slots__ = ('value', 'pickled', 'size', 'stamp', 'expires', 'written', 'checked')
+
+    def __init__(self, value, pickled, stamp, expires, written, checked):
+        if is_immutable(value):
+            self.value, self.pickled = value, None
+        else:
+            self.value, self.pickled = None, pickled
+        self.size = len(pickled)
+        self.stamp = stamp
+        self.expires = expires
+        self.written = written
+        self.checked = checked
+
+    def load(self):
+        return self.value if self.pickled is None else pickle.loads(self.pickled)
+
+
+class _LocalTier:
+    """L1: LRU в памяти процесса по полному ключу; размер записи — длина её pickle"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, full_key, now):
+        """Запись или None; истёкшая удаляется, найденная становится самой свежей"""
+        with self.lock:
+            entry = self.entries.get(full_key)
+            if entry is None:
+                return None
+            if entry.expires is not None and entry.expires <= now:
+                self._pop(full_key)
+                return None
+            self.entries.move_to_end(full_key)
+            return entry
+
+    def put(self, full_key, entry):
+        with self.lock:
+            self._pop(full_key)
+            if entry.size > self.max_bytes:
+                return  # больше всего L1: такое значение читается из L2
+            self.entries[full_key] = entry
+            self.size += entry.size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def discard(self, full_key):
+        with self.lock:
+            self._pop(full_key)
+
+    def _pop(self, full_key):
+        entry = self.entries.pop(full_key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def snapshot(self):
+        """[(полный ключ, байты, истекает, записано)] — для сводки кеша (shop/cache_inspect.py)"""
+        with self.lock:
+            return [
+                (full_key, entry.size, entry.expires, entry.written) for full_key, entry in self.entries.items()
+            ]
+
+
+def _new_stamp():
+    return os.urandom(8).hex()
+
+
+# Суффикс ключа штампа рядом со значением в L2
+STAMP_SUFFIX = ':stamp'
+
+
+def _stamp_key(key):
+    return f'{key}{STAMP_SUFFIX}'
+
+
+class TwoTierCache(BaseCache):
+    """
+    L1 в памяти процесса перед общим L2
+
+    LOCATION — алиас L2 в CACHES. OPTIONS: MAX_ENTRIES и MAX_BYTES — предел
+    L1 по числу записей и по суммарному размеру значений в pickle,
+    REVALIDATE_AFTER — через сколько секунд запись L1 сверяется с L2.
+    В L2 значение хранится как (штамп, истекает, время записи, pickle).
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._revalidate_after = float(options.get('REVALIDATE_AFTER', 5))
+        with _local_tiers_lock:
+            self._local = _local_tiers.setdefault(
+                location, _LocalTier(self._max_entries, int(options.get('MAX_BYTES', 32 * 1024 * 1024)))
+            )
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get(self, key, default=None, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        entry = self._local.get(full_key, now)
+        if entry is not None:
+            if now - entry.checked < self._revalidate_after:
+                return entry.load()
+            # Значение в L2 то же: L1 снова верит своей копии
+            if self.shared.get(_stamp_key(key), version=version) == entry.stamp:
+                entry.checked = now
+                return entry.load()
+
+        stored = self.shared.get(key, None, version=version)
+        if stored is None:
+            self._local.discard(full_key)
+            return default
+        stamp, expires, written, pickled = stored
+        value = pickle.loads(pickled)
+        self._local.put(full_key, _Entry(value, pickled, stamp, expires, written, now))
+        return value
+
+    def _store(self, key, value, timeout, version, add=False):
+        full_key = self.make_and_validate_key(key, version=version)
+        timeout = self._timeout(timeout)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        stamp, expires, now = _new_stamp(), self.get_backend_timeout(timeout), time.time()
+        stored = (stamp, expires, now, pickled)
+        if add:
+            # Атомарность — за L2: на cache.add() держатся блокировки cache_fetch во всех воркерах
+            if not self.shared.add(key, stored, timeout, version=version):
+                return False
+            self.shared.set(_stamp_key(key), stamp, timeout, version=version)
+        else:
+            self.shared.set_many({key: stored, _stamp_key(key): stamp}, timeout, version=version)
+        self._local.put(full_key, _Entry(value, pickled, stamp, expires, now, now))
+        return True
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, add=True)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local.discard(self.make_and_validate_key(key, version=version))
+        timeout = self._timeout(timeout)
+        self.shared.touch(_stamp_key(key), timeout, version=version)
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._local.discard(self.make_and_validate_key(key, version=version))
+        deleted = self.shared.delete(key, version=version)
+        self.shared.delete(_stamp_key(key), version=version)
+        return deleted
+
+    def clear(self):
+        self._local.clear()
+        self.shared.clear()
+
+    def forget(self, key, version=None):
+        """Сбросить ключ только в L1 текущего процесса"""
+        self._local.discard(self.make_and_validate_key(key, version=version))
+
+    def forget_all(self):
+        """Очистить L1 текущего процесса, не трогая L2"""
+        self._local.clear()
+
+    def entries(self):
+        """Записи L1: [(полный ключ, байты, истекает, записано)]"""
+        return self._local.snapshot()
+
+
+class SQLiteCache(BaseCache):
+    """
+    Кеш в файле SQLite (LOCATION — путь): общий L2 для воркеров одной
+    машины без Redis
+
+    Файл в режиме WAL: чтения не ждут записи. Просроченные записи при
+    чтении не удаляются (чтение не пишет в файл) — их убирает прореживание
+    раз в CULL_EVERY записей, когда файл превысил MAX_ENTRIES.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL,
+        written REAL
+    );
+    CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires);
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = str(location)
+        self._cull_every = int(params.get('OPTIONS', {}).get('CULL_EVERY', 100))
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        """Соединение с файлом кеша (отдельное на поток, пересоздаётся после fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            # В WAL без fsync на каждую запись; потеря хвоста кеша при сбое питания не страшна
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.executescript(self._SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(cache_entries)')}
+            if 'written' not in columns:  # файл от прежней версии
+                conn.execute('ALTER TABLE cache_entries ADD COLUMN written REAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT value FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def _written(self, conn):
+        self._writes += 1
+        if self._writes % self._cull_every == 0:
+            self._cull(conn)
+
+    def _cull(self, conn):
+        conn.execute('DELETE FROM cache_entries WHERE expires <= ?', (time.time(),))
+        (count,) = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()
+        if count > self._max_entries:
+            # Как LocMemCache: удаляется 1/CULL_FREQUENCY записей — те, что истекают раньше
+            conn.execute(
+                'DELETE FROM cache_entries WHERE key IN '
+                '(SELECT key FROM cache_entries ORDER BY expires IS NULL, expires LIMIT ?)',
+                (max(1, count // self._cull_frequency) if self._cull_frequency else count,),
+            )
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        conn.execute(
+            'INSERT INTO cache_entries (key, value, expires, written) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires, '
+            'written = excluded.written',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout), time.time()),
+        )
+        self._written(conn)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        # Одна инструкция: вставка или замена только просроченной записи — атомарно между процессами
+        now = time.time()
+        cursor = conn.execute(
+            'INSERT INTO cache_entries (key, value, expires, written) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires, '
+            'written = excluded.written '
+            'WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout), now, now),
+        )
+        if cursor.rowcount:
+            self._written(conn)
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute(
+            'UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache_entries')
+
+    def entries(self):
+        """Записи файла: [(полный ключ, байты, истекает, записано)]"""
+        return self._connection().execute(
+            'SELECT key, length(value), expires, written FROM cache_entries'
+        ).fetchall()
@@ -0,0 +1,255 @@
+# shop/cache_bus.py
+"""
+Межпроцессная шина инвалидации кеша
+
+LocMemCache живёт внутри одного процесса gunicorn: cache.delete() в воркере,
+обработавшем сохранение в админке, не затрагивает остальные воркеры.
+Шина хранит таблицу поколений ключей в отдельном файле SQLite (без Redis):
+публикация повышает поколение ключа, а каждый воркер перед обработкой
+запроса сверяет свой водяной знак с таблицей и удаляет у себя устаревшие
+ключи (см. CacheInvalidationMiddleware).
+
+Ключ с '*' на конце задаёт семейство ('product_detail_*'). Семейство не
+удаляется поштучно: его поколение становится версией (параметр version
+Django cache) для всех ключей с этим префиксом, поэтому после инвалидации
+старые записи просто перестают читаться. Значение семейства в кеше нужно
+читать и писать с версией version_for(key). Полная очистка (ALL_KEYS)
+повышает версию всех ключей так же, как семейство с пустым префиксом.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Специальный ключ: очистить кеш целиком во всех воркерах
+ALL_KEYS = '*'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_generations (
+    key TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_generations_generation
+    ON cache_generations (generation);
+"""
+
+_local = threading.local()
+_lock = threading.Lock()
+# Водяной знак процесса: последнее применённое поколение
+_watermark = None
+# Поколения семейств ключей и всего кеша, известные процессу: {'product_detail_*': 12, '*': 15}
+_families = {}
+# Функции callback(keys), вызываемые после применения инвалидации (см. subscribe)
+_subscribers = []
+# Пересчёты значений, идущие в процессе (см. watch); свой замок — _apply_locally
+# вызывается и под _lock из sync()
+_watches = set()
+_watches_lock = threading.Lock()
+
+
+def _bus_path():
+    return str(getattr(settings, 'CACHE_BUS_PATH', settings.BASE_DIR / 'cache_bus.sqlite3'))
+
+
+def _connection():
+    """Соединение с файлом шины (отдельное на поток, пересоздаётся после fork и смены пути)"""
+    path = _bus_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.path != path:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = path
+    return conn
+
+
+def is_family(key):
+    return key.endswith('*') and key != ALL_KEYS
+
+
+def _versioned(key):
+    """Поколение ключа становится версией: семейство или ALL_KEYS (префикс '')"""
+    return key.endswith('*')
+
+
+def version_for(key):
+    """Версия кеша для ключа с учётом поколения его семейства (None — по умолчанию)"""
+    # Из подходящих семейств ('product_*' и 'product_detail_*') действует
+    # сброшенное последним: поколения только растут
+    generations = [generation for pattern, generation in _families.items() if key.startswith(pattern[:-1])]
+    # +1: версия по умолчанию в Django равна 1, первое поколение должно от неё отличаться
+    return max(generations) + 1 if generations else None
+
+
+def _matches(key, pattern):
+    return pattern == key or pattern == ALL_KEYS or (is_family(pattern) and key.startswith(pattern[:-1]))
+
+
+class Watch:
+    """Наблюдение за ключом на время пересчёта: invalidated — ключ сброшен"""
+
+    __slots__ = ('key', 'invalidated')
+
+    def __init__(self, key):
+        self.key = key
+        self.invalidated = False
+
+
+@contextmanager
+def watch(key):
+    """
+    Отметить, сбрасывался ли key, пока пересчитывается его значение
+
+    Значение, посчитанное по данным до коммита, не должно попасть в кеш
+    после инвалидации этого коммита. Перед записью нужно вызвать sync():
+    инвалидации других процессов применяются только при сверке с шиной.
+
+    Использование:
+    with watch(key) as watched:
+        value = compute()
+        sync()
+        if not watched.invalidated:
+            cache.set(key, value)
+    """
+    watched = Watch(key)
+    with _watches_lock:
+        _watches.add(watched)
+    try:
+        yield watched
+    finally:
+        with _watches_lock:
+            _watches.discard(watched)
+
+
+def subscribe(callback):
+    """Вызывать callback(keys) после каждой инвалидации, применённой в процессе (своей и из шины)"""
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+
+
+def _apply_locally(keys, published=True):
+    """
+    published=False — инвалидация пришла из шины. Общий уровень кеша
+    (shop/cache_backends.py) уже очистил опубликовавший её процесс, здесь
+    достаточно сбросить локальную копию: иначе каждый воркер стирал бы из
+    общего кеша значения, пересчитанные после инвалидации.
+    """
+    with _watches_lock:
+        for watched in _watches:
+            if any(_matches(watched.key, key) for key in keys):
+                watched.invalidated = True
+    local_only = not published and hasattr(cache, 'forget')
+    if ALL_KEYS in keys:
+        cache.forget_all() if local_only else cache.clear()
+    else:
+        drop = cache.forget if local_only else cache.delete
+        for key in keys:
+            if not is_family(key):
+                drop(key, version=version_for(key))
+    for callback in _subscribers:
+        try:
+            callback(keys)
+        except Exception:
+            logger.exception('Ошибка обработчика инвалидации %r', callback)
+
+
+def invalidate(keys):
+    """
+    Удалить ключи в текущем процессе и разослать инвалидацию остальным
+
+    Использование:
+    invalidate(['products_catalog', f'product_detail_{pk}'])
+    invalidate(['product_detail_*'])  # всё семейство
+    invalidate([ALL_KEYS])  # полная очистка во всех воркерах
+    """
+    global _watermark
+
+    keys = sorted(set(keys))
+    if not keys:
+        return
+
+    try:
+        conn = _connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            (current,) = conn.execute(
+                'SELECT COALESCE(MAX(generation), 0) FROM cache_generations'
+            ).fetchone()
+            conn.executemany(
+                'INSERT INTO cache_generations (key, generation) VALUES (?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET generation = excluded.generation',
+                [(key, current + 1) for key in keys],
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error:
+        # Локальный кеш всё равно очищаем, остальные воркеры догонят по TTL
+        logger.warning('Не удалось опубликовать инвалидацию %s', keys, exc_info=True)
+        families = [key for key in keys if is_family(key)]
+        if families:
+            cache.clear()
+    else:
+        with _lock:
+            for key in keys:
+                if _versioned(key):
+                    _families[key] = current + 1
+            # Своя публикация уже применена ниже. Водяной знак двигаем, только
+            # если процесс видел все поколения до неё: иначе sync() пропустил бы
+            # чужие инвалидации, опубликованные между ними
+            if _watermark == current:
+                _watermark = current + 1
+
+    _apply_locally(keys)
+
+
+def sync():
+    """
+    Применить в текущем процессе инвалидации, опубликованные другими процессами
+
+    Вызывается перед каждым запросом. Если в шине нет поколений новее
+    водяного знака, обходится одним чтением MAX(generation) по индексу.
+    Отпечаток файла (mtime, размер) для этого не годится: запись того же
+    размера в пределах одного тика mtime его не меняет.
+    """
+    global _watermark
+
+    with _lock:
+        try:
+            conn = _connection()
+            (latest,) = conn.execute(
+                'SELECT COALESCE(MAX(generation), 0) FROM cache_generations'
+            ).fetchone()
+            if _watermark is None:
+                # Свежий процесс: локальный кеш пуст, нужны только поколения семейств
+                rows = conn.execute(
+                    "SELECT key, generation FROM cache_generations WHERE key LIKE '%*'"
+                ).fetchall()
+                _families.update((key, gen) for key, gen in rows if _versioned(key))
+                _watermark = latest
+                return
+            if latest <= _watermark:
+                return
+            rows = conn.execute(
+                'SELECT key, generation FROM cache_generations WHERE generation > ?',
+                (_watermark,),
+            ).fetchall()
+        except sqlite3.Error:
+            logger.warning('Не удалось прочитать шину инвалидации кеша', exc_info=True)
+            return
+
+        if not rows:
+            return
+        for key, generation in rows:
+            if _versioned(key):
+                _families[key] = generation
+        _apply_locally([key for key, _ in rows], published=False)
+        _watermark = max(generation for _, generation in rows)
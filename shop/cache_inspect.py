@@ -0,0 +1,204 @@
+# shop/cache_inspect.py
+"""
+Содержимое кеша воркеров: семейства ключей, число записей, размер и возраст
+
+LocMemCache у каждого воркера свой, и manage.py, запущенный рядом с
+gunicorn, видит только собственный пустой кеш. Поэтому отчёт запрашивается
+через шину инвалидации: команда публикует ключ REPORT_KEY, каждый воркер,
+применив его (cache_bus.sync — перед запросом или в потоке прогрева раз в
+CACHE_WARMUP_INTERVAL секунд), записывает сводку своего кеша в таблицу
+cache_reports того же файла SQLite, а команда собирает сводки, пришедшие
+после запроса (manage.py clear_cache stats). У двухуровневого кеша
+(shop/cache_backends.py) воркер сообщает о своём L1, а общий L2 команда
+читает сама (shared_inventory).
+
+Возраст записей — по времени записи, которое хранят бэкенды из
+shop/cache_backends.py; у LocMemCache его нет, и возраст не выводится.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+from . import cache_bus, metrics
+from .cache_backends import STAMP_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# Ключ-сигнал в шине: воркерам прислать сводку своего кеша
+REPORT_KEY = 'cache_report'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_reports (
+    pid INTEGER PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+_local = threading.local()
+
+
+def _split_key(full_key, key_prefix):
+    """'prefix:3:page:…' -> ('page:…', 3) для функции ключа Django по умолчанию"""
+    prefix = f'{key_prefix}:'
+    if not full_key.startswith(prefix):
+        return full_key, None
+    version, _, key = full_key[len(prefix):].partition(':')
+    try:
+        return key, int(version)
+    except ValueError:
+        return full_key, None
+
+
+def _entries(backend):
+    """[(полный ключ, байты, истекает, записано)] или None, если бэкенд не даёт перечислить записи"""
+    if hasattr(backend, 'entries'):
+        return backend.entries()  # shop/cache_backends.py: L1 или файл SQLite
+    store = getattr(backend, '_cache', None)
+    expire_info = getattr(backend, '_expire_info', None)
+    if store is None or expire_info is None:
+        return None
+    with backend._lock:
+        return [(full_key, len(pickled), expire_info.get(full_key), None) for full_key, pickled in store.items()]
+
+
+def inventory(backend=None):
+    """
+    Сводка кеша backend (по умолчанию — кеша текущего процесса) по семействам
+    ключей (None — бэкенд не даёт перечислить записи)
+
+    {семейство: {'entries': n, 'bytes': n, 'dead': n, 'oldest': t, 'newest': t}}
+    dead — записи с истёкшим сроком или с версией, устаревшей после
+    инвалидации семейства: их уже не прочитать, но место они занимают до
+    вытеснения. oldest/newest — время записи самой старой и самой свежей
+    живой записи (None, если бэкенд не хранит время записи).
+    """
+    backend = caches[DEFAULT_CACHE_ALIAS] if backend is None else backend
+    items = _entries(backend)
+    if items is None:
+        return None
+
+    now = time.time()
+    families = {}
+    for full_key, size, expires_at, written in items:
+        key, version = _split_key(full_key, backend.key_prefix)
+        stamp = key.endswith(STAMP_SUFFIX)
+        if stamp:
+            key = key[:-len(STAMP_SUFFIX)]
+        stats = families.setdefault(metrics.key_family(key), {
+            'entries': 0, 'bytes': 0, 'dead': 0, 'oldest': None, 'newest': None,
+        })
+        stats['bytes'] += size
+        if stamp:
+            continue  # штамп записи двухуровневого кеша: место занимает, записью не считается
+        stats['entries'] += 1
+        expired = expires_at is not None and expires_at <= now
+        if expired or version != (cache_bus.version_for(key) or backend.version):
+            stats['dead'] += 1
+            continue
+        if written is not None:
+            stats['oldest'] = written if stats['oldest'] is None else min(stats['oldest'], written)
+            stats['newest'] = written if stats['newest'] is None else max(stats['newest'], written)
+    return families
+
+
+def shared_inventory():
+    """(имя бэкенда, сводка) общего уровня двухуровневого кеша или None без него"""
+    shared = getattr(caches[DEFAULT_CACHE_ALIAS], 'shared', None)
+    if shared is None:
+        return None
+    return type(shared).__name__, inventory(shared)
+
+
+def merge(reports):
+    """Сводки нескольких процессов -> одна сводка по семействам"""
+    total = {}
+    for report in reports:
+        for family, stats in (report.get('families') or {}).items():
+            merged = total.setdefault(family, {'entries': 0, 'bytes': 0, 'dead': 0, 'oldest': None, 'newest': None})
+            for field in ('entries', 'bytes', 'dead'):
+                merged[field] += stats[field]
+            for field, pick in (('oldest', min), ('newest', max)):
+                if stats[field] is not None:
+                    merged[field] = stats[field] if merged[field] is None else pick(merged[field], stats[field])
+    return total
+
+
+def hit_counts():
+    """Обращения к кешу по семействам во всех процессах: {семейство: {'hit': n, 'stale': n, 'miss': n}}"""
+    counts = {}
+    for (family, result), count in metrics.collect()[metrics.cache_requests.name].items():
+        counts.setdefault(family, {'hit': 0, 'stale': 0, 'miss': 0})[result] += count
+    return counts
+
+
+# ============================================
+# Отчёты воркеров
+# ============================================
+
+def _reports_path():
+    return str(getattr(settings, 'CACHE_BUS_PATH', settings.BASE_DIR / 'cache_bus.sqlite3'))
+
+
+def _connection():
+    """Соединение с файлом шины (отдельное на поток, пересоздаётся после fork и смены пути)"""
+    path = _reports_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.path != path:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = path
+    return conn
+
+
+def report():
+    """Сводка кеша текущего процесса в виде, пригодном для JSON"""
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    return {
+        'backend': type(backend).__name__,
+        'max_entries': getattr(backend, '_max_entries', None),
+        'families': inventory(),
+    }
+
+
+def _on_invalidate(keys):
+    if REPORT_KEY not in keys:
+        return
+    try:
+        _connection().execute(
+            'INSERT INTO cache_reports (pid, updated_at, data) VALUES (?, ?, ?) '
+            'ON CONFLICT(pid) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data',
+            (os.getpid(), time.time(), json.dumps(report())),
+        )
+    except sqlite3.Error:
+        logger.warning('Не удалось записать сводку кеша', exc_info=True)
+
+
+def enable_reports():
+    """Отвечать на запросы сводки кеша (вызывается в воркере, banyana_fresh/wsgi.py)"""
+    cache_bus.subscribe(_on_invalidate)
+
+
+def request_reports(wait):
+    """
+    Попросить все воркеры прислать сводку кеша и собрать ответы: {pid: сводка}
+
+    Воркер отвечает, когда сверяется с шиной: при следующем запросе
+    посетителя или в фоновом потоке прогрева, поэтому wait должен быть
+    больше CACHE_WARMUP_INTERVAL.
+    """
+    requested = time.time()
+    cache_bus.invalidate([REPORT_KEY])
+    time.sleep(wait)
+    rows = _connection().execute(
+        'SELECT pid, data FROM cache_reports WHERE updated_at >= ? ORDER BY pid', (requested,)
+    ).fetchall()
+    return {pid: json.loads(data) for pid, data in rows}
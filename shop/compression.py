@@ -0,0 +1,148 @@
+# shop/compression.py
+"""
+Сжатие HTML-ответов: gzip и Brotli (если установлен пакет brotli)
+
+Страница из кеша (shop/page_cache.py) хранит статичные куски тела уже
+сжатыми в raw deflate с полным сбросом (Z_FULL_FLUSH): такие куски не
+ссылаются друг на друга и склеиваются в один поток. При отдаче сжимаются
+только персональные фрагменты (CSRF-токен, дыры) — сотни байт вместо
+сотни килобайт, — а заголовок и CRC32 gzip собираются вокруг склейки.
+Страница без персональных фрагментов хранит и готовый Brotli.
+
+Остальные ответы сжимаются целиком в памяти и сохраняют Content-Length;
+потоковые и очень большие (больше STREAM_THRESHOLD) — по мере отдачи.
+"""
+import struct
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Brotli необязателен: без него только gzip
+    brotli = None
+
+# Статичные куски сжимаются один раз на запись кеша — можно не экономить
+PRECOMPRESS_LEVEL = 9
+# Но Brotli страницы из кеша считается в потоке запроса, заполнившего кеш:
+# качество 11 в десятки раз медленнее 5 при выигрыше в несколько процентов.
+# Максимальное качество — только при сборке статики (collectstatic, WhiteNoise)
+BROTLI_PRECOMPRESS_QUALITY = 5
+# Сжатие на каждый запрос
+STREAM_LEVEL = 6
+BROTLI_STREAM_QUALITY = 5
+STREAM_CHUNK = 64 * 1024
+# Обычный ответ больше этого сжимается потоково: клиент получает начало раньше
+STREAM_THRESHOLD = 1024 * 1024
+
+_GZIP_FINAL_BLOCK = b'\x03\x00'  # пустой последний блок deflate
+
+
+def encoded_etag(etag, encoding):
+    """
+    Строгий ETag сжатого варианта: '"abc"' -> '"abc-gzip"'
+
+    Строгий валидатор различает представления, а сжатое тело побайтно
+    другое — поэтому у каждого варианта свой ETag, а не слабый общий.
+    """
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def base_etag(etag):
+    """ETag без суффикса кодировки: '"abc-br"' -> '"abc"'"""
+    for encoding in ('br', 'gzip'):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def negotiate(accept_encoding, offered):
+    """
+    Лучшая из offered кодировок, которую принимает клиент, или None
+
+    offered — в порядке предпочтения сервера; q=0 означает запрет.
+    """
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    best, best_quality = None, 0.0
+    for encoding in offered:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def deflate_segment(data, level=PRECOMPRESS_LEVEL):
+    """Кусок raw deflate, который можно склеивать с другими такими же"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+def gzip_join(pieces):
+    """
+    gzip-поток из кусков (сырые_байты, сжатые_байты или None)
+
+    Куски без готового сжатия (персональные фрагменты) сжимаются здесь же.
+    """
+    body = []
+    crc = 0
+    size = 0
+    for raw, deflated in pieces:
+        crc = zlib.crc32(raw, crc)
+        size += len(raw)
+        body.append(deflated if deflated is not None else deflate_segment(raw, STREAM_LEVEL))
+    header = b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\xff'
+    trailer = struct.pack('<II', crc, size & 0xFFFFFFFF)
+    return b''.join([header, *body, _GZIP_FINAL_BLOCK, trailer])
+
+
+def brotli_compress(data):
+    return brotli.compress(data, quality=BROTLI_PRECOMPRESS_QUALITY)
+
+
+def compress(data, encoding):
+    """Сжать тело ответа целиком (для ответа с Content-Length)"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_STREAM_QUALITY)
+    compressor = zlib.compressobj(STREAM_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _chunks(data):
+    for start in range(0, len(data), STREAM_CHUNK):
+        yield data[start:start + STREAM_CHUNK]
+
+
+def compress_stream(chunks, encoding):
+    """Потоковое сжатие: каждый кусок уходит клиенту сразу после сжатия"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_STREAM_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(STREAM_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_content(content, encoding):
+    return compress_stream(_chunks(content), encoding)
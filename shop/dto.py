@@ -0,0 +1,215 @@
+# shop/dto.py
+"""
+Компактные модели представления для кеша
+
+В кеш кладутся не экземпляры моделей с _state и кешами prefetch, а
+неизменяемые DTO только с теми полями, которые читают шаблоны. Для хранения
+они упаковываются pack() в marshal-байты: DTO -> список [код_типа, поля...],
+кортежи и словари остаются собой. Поля DTO не должны быть списками.
+"""
+import marshal
+from dataclasses import dataclass, fields
+
+from .utils import format_price
+
+# Версия marshal фиксирована: байты читаются любым воркером того же Python
+_MARSHAL_VERSION = 4
+# Длина описания в карточке каталога (главная обрезает сильнее в шаблоне)
+CARD_EXCERPT_LENGTH = 150
+
+
+@dataclass(frozen=True, slots=True)
+class ImageDTO:
+    url: str
+
+
+@dataclass(frozen=True, slots=True)
+class PriceDTO:
+    id: int
+    name: str
+    price: int
+    description: str
+    total_length: str
+    steam_room_length: str
+    rest_room: str
+    height: str
+    width: str
+
+    @classmethod
+    def from_model(cls, price):
+        return cls(
+            id=price.pk,
+            name=price.name,
+            price=int(price.price),
+            description=price.description,
+            total_length=price.total_length,
+            steam_room_length=price.steam_room_length,
+            rest_room=price.rest_room,
+            height=price.height,
+            width=price.width,
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ProductDTO:
+    id: int
+    title: str
+    description: str
+    price: int
+    formatted_price: str
+    image_url: str
+    images: tuple
+    prices: tuple
+
+    @property
+    def pk(self):
+        return self.id
+
+    @classmethod
+    def from_model(cls, product):
+        """Из товара с prefetch_related('prices', 'images')"""
+        return cls(
+            id=product.pk,
+            title=product.title,
+            description=product.description,
+            price=int(product.price),
+            formatted_price=product.formatted_price,
+            image_url=product.image.url if product.image else '',
+            images=tuple(ImageDTO(image.image.url) for image in product.images.all()),
+            prices=tuple(PriceDTO.from_model(price) for price in product.prices.all()),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class OptionDTO:
+    id: int
+    name: str
+    category: str
+    price: int
+    formatted_price: str
+    description: str
+    image_url: str
+
+    @classmethod
+    def from_model(cls, option):
+        return cls(
+            id=option.pk,
+            name=option.name,
+            category=option.category,
+            price=int(option.price),
+            formatted_price=format_price(option.price),
+            description=option.description,
+            image_url=option.image.url if option.image else '',
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class PhotoDTO:
+    id: int
+    url: str
+
+    @classmethod
+    def from_model(cls, photo):
+        return cls(id=photo.pk, url=photo.image.url if photo.image else '')
+
+
+@dataclass(frozen=True, slots=True)
+class CardDTO:
+    """Карточка товара для каталога и главной: только то, что видно в списке"""
+    id: int
+    title: str
+    excerpt: str
+    image_url: str
+    base_price: int
+    from_price: int  # цена первого размера, без размеров — базовая; 0 — по запросу
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def formatted_price(self):
+        return format_price(self.base_price)
+
+    @property
+    def formatted_from_price(self):
+        return format_price(self.from_price)
+
+    @classmethod
+    def for_products(cls, queryset, limit=None):
+        """
+        Карточки товаров из queryset одним запросом
+
+        Обложка (первое фото галереи, если нет главного) и цена первого размера
+        берутся подзапросами, описание обрезается ещё в БД. Число запросов не
+        зависит от числа товаров.
+        """
+        from django.core.files.storage import default_storage
+        from django.db.models import OuterRef, Subquery
+        from django.db.models.functions import Substr
+        from django.utils.text import Truncator
+
+        from .models import ProductImage, ProductPrice
+
+        first_image = (
+            ProductImage.objects.filter(product=OuterRef('pk'))
+            .order_by('order', 'id').values('image')[:1]
+        )
+        first_price = (
+            ProductPrice.objects.filter(product=OuterRef('pk'))
+            .order_by('order', 'price', 'id').values('price')[:1]
+        )
+        rows = queryset.annotate(
+            cover=Subquery(first_image),
+            first_price=Subquery(first_price),
+            head=Substr('description', 1, CARD_EXCERPT_LENGTH + 1),
+        ).values_list('pk', 'title', 'head', 'image', 'cover', 'price', 'first_price')
+        if limit is not None:
+            rows = rows[:limit]
+        return tuple(
+            cls(
+                id=pk,
+                title=title,
+                excerpt=Truncator(head).chars(CARD_EXCERPT_LENGTH),
+                image_url=default_storage.url(image or cover) if image or cover else '',
+                base_price=int(price),
+                from_price=int(price if first_price is None else first_price),
+            )
+            for pk, title, head, image, cover, price, first_price in rows
+        )
+
+
+# Порядок задаёт коды типов в упакованных данных: новые типы — только в конец
+_TYPES = [ImageDTO, PriceDTO, ProductDTO, OptionDTO, PhotoDTO, CardDTO]
+_CODES = {cls: code for code, cls in enumerate(_TYPES)}
+_FIELDS = {cls: tuple(f.name for f in fields(cls)) for cls in _TYPES}
+
+
+def _encode(value):
+    code = _CODES.get(type(value))
+    if code is not None:
+        return [code, *(_encode(getattr(value, name)) for name in _FIELDS[type(value)])]
+    if isinstance(value, (tuple, list)):
+        return tuple(_encode(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return _TYPES[value[0]](*(_decode(item) for item in value[1:]))
+    if isinstance(value, tuple):
+        return tuple(_decode(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _decode(item) for key, item in value.items()}
+    return value
+
+
+def pack(value):
+    """DTO (или кортежи/словари из них) -> компактные байты для кеша"""
+    return marshal.dumps(_encode(value), _MARSHAL_VERSION)
+
+
+def unpack(data):
+    return _decode(marshal.loads(data))
@@ -0,0 +1,156 @@
+# shop/facets.py
+"""
+Фасетный фильтр каталога: длина бани, длина парной, цена
+
+Размеры в ProductPrice вводятся текстом («5.5», «2.2/2.25», «170/195»),
+поэтому при каждом сохранении размера они разбираются в числовые поля
+*_m (метры, см. parse_meters в shop/models.py). Фильтр — условия на эти поля и цену с
+индексами, а не разбор строк в Python. Товар подходит, если у него есть
+размер, подходящий под все выбранные условия сразу.
+
+Счётчики фасетов считаются одним агрегирующим запросом и хранятся в кеше
+по выбранным условиям (семейство catalog_facets:*). Семейство сбрасывается
+при изменении товаров и размеров (см. CACHE_DEPENDENCIES).
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db.models import Count, Q
+from django.utils.http import urlencode
+
+from .models import ProductPrice
+from .utils import cache_fetch, format_price, make_cache_key
+
+
+@dataclass(frozen=True)
+class Facet:
+    name: str  # параметр в адресе: ?length=4-5
+    label: str
+    field: str  # числовое поле ProductPrice
+    buckets: tuple  # ((от, до), ...): от включительно, до не включительно, None — без границы
+    unit: str = 'м'
+
+    def format(self, value):
+        return format_price(value) if self.unit == '₽' else f'{value:g} {self.unit}'
+
+    def bucket_for(self, slug):
+        """Диапазон по slug из адреса или None: принимаются только объявленные диапазоны"""
+        for bucket in self.buckets:
+            if bucket_slug(bucket) == slug:
+                return bucket
+        return None
+
+    def bucket_label(self, bucket):
+        low, high = bucket
+        if low is None:
+            return f'до {self.format(high)}'
+        if high is None:
+            return f'от {self.format(low)}'
+        return f'{low:g}–{self.format(high)}' if self.unit != '₽' else f'{self.format(low)} – {self.format(high)}'
+
+
+FACETS = (
+    Facet('length', 'Длина бани', 'length_m', ((None, 4), (4, 5), (5, 6), (6, None))),
+    Facet('steam', 'Длина парной', 'steam_room_m', ((None, 2), (2, Decimal('2.5')), (Decimal('2.5'), None))),
+    Facet(
+        'price', 'Цена', 'price',
+        ((None, 300000), (300000, 400000), (400000, 500000), (500000, None)), unit='₽',
+    ),
+)
+# Параметры адреса, от которых зависит страница каталога (ключ кеша страницы)
+PARAMS = tuple(facet.name for facet in FACETS)
+
+
+def bucket_slug(bucket):
+    low, high = bucket
+    return f'{"" if low is None else low}-{"" if high is None else high}'
+
+
+def parse_selection(params):
+    """
+    Выбранные диапазоны из GET: {'length': (4, 5), ...}
+
+    Значения, не совпадающие со slug объявленного диапазона (nan,
+    3.0001-7), пропускаются: иначе каждый такой адрес заводил бы свои
+    записи catalog_facets:* и page:* в кеше.
+    """
+    selection = {}
+    for facet in FACETS:
+        bucket = facet.bucket_for(params.get(facet.name))
+        if bucket is not None:
+            selection[facet.name] = bucket
+    return selection
+
+
+def _range_q(facet, bucket):
+    low, high = bucket
+    q = Q()
+    if low is not None:
+        q &= Q(**{f'{facet.field}__gte': low})
+    if high is not None:
+        q &= Q(**{f'{facet.field}__lt': high})
+    return q
+
+
+def _selection_q(selection, skip=None):
+    q = Q()
+    for facet in FACETS:
+        if facet.name in selection and facet.name != skip:
+            q &= _range_q(facet, selection[facet.name])
+    return q
+
+
+def matching_prices(selection):
+    """Размеры, подходящие под все выбранные условия"""
+    return ProductPrice.objects.filter(_selection_q(selection))
+
+
+def _counts(selection):
+    """
+    {(фасет, slug): число товаров} одним запросом
+
+    Счётчик варианта учитывает условия остальных фасетов, но не своего:
+    видно, сколько товаров будет, если переключиться на этот вариант.
+    """
+    aggregates = {}
+    for facet in FACETS:
+        others = _selection_q(selection, skip=facet.name)
+        for index, bucket in enumerate(facet.buckets):
+            aggregates[f'{facet.name}_{index}'] = Count(
+                'product', distinct=True, filter=_range_q(facet, bucket) & others,
+            )
+    totals = ProductPrice.objects.aggregate(**aggregates)
+    return {
+        (facet.name, bucket_slug(bucket)): totals[f'{facet.name}_{index}']
+        for facet in FACETS
+        for index, bucket in enumerate(facet.buckets)
+    }
+
+
+def facet_counts(selection):
+    """
+    Фасеты для шаблона каталога: [{'label', 'buckets': [{'label', 'count', 'selected', 'query'}]}]
+
+    query — строка запроса, которая выбирает вариант (или снимает выбор,
+    если он уже выбран), сохраняя остальные условия.
+    """
+    key = make_cache_key('catalog_facets', sorted((name, bucket_slug(b)) for name, b in selection.items()))
+    counts = cache_fetch(key, lambda: _counts(selection), soft_ttl=60 * 60, hard_ttl=60 * 60 * 6)
+    current = {name: bucket_slug(bucket) for name, bucket in selection.items()}
+    result = []
+    for facet in FACETS:
+        buckets = []
+        for bucket in facet.buckets:
+            slug = bucket_slug(bucket)
+            selected = current.get(facet.name) == slug
+            params = {name: value for name, value in current.items() if name != facet.name}
+            if not selected:
+                params[facet.name] = slug
+            buckets.append({
+                'label': facet.bucket_label(bucket),
+                'count': counts[(facet.name, slug)],
+                'selected': selected,
+                'query': '?' + urlencode(params) if params else '?',
+            })
+        result.append({'name': facet.name, 'label': facet.label, 'buckets': buckets})
+    return result
@@ -0,0 +1,356 @@
+# shop/images.py
+"""
+Производные изображения: уменьшенные копии и WebP/AVIF
+
+Для каждого ImageField моделей shop после сохранения в фоновом пуле потоков
+(не в потоке запроса) создаются копии шириной из IMAGE_DERIVATIVES['SIZES']
+в исходном формате и в форматах IMAGE_DERIVATIVES['FORMATS']. Копии лежат
+рядом с оригиналом: products/banya.jpg -> products/banya.480w.webp.
+Генерация идемпотентна: существующие файлы не пересоздаются, поэтому новый
+размер в настройках просто досоздаёт недостающие копии. Копии удаляются
+вместе с объектом и при замене изображения, если оригинал больше нигде
+не используется.
+
+Шаблоны получают URL через фильтры shop_images (thumbnail, srcset) и тег
+image_sources; пока копии не готовы, отдаётся оригинал.
+"""
+import logging
+import os
+import posixpath
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import unquote
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from PIL import Image, ImageOps, features
+
+from . import cache_bus
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SIZES': (160, 480, 960, 1600),
+    'FORMATS': ('avif', 'webp'),
+    'QUALITY': 80,
+    'WORKERS': 2,
+}
+
+# Расширение файла -> формат Pillow для исходного формата копии
+_PIL_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+_MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+_EXIF_ORIENTATION = 0x0112
+# Имя копии после корня оригинала: .480w.webp, а также дубли .480w_AbC1234.webp,
+# которые оставляли гонки воркеров при записи через storage.save()
+_DERIVATIVE_SUFFIX = r'\.\d+w(?:_[A-Za-z0-9]{7})?\.[a-z0-9]+'
+# Права копий, если у хранилища не задан FILE_UPLOAD_PERMISSIONS (mkstemp создаёт 0600)
+_FILE_MODE = 0o644
+
+_executor = None
+_executor_lock = threading.Lock()
+# Копии, существование которых уже проверено (на диске они не исчезают)
+_known = set()
+# Копии, которых не было при рендере: не проверяются заново на каждой странице.
+# Сбрасывается вместе с кешем страниц (page:*), который публикует каждая генерация
+_missing = set()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_DERIVATIVES', {})}
+
+
+def modern_formats():
+    """Форматы из настроек, которые поддерживает установленный Pillow"""
+    return [fmt for fmt in get_config()['FORMATS'] if features.check(fmt)]
+
+
+def name_from_url(value):
+    """Имя файла в хранилище из FieldFile, имени или URL вида /media/..."""
+    if hasattr(value, 'name'):
+        return value.name or ''
+    value = value or ''
+    if value.startswith(settings.MEDIA_URL):
+        return unquote(value[len(settings.MEDIA_URL):])
+    return value
+
+
+def derivative_name(name, width, fmt=None):
+    """products/banya.jpg, 480, 'webp' -> products/banya.480w.webp"""
+    root, ext = posixpath.splitext(name)
+    return f'{root}.{width}w.{fmt if fmt else ext.lstrip(".").lower()}'
+
+
+def _exists(name, storage):
+    if name in _known:
+        return True
+    if storage.exists(name):
+        _known.add(name)
+        return True
+    return False
+
+
+def _ready(name, storage):
+    """_exists() для рендера: отсутствие копии тоже запоминается до сброса page:*"""
+    if name in _missing:
+        return False
+    if _exists(name, storage):
+        return True
+    _missing.add(name)
+    return False
+
+
+def _encode(image, pil_format, quality):
+    buffer = BytesIO()
+    if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    options = {'quality': quality} if pil_format in ('JPEG', 'WEBP', 'AVIF') else {'optimize': True}
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def _write(name, data, storage):
+    """
+    Записать копию ровно под именем name
+
+    storage.save() при гонке двух воркеров дал бы второй копии суффикс, и
+    файл остался бы сиротой. В файловом хранилище копия пишется во временный
+    файл рядом и переименовывается os.replace(): замена атомарна, и второй
+    воркер лишь перезаписывает то же содержимое. Хранилища без локальных
+    путей пишут через save(), если копии ещё нет.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        if not storage.exists(name):
+            storage.save(name, ContentFile(data))
+        return
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.chmod(tmp_path, getattr(storage, 'file_permissions_mode', None) or _FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def generate_derivatives(name, storage=default_storage, dry_run=False):
+    """
+    Создать недостающие копии изображения
+
+    Возвращает список (имя_копии, размер_в_байтах) созданных файлов
+    (при dry_run — тех, что были бы созданы, с размером 0).
+    """
+    config = get_config()
+    ext = posixpath.splitext(name)[1].lower()
+    if ext not in _PIL_FORMATS:
+        return []
+    targets = [(fmt, fmt.upper()) for fmt in modern_formats() if f'.{fmt}' != ext]
+    targets.append((None, _PIL_FORMATS[ext]))
+
+    created = []
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)  # читает только заголовок
+        # Ширина с учётом EXIF-поворота (5–8 — поворот на 90°), без декодирования
+        width_limit = image.height if image.getexif().get(_EXIF_ORIENTATION, 1) in (5, 6, 7, 8) else image.width
+        pending = []
+        for width in sorted(config['SIZES']):
+            if width >= width_limit:
+                break  # не увеличиваем
+            for fmt, pil_format in targets:
+                target = derivative_name(name, width, fmt)
+                if not _exists(target, storage):
+                    pending.append((width, target, pil_format))
+        if dry_run or not pending:
+            return [(target, 0) for _, target, _ in pending]
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        resized, resized_width = None, None
+        for width, target, pil_format in pending:
+            if width != resized_width:
+                resized, resized_width = image.copy(), width
+                resized.thumbnail((width, image.height), Image.LANCZOS)
+            data = _encode(resized, pil_format, config['QUALITY'])
+            _write(target, data, storage)
+            _known.add(target)
+            _missing.discard(target)
+            created.append((target, len(data)))
+    return created
+
+
+def delete_derivatives(name, storage=default_storage):
+    """
+    Удалить все копии изображения name
+
+    Файлы ищутся в каталоге оригинала по шаблону имени, поэтому удаляются и
+    копии размеров, убранных из настроек, и дубли с суффиксом. Возвращает
+    список удалённых имён.
+    """
+    directory, filename = posixpath.split(name)
+    pattern = re.compile(re.escape(posixpath.splitext(filename)[0]) + _DERIVATIVE_SUFFIX)
+    try:
+        _, files = storage.listdir(directory)
+    except (FileNotFoundError, NotImplementedError):
+        return []
+    deleted = []
+    for filename in files:
+        if pattern.fullmatch(filename):
+            target = posixpath.join(directory, filename)
+            storage.delete(target)
+            _known.discard(target)
+            deleted.append(target)
+    return deleted
+
+
+def _in_use(name):
+    """Ссылается ли на файл name хоть одно ImageField моделей shop"""
+    return any(
+        model._default_manager.filter(**{field.name: name}).exists()
+        for model in apps.get_app_config('shop').get_models()
+        for field in image_fields(model)
+    )
+
+
+def _delete_safely(name):
+    try:
+        if not _in_use(name):
+            delete_derivatives(name)
+    except Exception:
+        logger.warning('Не удалось удалить копии изображения %s', name, exc_info=True)
+
+
+def _generate_safely(name):
+    try:
+        created = generate_derivatives(name)
+    except Exception:
+        logger.warning('Не удалось создать копии изображения %s', name, exc_info=True)
+        return
+    if created:
+        # Страницы, отрендеренные с оригиналом, перерисуются уже с копиями
+        cache_bus.invalidate(['page:*'])
+
+
+def _submit(task, name):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_config()['WORKERS'], thread_name_prefix='image-derivatives',
+            )
+    _executor.submit(task, name)
+
+
+def schedule(name):
+    """Поставить генерацию копий в фоновый пул"""
+    if name:
+        _submit(_generate_safely, name)
+
+
+def schedule_delete(name):
+    """Поставить удаление копий в фоновый пул (каталог с работами может быть большим)"""
+    if name:
+        _submit(_delete_safely, name)
+
+
+def image_fields(model):
+    return [field for field in model._meta.get_fields() if isinstance(field, models.ImageField)]
+
+
+def _remember_names(sender, instance, raw=False, **kwargs):
+    """Запомнить прежние файлы изображений: после сохранения копии заменённых удаляются"""
+    if raw or instance._state.adding:
+        return
+    attnames = [field.attname for field in image_fields(sender)]
+    before = sender._default_manager.filter(pk=instance.pk).values_list(*attnames).first()
+    instance._image_names_before = dict(zip(attnames, before or ()))
+
+
+def _on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    before = getattr(instance, '_image_names_before', {})
+    for field in image_fields(sender):
+        name = getattr(instance, field.attname).name
+        if name:
+            # Файл записан в хранилище к моменту коммита
+            transaction.on_commit(lambda name=name: schedule(name))
+        old_name = before.get(field.attname)
+        if old_name and old_name != name:
+            transaction.on_commit(lambda old_name=old_name: schedule_delete(old_name))
+
+
+def _on_delete(sender, instance, **kwargs):
+    for field in image_fields(sender):
+        name = getattr(instance, field.attname).name
+        if name:
+            transaction.on_commit(lambda name=name: schedule_delete(name))
+
+
+def _on_invalidate(keys):
+    # Копии создала генерация в этом или другом процессе, либо весь кеш сброшен
+    if 'page:*' in keys or cache_bus.ALL_KEYS in keys:
+        _missing.clear()
+
+
+def connect_signals():
+    for model in apps.get_app_config('shop').get_models():
+        if image_fields(model):
+            uid = f'image-derivatives-{model._meta.label}'
+            pre_save.connect(_remember_names, sender=model, dispatch_uid=uid)
+            post_save.connect(_on_save, sender=model, dispatch_uid=uid)
+            post_delete.connect(_on_delete, sender=model, dispatch_uid=uid)
+    cache_bus.subscribe(_on_invalidate)
+
+
+# ---------- URL для шаблонов и админки ----------
+
+def _variants(name, fmt, storage=default_storage):
+    return [
+        (width, derivative_name(name, width, fmt))
+        for width in sorted(get_config()['SIZES'])
+        if _ready(derivative_name(name, width, fmt), storage)
+    ]
+
+
+def thumbnail_url(value, width, fmt=None):
+    """URL наименьшей готовой копии не уже width (иначе — оригинала)"""
+    name = name_from_url(value)
+    if not name:
+        return ''
+    for variant_width, variant in _variants(name, fmt):
+        if variant_width >= width:
+            return default_storage.url(variant)
+    return default_storage.url(name)
+
+
+def srcset(value, fmt=None):
+    """Значение атрибута srcset из готовых копий ('' если копий ещё нет)"""
+    name = name_from_url(value)
+    if not name:
+        return ''
+    return ', '.join(f'{default_storage.url(variant)} {width}w' for width, variant in _variants(name, fmt))
+
+
+def sources(value):
+    """[(mime, srcset)] для <source> в <picture> по современным форматам"""
+    result = []
+    for fmt in modern_formats():
+        value_srcset = srcset(value, fmt)
+        if value_srcset:
+            result.append((_MIME_TYPES.get(fmt, f'image/{fmt}'), value_srcset))
+    return result
@@ -0,0 +1,251 @@
+# shop/ingest.py
+"""
+Очередь входящих заявок (заказы, заявки на кредит)
+
+Под наплывом заявок запись в db.sqlite3 прямо в запросе упирается в единственную
+блокировку записи SQLite: запросы ждут друг друга до timeout из DATABASES.
+Вместо этого view кладёт заявку в очередь — таблицу в отдельном файле SQLite
+в режиме WAL (по образцу шины кеша, shop/cache_bus.py) — и сразу отвечает.
+Вставка одной строки в маленький файл без транзакций Django занимает доли
+миллисекунды.
+
+Фоновый поток в каждом воркере переносит заявки в основную БД пачками через
+bulk_create и удаляет перенесённые из очереди. Очередь переживает перезапуск:
+поток, стартующий вместе с воркером (banyana_fresh/wsgi.py), доберёт то, что
+осталось. Заявки, которые ещё не перенесены, видны в админке над списком
+заявок.
+
+Доставка «хотя бы один раз»: строку забирает один воркер (claimed_at), и
+если он упал, не успев перенести её, через INGEST_LEASE секунд строку
+заберёт другой. Строка с ошибкой переноса остаётся в очереди с текстом
+ошибки и повторяется по той же аренде.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT NOT NULL DEFAULT ''
+);
+"""
+
+# Пауза после первой заявки, чтобы набрать пачку
+DRAIN_DELAY = 0.2
+# Без новых заявок очередь всё равно проверяется: строки упавших воркеров
+IDLE_POLL = 30
+
+_local = threading.local()
+_wakeup = threading.Event()
+_drainer_lock = threading.Lock()
+_drainer_pid = None
+
+
+def _queue_path():
+    return str(getattr(settings, 'INGEST_QUEUE_PATH', settings.BASE_DIR / 'ingest_queue.sqlite3'))
+
+
+def _batch_size():
+    return getattr(settings, 'INGEST_BATCH_SIZE', 200)
+
+
+def _lease():
+    return getattr(settings, 'INGEST_LEASE', 60)
+
+
+def _connection():
+    """Соединение с файлом очереди (отдельное на поток, пересоздаётся после fork и смены пути)"""
+    path = _queue_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.path != path:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # Заявка не должна пропасть при отключении питания после ответа клиенту
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = path
+    return conn
+
+
+def enqueue(model, **fields):
+    """
+    Поставить заявку в очередь и разбудить фоновый поток
+
+    Использование:
+    enqueue(CreditRequest, fio='Иванов', phone='+79990000000')
+
+    Если очередь недоступна, заявка сохраняется в БД сразу, как раньше.
+    """
+    created_at = timezone.now()
+    try:
+        _connection().execute(
+            'INSERT INTO submissions (model, payload, created_at) VALUES (?, ?, ?)',
+            (model._meta.label, json.dumps(fields, ensure_ascii=False), created_at.isoformat()),
+        )
+    except sqlite3.Error:
+        logger.warning('Очередь заявок недоступна, %s сохраняется напрямую', model._meta.label, exc_info=True)
+        model.objects.create(created_at=created_at, **fields)
+        return
+    start_drainer()
+    _wakeup.set()
+
+
+def _claim(limit):
+    """Забрать до limit строк, свободных или с истёкшей арендой"""
+    now = time.time()
+    conn = _connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute(
+            'SELECT id, model, payload, created_at FROM submissions '
+            'WHERE claimed_at IS NULL OR claimed_at < ? ORDER BY id LIMIT ?',
+            (now - _lease(), limit),
+        ).fetchall()
+        conn.executemany('UPDATE submissions SET claimed_at = ? WHERE id = ?', [(now, row[0]) for row in rows])
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return rows
+
+
+def _build(model, payload, created_at):
+    obj = model(**json.loads(payload))
+    obj.created_at = datetime.fromisoformat(created_at)
+    return obj
+
+
+def _insert(label, rows):
+    """
+    Перенести строки одной модели: пачкой, а если пачка не прошла — по одной,
+    чтобы одна испорченная заявка не держала остальные
+
+    Возвращает (перенесённые id, {id: ошибка}).
+    """
+    model = apps.get_model(label)
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([_build(model, payload, created_at) for _, payload, created_at in rows])
+        return [row_id for row_id, _, _ in rows], {}
+    except Exception:
+        logger.warning('Пачка заявок %s не перенеслась, переносим по одной', label, exc_info=True)
+
+    done, failed = [], {}
+    for row_id, payload, created_at in rows:
+        try:
+            with transaction.atomic():
+                _build(model, payload, created_at).save()
+        except Exception as exc:
+            failed[row_id] = f'{type(exc).__name__}: {exc}'
+        else:
+            done.append(row_id)
+    return done, failed
+
+
+def drain(limit=None):
+    """Перенести одну пачку заявок в БД; возвращает число забранных из очереди строк"""
+    rows = _claim(limit or _batch_size())
+    if not rows:
+        return 0
+
+    by_model = {}
+    for row_id, label, payload, created_at in rows:
+        by_model.setdefault(label, []).append((row_id, payload, created_at))
+    done, failed = [], {}
+    for label, model_rows in by_model.items():
+        model_done, model_failed = _insert(label, model_rows)
+        done += model_done
+        failed.update(model_failed)
+
+    conn = _connection()
+    if done:
+        conn.executemany('DELETE FROM submissions WHERE id = ?', [(row_id,) for row_id in done])
+    if failed:
+        # Аренда не снимается: повтор не раньше чем через INGEST_LEASE секунд
+        logger.error('Заявки не перенесены в БД: %s', failed)
+        conn.executemany(
+            'UPDATE submissions SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+            [(error, row_id) for row_id, error in failed.items()],
+        )
+    return len(rows)
+
+
+def drain_all():
+    """Переносить пачки, пока очередь не опустеет (или не останутся только арендованные)"""
+    total = 0
+    while True:
+        count = drain()
+        total += count
+        if count < _batch_size():
+            return total
+
+
+def pending(label=None):
+    """Заявки, ещё не перенесённые в БД (для админки), старые первыми"""
+    query = 'SELECT id, model, payload, created_at, attempts, last_error FROM submissions'
+    params = ()
+    if label:
+        query += ' WHERE model = ?'
+        params = (label,)
+    try:
+        rows = _connection().execute(query + ' ORDER BY id', params).fetchall()
+    except sqlite3.Error:
+        logger.warning('Не удалось прочитать очередь заявок', exc_info=True)
+        return []
+    return [
+        {
+            'id': row_id,
+            'model': model,
+            'fields': json.loads(payload),
+            'created_at': datetime.fromisoformat(created_at),
+            'attempts': attempts,
+            'last_error': last_error,
+        }
+        for row_id, model, payload, created_at, attempts, last_error in rows
+    ]
+
+
+def _run():
+    while True:
+        if _wakeup.wait(IDLE_POLL):
+            time.sleep(DRAIN_DELAY)
+        _wakeup.clear()
+        try:
+            drain_all()
+        except Exception:
+            logger.exception('Ошибка фонового переноса заявок')
+        finally:
+            close_old_connections()
+
+
+def start_drainer():
+    """Запустить фоновый поток переноса в текущем процессе (повторный вызов ничего не делает)"""
+    global _drainer_pid
+    if _drainer_pid == os.getpid():
+        return
+    with _drainer_lock:
+        if _drainer_pid == os.getpid():
+            return
+        threading.Thread(target=_run, name='ingest-drainer', daemon=True).start()
+        _drainer_pid = os.getpid()
+        # Заявки, оставшиеся с прошлого запуска
+        _wakeup.set()
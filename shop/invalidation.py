@@ -0,0 +1,139 @@
+# shop/invalidation.py
+"""
+Декларативная инвалидация кеша по графу зависимостей
+
+CACHE_DEPENDENCIES описывает, какие ключи и семейства ключей зависят от
+модели. Ключи сбрасываются по сигналам post_save / post_delete / m2m_changed
+и bulk_changed — о массовых операциях (update, bulk_create, bulk_update,
+см. shop/signals.py). Публикация откладывается до
+коммита транзакции и объединяется: сохранение товара с инлайнами в админке
+даёт одну запись в шине, а не по одной на каждую строку.
+"""
+import string
+import threading
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from . import cache_bus
+from .signals import bulk_changed, track_fields
+
+# Модель -> зависимые ключи.
+# keys — общие ключи и семейства ('product_detail_*', 'page:*' — кеш страниц,
+# 'quote_index:*' — индекс цен калькулятора в памяти воркеров,
+# 'catalog_facets:*' — счётчики фильтра каталога);
+# instance_keys — шаблоны ключей конкретного объекта, поля подставляются из него.
+CACHE_DEPENDENCIES = {
+    'shop.Product': {
+        'keys': [
+            'products_all', 'products_featured', 'products_catalog', 'catalog_facets:*',
+            'quote_index:*', 'page:*',
+        ],
+        'instance_keys': ['product_{pk}', 'product_detail_{pk}'],
+    },
+    'shop.ProductPrice': {
+        'keys': ['products_featured', 'products_catalog', 'catalog_facets:*', 'quote_index:*', 'page:*'],
+        'instance_keys': ['product_detail_{product_id}'],
+    },
+    'shop.ProductImage': {
+        'keys': ['products_featured', 'products_catalog', 'page:*'],
+        'instance_keys': ['product_detail_{product_id}'],
+    },
+    'shop.GlobalOption': {
+        # Сгруппированные опции входят в контекст каждой карточки товара
+        'keys': [
+            'global_options_active', 'global_options_grouped', 'product_detail_*',
+            'quote_index:*', 'page:*',
+        ],
+    },
+    'shop.CompanyInfo': {
+        'keys': ['company_info', 'page:*'],
+    },
+    'shop.WorkPhoto': {
+        'keys': ['works_page:*', 'page:*'],
+    },
+}
+
+_pending = threading.local()
+
+
+def _dependencies(model):
+    return CACHE_DEPENDENCIES.get(model._meta.label, {})
+
+
+def _instance_fields(model):
+    """Поля, которые нужны шаблонам instance_keys модели"""
+    formatter = string.Formatter()
+    return sorted({
+        field
+        for template in _dependencies(model).get('instance_keys', [])
+        for _, field, _, _ in formatter.parse(template)
+        if field
+    })
+
+
+def keys_for(model, instances=()):
+    """Ключи кеша, зависящие от модели и (опционально) конкретных объектов"""
+    deps = _dependencies(model)
+    keys = set(deps.get('keys', []))
+    for instance in instances:
+        values = {field: getattr(instance, field) for field in _instance_fields(model)}
+        keys.update(template.format(**values) for template in deps.get('instance_keys', []))
+    return keys
+
+
+def _flush():
+    keys = getattr(_pending, 'keys', None)
+    if keys:
+        _pending.keys = set()
+        cache_bus.invalidate(keys)
+
+
+def schedule(keys):
+    """Отложить инвалидацию ключей до коммита текущей транзакции"""
+    if not keys:
+        return
+    if not hasattr(_pending, 'keys'):
+        _pending.keys = set()
+    _pending.keys.update(keys)
+    # Вне транзакции on_commit выполняется сразу
+    transaction.on_commit(_flush)
+
+
+def invalidate_model(model, instances=()):
+    """Сбросить кеш, зависящий от модели (и её объектов)"""
+    schedule(keys_for(model, instances))
+
+
+def _on_save_or_delete(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return  # loaddata
+    invalidate_model(sender, [instance])
+
+
+def _on_m2m_changed(sender, instance, action, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if _dependencies(type(instance)):
+        invalidate_model(type(instance), [instance])
+    model = kwargs.get('model')
+    if model is not None and _dependencies(model):
+        invalidate_model(model, model._default_manager.filter(pk__in=kwargs.get('pk_set') or ()))
+
+
+def _on_bulk_changed(sender, instances, **kwargs):
+    if _dependencies(sender):
+        invalidate_model(sender, instances)
+
+
+def connect_signals():
+    """Подключить обработчики ко всем моделям из CACHE_DEPENDENCIES"""
+    for label in CACHE_DEPENDENCIES:
+        model = apps.get_model(label)
+        uid = f'cache-invalidation-{label}'
+        post_save.connect(_on_save_or_delete, sender=model, dispatch_uid=uid)
+        post_delete.connect(_on_save_or_delete, sender=model, dispatch_uid=uid)
+        bulk_changed.connect(_on_bulk_changed, sender=model, dispatch_uid=uid)
+        track_fields(label, [field for field in _instance_fields(model) if field != 'pk'])
+    m2m_changed.connect(_on_m2m_changed, dispatch_uid='cache-invalidation-m2m')
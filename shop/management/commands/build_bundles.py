@@ -0,0 +1,53 @@
+# shop/management/commands/build_bundles.py
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import bundles
+
+
+class Command(BaseCommand):
+    help = 'Сборка бандлов CSS/JS из блоков {% bundle %} шаблонов (запускать перед collectstatic)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Ничего не записывать, завершиться с ошибкой, если бандлы устарели',
+        )
+
+    def handle(self, *args, **options):
+        output_dir = bundles.output_dir()
+        try:
+            expected = bundles.expected_files(bundles.collect_sources())
+        except bundles.BundleError as exc:
+            raise CommandError(str(exc)) from exc
+
+        outdated = bundles.outdated(expected)
+        stale = [
+            path for path in sorted(output_dir.glob('*.*'))
+            if f'{bundles.BUNDLES_DIR}/{path.name}' not in expected
+        ] if output_dir.exists() else []
+
+        if options['check']:
+            if outdated or stale:
+                raise CommandError(
+                    'Бандлы устарели: ' + ', '.join(outdated + [str(path) for path in stale])
+                    + '. Запустите manage.py build_bundles'
+                )
+            self.stdout.write(self.style.SUCCESS('Бандлы актуальны'))
+            return
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for path in stale:
+            path.unlink()
+        saved_total = 0
+        for path, (content, source_size, template_name) in expected.items():
+            (output_dir.parent / path).write_text(content, encoding='utf-8')
+            size = len(content.encode())
+            saved_total += source_size
+            self.stdout.write(
+                f'{path}: {source_size / 1024:.1f} КБ в {template_name} -> {size / 1024:.1f} КБ'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Бандлов: {len(expected)}, из HTML вынесено {saved_total / 1024:.1f} КБ'
+            + (f', удалено устаревших: {len(stale)}' if stale else '')
+        ))
@@ -0,0 +1,179 @@
+# shop/management/commands/build_image_derivatives.py
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from shop import cache_bus, images
+
+
+def _init_worker():
+    # При запуске через spawn дочерний процесс стартует без настроенного Django
+    django.setup()
+
+
+def _process(name, dry_run):
+    """Выполняется в дочернем процессе: копии одного файла и время работы"""
+    started = time.perf_counter()
+    try:
+        created = images.generate_derivatives(name, dry_run=dry_run)
+    except Exception as exc:
+        return name, None, time.perf_counter() - started, str(exc)
+    return name, created, time.perf_counter() - started, None
+
+
+class Command(BaseCommand):
+    help = 'Создание недостающих уменьшенных копий и WebP/AVIF для всех изображений магазина'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Количество процессов (по умолчанию — число ядер)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, какие копии будут созданы',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Игнорировать сохранённый прогресс и проверить все файлы заново',
+        )
+        parser.add_argument(
+            '--progress-file',
+            default=str(settings.BASE_DIR / 'logs' / 'image_derivatives_progress.json'),
+            help='Файл прогресса для продолжения прерванного запуска',
+        )
+
+    def _originals(self):
+        """Имена файлов из всех ImageField моделей shop"""
+        names = set()
+        for model in apps.get_app_config('shop').get_models():
+            for field in images.image_fields(model):
+                names.update(
+                    model._default_manager.exclude(**{field.name: ''})
+                    .exclude(**{f'{field.name}__isnull': True})
+                    .values_list(field.name, flat=True)
+                )
+        return sorted(names)
+
+    def _load_progress(self, path, signature):
+        """
+        Обработанные файлы из файла прогресса
+
+        Первая строка — заголовок с сигнатурой настроек, дальше по JSON-строке
+        с именем на каждый обработанный файл. Недописанная при прерывании
+        последняя строка пропускается.
+        """
+        try:
+            with open(path, encoding='utf-8') as fh:
+                header = json.loads(fh.readline())
+                # Другие размеры или форматы — прогресс недействителен
+                if not isinstance(header, dict) or header.get('signature') != signature:
+                    return set()
+                done = set(header.get('done', []))  # прежний формат: весь список в одном объекте
+                for line in fh:
+                    try:
+                        done.add(json.loads(line))
+                    except ValueError:
+                        break
+        except (OSError, ValueError):
+            return set()
+        return done
+
+    def _open_progress(self, path, signature, done):
+        """
+        Файл прогресса для дозаписи: строка на файл вместо перезаписи всего списка
+
+        Один раз за запуск файл переписывается начисто — без недописанной
+        строки прерванного запуска, к которой иначе приклеилась бы новая.
+        """
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            fh.write(json.dumps({'signature': signature}) + '\n')
+            fh.writelines(json.dumps(name, ensure_ascii=False) + '\n' for name in sorted(done))
+        os.replace(tmp, path)
+        return open(path, 'a', encoding='utf-8')
+
+    def _save_progress(self, fh, name):
+        fh.write(json.dumps(name, ensure_ascii=False) + '\n')
+        fh.flush()  # прерванный запуск не потеряет уже созданные копии
+
+    def _summary(self, names):
+        """Объём оригиналов против копий каждой ширины в лучшем формате"""
+        config = images.get_config()
+        fmt = (images.modern_formats() or [None])[0]
+        originals = sum(default_storage.size(name) for name in names if default_storage.exists(name))
+        self.stdout.write(f'Оригиналы: {len(names)} файлов, {originals / 1024 / 1024:.1f} МБ')
+        for width in sorted(config['SIZES']):
+            total = covered = 0
+            for name in names:
+                variant = images.derivative_name(name, width, fmt)
+                if default_storage.exists(variant):
+                    covered += default_storage.size(name)
+                    total += default_storage.size(variant)
+            if covered:
+                self.stdout.write(
+                    f'  {width}px ({fmt or "исходный формат"}): {total / 1024 / 1024:.1f} МБ '
+                    f'вместо {covered / 1024 / 1024:.1f} МБ, экономия {100 - total * 100 / covered:.0f}%'
+                )
+
+    def handle(self, *args, **options):
+        config = images.get_config()
+        signature = json.dumps([sorted(config['SIZES']), images.modern_formats()])
+        progress_file = options['progress_file']
+        dry_run = options['dry_run']
+
+        names = self._originals()
+        done = set() if options['restart'] else self._load_progress(progress_file, signature)
+        todo = [name for name in names if name not in done]
+        self.stdout.write(
+            f'Файлов: {len(names)}, уже обработано: {len(names) - len(todo)}, '
+            f'процессов: {options["workers"]}'
+        )
+
+        started = time.perf_counter()
+        created_total = written_bytes = errors = 0
+        progress = None if dry_run else self._open_progress(progress_file, signature, done)
+        with progress or nullcontext(), \
+                ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            futures = [pool.submit(_process, name, dry_run) for name in todo]
+            for future in as_completed(futures):
+                name, created, seconds, error = future.result()
+                if error:
+                    errors += 1
+                    self.stderr.write(f'{name}: ошибка — {error}')
+                    continue
+                created_total += len(created)
+                written_bytes += sum(size for _, size in created)
+                verb = 'будет создано' if dry_run else 'создано'
+                self.stdout.write(f'{name}: {verb} {len(created)} копий, {seconds:.2f} с')
+                if not dry_run:
+                    self._save_progress(progress, name)
+
+        elapsed = time.perf_counter() - started
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'Будет создано копий: {created_total} ({elapsed:.1f} с на проверку)'
+            ))
+            return
+
+        if created_total:
+            # Страницы, отрендеренные с оригиналами, перерисуются с копиями
+            cache_bus.invalidate(['page:*'])
+        self._summary(names)
+        style = self.style.WARNING if errors else self.style.SUCCESS
+        self.stdout.write(style(
+            f'Создано копий: {created_total} ({written_bytes / 1024 / 1024:.1f} МБ) '
+            f'за {elapsed:.1f} с, ошибок: {errors}'
+        ))
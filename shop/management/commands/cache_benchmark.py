@@ -0,0 +1,69 @@
+# shop/management/commands/cache_benchmark.py
+import pickle
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from shop import dto
+from shop.models import GlobalOption, Product, ProductImage, ProductPrice
+
+
+class Command(BaseCommand):
+    help = 'Сравнение размера и скорости чтения записей кеша: экземпляры моделей против DTO'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='Количество чтений каждой записи',
+        )
+
+    def _measure(self, value, decode, iterations):
+        """Размер и время попадания так, как их видит LocMemCache (pickle)"""
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            decode(pickle.loads(data))
+        return len(data), (time.perf_counter() - started) / iterations * 1e6
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        products = list(
+            Product.objects
+            .prefetch_related(
+                Prefetch('prices', queryset=ProductPrice.objects.order_by('order')),
+                Prefetch('images', queryset=ProductImage.objects.order_by('order'))
+            )
+        )
+        if not products:
+            self.stdout.write(self.style.WARNING('В базе нет товаров — измерять нечего'))
+            return
+        global_options = list(GlobalOption.objects.filter(is_active=True))
+
+        entries = {
+            'products_catalog': (
+                products,
+                dto.CardDTO.for_products(Product.objects.order_by('id')),
+            ),
+            'product_detail_<pk>': (
+                {'product': products[0], 'prices': products[0].prices.all(), 'options': global_options},
+                {
+                    'product': dto.ProductDTO.from_model(products[0]),
+                    'options': tuple(dto.OptionDTO.from_model(o) for o in global_options),
+                },
+            ),
+            'global_options_grouped': (
+                global_options,
+                tuple(dto.OptionDTO.from_model(o) for o in global_options),
+            ),
+        }
+
+        self.stdout.write(f'{"ключ":<24}{"модели, байт":>14}{"DTO, байт":>12}{"модели, мкс":>14}{"DTO, мкс":>11}')
+        for key, (models_value, dto_value) in entries.items():
+            before_size, before_us = self._measure(models_value, lambda v: v, iterations)
+            after_size, after_us = self._measure(dto.pack(dto_value), dto.unpack, iterations)
+            self.stdout.write(
+                f'{key:<24}{before_size:>14}{after_size:>12}{before_us:>14.1f}{after_us:>11.1f}'
+            )
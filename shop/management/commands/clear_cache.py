@@ -1,26 +1,131 @@
 # shop/management/commands/clear_cache.py
-from django.core.management.base import BaseCommand
-from django.core.cache import cache
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import cache_bus, cache_inspect, warmup
+
+
+def _size(size):
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024 or unit == 'МБ':
+            return f'{size:.0f} {unit}' if unit == 'Б' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+def _age(seconds):
+    if seconds < 60:
+        return f'{seconds:.0f} с'
+    if seconds < 3600:
+        return f'{seconds / 60:.0f} мин'
+    return f'{seconds / 3600:.1f} ч'
 
 
 class Command(BaseCommand):
-    help = 'Очистка всего кеша приложения'
+    help = (
+        'Кеш во всех воркерах через шину инвалидации: без подкоманды — очистка '
+        '(всего кеша или --key), stats — сводка по семействам ключей, '
+        'invalidate — сброс ключей и шаблонов, warm — прогрев'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
             '--key',
             type=str,
-            help='Очистить конкретный ключ кеша',
+            help='Очистить конкретный ключ кеша или семейство (product_detail_*)',
         )
+        actions = parser.add_subparsers(dest='action')
+        stats = actions.add_parser('stats', help='Записи, размер, возраст и попадания по семействам ключей')
+        stats.add_argument(
+            '--wait',
+            type=float,
+            default=3,
+            help='Сколько секунд ждать сводки воркеров (больше CACHE_WARMUP_INTERVAL)',
+        )
+        invalidate = actions.add_parser('invalidate', help='Сбросить ключи и семейства во всех воркерах')
+        invalidate.add_argument('patterns', nargs='+', help="Ключ, семейство с '*' на конце или '*' — весь кеш")
+        actions.add_parser('warm', help='Прогреть страницы и данные во всех воркерах')
 
     def handle(self, *args, **options):
-        if options['key']:
-            cache.delete(options['key'])
-            self.stdout.write(
-                self.style.SUCCESS(f'Кеш для ключа "{options["key"]}" очищен')
-            )
+        action = options.get('action')
+        if action == 'stats':
+            self._stats(options['wait'])
+        elif action == 'invalidate':
+            self._invalidate(options['patterns'])
+        elif action == 'warm':
+            cache_bus.invalidate([warmup.WARMUP_KEY])
+            self.stdout.write(self.style.SUCCESS('Воркеры получили сигнал прогрева через шину инвалидации'))
+        elif options['key']:
+            self._invalidate([options['key']])
         else:
-            cache.clear()
+            # Рассылается всем воркерам через шину инвалидации
+            cache_bus.invalidate([cache_bus.ALL_KEYS])
             self.stdout.write(
                 self.style.SUCCESS('Весь кеш успешно очищен!')
             )
+
+    def _invalidate(self, patterns):
+        for pattern in patterns:
+            if '*' in pattern.rstrip('*') or pattern.endswith('**'):
+                raise CommandError(f"Шаблон {pattern!r}: '*' допустим только в конце (product_detail_*)")
+        cache_bus.invalidate(patterns)
+        for pattern in patterns:
+            self.stdout.write(self.style.SUCCESS(f'Кеш для ключа "{pattern}" очищен'))
+
+    def _stats(self, wait):
+        reports = cache_inspect.request_reports(wait)
+        hits = cache_inspect.hit_counts()
+        shared = cache_inspect.shared_inventory()
+        if shared is not None:
+            self._shared(*shared)
+        if not reports:
+            self.stdout.write(self.style.WARNING(
+                f'За {wait:g} с не ответил ни один воркер: сервер не запущен или '
+                'воркеры без фонового прогрева ещё не получали запросов'
+            ))
+        for pid, report in reports.items():
+            families = report['families']
+            if families is None:
+                self.stdout.write(f'pid {pid}: {report["backend"]} не даёт перечислить записи')
+                continue
+            entries = sum(stats['entries'] for stats in families.values())
+            size = sum(stats['bytes'] for stats in families.values())
+            self.stdout.write(
+                f'pid {pid}: {report["backend"]}, записей {entries} из {report["max_entries"]}, {_size(size)}'
+            )
+
+        totals = cache_inspect.merge(reports.values())
+        now = time.time()
+        self.stdout.write(
+            f'\n{"семейство":<28}{"записей":>9}{"размер":>11}{"устар.":>8}{"возраст":>18}{"попадания":>12}{"обращений":>11}'
+        )
+        for family in sorted(totals.keys() | hits.keys()):
+            stats = totals.get(family, {'entries': 0, 'bytes': 0, 'dead': 0, 'oldest': None, 'newest': None})
+            age = '—'
+            if stats['oldest'] is not None:
+                age = f'{_age(now - stats["newest"])} – {_age(now - stats["oldest"])}'
+            counts = hits.get(family, {})
+            requests = sum(counts.values())
+            ratio = f'{counts["hit"] / requests:.0%}' if requests else '—'
+            self.stdout.write(
+                f'{family:<28}{stats["entries"]:>9}{_size(stats["bytes"]):>11}{stats["dead"]:>8}'
+                f'{age:>18}{ratio:>12}{requests:>11}'
+            )
+        self.stdout.write(
+            '\nустар. — записи с истёкшим сроком или сброшенной версией, ждут вытеснения; '
+            'попадания — по снимкам метрик (до METRICS_FLUSH_INTERVAL с задержки)'
+        )
+
+    def _shared(self, backend, families):
+        if families is None:
+            self.stdout.write(f'Общий кеш (L2): {backend} не даёт перечислить записи')
+            return
+        entries = sum(stats['entries'] for stats in families.values())
+        size = sum(stats['bytes'] for stats in families.values())
+        self.stdout.write(f'Общий кеш (L2): {backend}, записей {entries}, {_size(size)}')
+        self.stdout.write(f'{"семейство":<28}{"записей":>9}{"размер":>11}{"устар.":>8}')
+        for family, stats in sorted(families.items()):
+            self.stdout.write(
+                f'{family:<28}{stats["entries"]:>9}{_size(stats["bytes"]):>11}{stats["dead"]:>8}'
+            )
+        self.stdout.write('\nЛокальный кеш воркеров (L1):')
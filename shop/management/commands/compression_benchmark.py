@@ -0,0 +1,60 @@
+# shop/management/commands/compression_benchmark.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from shop.models import Product
+
+GZIP_MIDDLEWARE = 'django.middleware.gzip.GZipMiddleware'
+COMPRESSION_MIDDLEWARE = 'shop.middleware.CompressionMiddleware'
+
+
+class Command(BaseCommand):
+    help = 'Процессорное время на запрос закешированной страницы: GZipMiddleware против готовых вариантов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Количество запросов к каждой странице',
+        )
+        parser.add_argument(
+            '--encoding',
+            default='gzip',
+            help='Значение Accept-Encoding (по умолчанию gzip)',
+        )
+
+    def _middleware(self, compression):
+        return [compression if name == COMPRESSION_MIDDLEWARE else name for name in settings.MIDDLEWARE]
+
+    def _measure(self, middleware, url, requests, encoding):
+        """CPU на запрос (мкс) и размер ответа; кеш страницы прогрет первым запросом"""
+        with override_settings(MIDDLEWARE=middleware, ALLOWED_HOSTS=['*']):
+            client = Client(HTTP_ACCEPT_ENCODING=encoding)
+            client.get(url)
+            started = time.process_time()
+            for _ in range(requests):
+                response = client.get(url)
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.process_time() - started
+        return elapsed / requests * 1e6, len(body)
+
+    def handle(self, *args, **options):
+        urls = [reverse('index'), reverse('catalog'), reverse('works')]
+        product = Product.objects.order_by('id').first()
+        if product:
+            urls.append(reverse('product_detail', args=[product.pk]))
+
+        self.stdout.write(f'{"страница":<16}{"GZip, мкс":>12}{"готовые, мкс":>15}{"байт":>10}{"байт":>10}')
+        for url in urls:
+            before_us, before_size = self._measure(
+                self._middleware(GZIP_MIDDLEWARE), url, options['requests'], options['encoding'],
+            )
+            after_us, after_size = self._measure(
+                self._middleware(COMPRESSION_MIDDLEWARE), url, options['requests'], options['encoding'],
+            )
+            self.stdout.write(f'{url:<16}{before_us:>12.0f}{after_us:>15.0f}{before_size:>10}{after_size:>10}')
@@ -0,0 +1,19 @@
+# shop/management/commands/drain_submissions.py
+from django.core.management.base import BaseCommand
+
+from shop import ingest
+
+
+class Command(BaseCommand):
+    help = 'Перенести заявки из очереди в БД (без ожидания фонового потока воркеров)'
+
+    def handle(self, *args, **options):
+        moved = ingest.drain_all()
+        left = ingest.pending()
+        self.stdout.write(self.style.SUCCESS(f'Забрано из очереди: {moved}, осталось: {len(left)}'))
+        for submission in left:
+            if submission['last_error']:
+                self.stdout.write(
+                    f"  #{submission['id']} {submission['model']} "
+                    f"(попыток {submission['attempts']}): {submission['last_error']}"
+                )
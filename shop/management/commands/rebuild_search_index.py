@@ -0,0 +1,19 @@
+# shop/management/commands/rebuild_search_index.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import search
+
+
+class Command(BaseCommand):
+    help = 'Заполнить полнотекстовый индекс товаров и опций заново (после массовых update() и загрузки данных)'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Полнотекстовый индекс есть только у SQLite (FTS5)')
+        started = time.perf_counter()
+        total = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано документов: {total} за {time.perf_counter() - started:.2f} с'
+        ))
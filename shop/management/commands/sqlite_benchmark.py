@@ -0,0 +1,129 @@
+# shop/management/commands/sqlite_benchmark.py
+import multiprocessing
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from shop import dto, sqlite_tuning
+from shop.models import OrderRequest, Product
+
+# Как было до настройки: журнал отката, новое соединение на каждый запрос
+BASELINE = {'pragmas': {'journal_mode': 'DELETE'}, 'reuse': False, 'begin': 'BEGIN'}
+
+
+def _worker(db_path, mode, role, statement, duration, results):
+    """Процесс-«воркер»: читает каталог или пишет заявки, пока не истечёт duration"""
+    conn = None
+    latencies, errors = [], 0
+    sql, params = statement
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = sqlite3.connect(db_path, timeout=20, isolation_level=None)
+                sqlite_tuning.apply_pragmas(conn, mode['pragmas'])
+            if role == 'reader':
+                conn.execute(sql, params).fetchall()
+            else:
+                conn.execute(mode['begin'])
+                conn.execute(sql, params)
+                conn.execute('COMMIT')
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn is not None and conn.in_transaction:
+                conn.execute('ROLLBACK')
+        else:
+            latencies.append(time.perf_counter() - started)
+        if not mode['reuse'] and conn is not None:
+            conn.close()
+            conn = None
+    results.put((role, latencies, errors))
+
+
+class Command(BaseCommand):
+    help = 'Конкурентная нагрузка на копию db.sqlite3: читатели и писатели до и после настройки SQLite'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=6, help='Процессов-читателей')
+        parser.add_argument('--writers', type=int, default=2, help='Процессов-писателей')
+        parser.add_argument('--seconds', type=float, default=5, help='Длительность каждого прогона')
+
+    def _statements(self):
+        """SQL витрины каталога (как его выполняет CardDTO.for_products) и вставки заявки"""
+        with CaptureQueriesContext(connection) as queries:
+            dto.CardDTO.for_products(Product.objects.order_by('id'))
+        reader = (queries.captured_queries[-1]['sql'], ())
+        fields = ['fio', 'phone', 'email', 'message', 'order_details', 'created_at']
+        writer = (
+            f'INSERT INTO {OrderRequest._meta.db_table} ({", ".join(fields)}) '
+            f'VALUES ({", ".join("?" * len(fields))})',
+            ('Нагрузка', '+70000000000', 'bench@example.com', '', '', '2026-01-01 00:00:00'),
+        )
+        return reader, writer
+
+    def _run(self, source, mode, statements, options):
+        """Прогон на свежей копии базы; {'reader'|'writer': (задержки, ошибки)}"""
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = str(Path(directory) / 'bench.sqlite3')
+            # backup, а не копия файла: учитывает ещё не перенесённое из -wal
+            with sqlite3.connect(source) as src, sqlite3.connect(db_path) as dst:
+                src.backup(dst)
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            roles = ['reader'] * options['readers'] + ['writer'] * options['writers']
+            processes = [
+                context.Process(
+                    target=_worker,
+                    args=(db_path, mode, role, statements[role == 'writer'], options['seconds'], results),
+                )
+                for role in roles
+            ]
+            for process in processes:
+                process.start()
+            collected = {'reader': ([], 0), 'writer': ([], 0)}
+            for _ in processes:
+                role, latencies, errors = results.get()
+                collected[role] = (collected[role][0] + latencies, collected[role][1] + errors)
+            for process in processes:
+                process.join()
+        return collected
+
+    def _report(self, title, collected, seconds):
+        self.stdout.write(title)
+        for role, (latencies, errors) in collected.items():
+            if not latencies:
+                self.stdout.write(f'  {role}: ни одной успешной операции, ошибок {errors}')
+                continue
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            self.stdout.write(
+                f'  {role}: {len(latencies) / seconds:8.0f} оп/с, '
+                f'p50 {statistics.median(latencies) * 1000:6.2f} мс, p95 {p95:6.2f} мс, '
+                f'ошибок «locked» {errors}'
+            )
+
+    def handle(self, *args, **options):
+        source = str(settings.DATABASES['default']['NAME'])
+        statements = self._statements()
+        # Соединение команды закрываем до fork: дочерние процессы открывают свои
+        connection.close()
+
+        tuned = {
+            'pragmas': getattr(settings, 'SQLITE_PRAGMAS', {}),
+            'reuse': bool(settings.DATABASES['default'].get('CONN_MAX_AGE')),
+            'begin': f"BEGIN {settings.DATABASES['default']['OPTIONS'].get('transaction_mode', '')}".strip(),
+        }
+        self.stdout.write(
+            f"Читателей {options['readers']}, писателей {options['writers']}, {options['seconds']:g} с на прогон"
+        )
+        for title, mode in (('До: журнал отката, соединение на запрос', BASELINE),
+                            ('После: SQLITE_PRAGMAS, CONN_MAX_AGE', tuned)):
+            self._report(title, self._run(source, mode, statements, options), options['seconds'])
@@ -0,0 +1,173 @@
+# shop/management/commands/views_benchmark.py
+import json
+import os
+import platform
+import socket
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from importlib.util import find_spec
+from pathlib import Path
+from unittest import mock
+
+import django
+from captcha.conf import settings as captcha_settings
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from shop import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон страниц и форм на синтетическом каталоге во временной базе: '
+        'пропускная способность, p50/p95/p99, запросы к БД и попадания в кеш (холодный и тёплый кеш)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=60, help='Товаров')
+        parser.add_argument('--prices', type=int, default=4, help='Размеров у товара')
+        parser.add_argument('--images', type=int, default=5, help='Фотографий у товара')
+        parser.add_argument('--options', type=int, default=120, help='Дополнительных опций')
+        parser.add_argument('--works', type=int, default=3000, help='Фотографий работ')
+        parser.add_argument('--requests', type=int, default=50, help='Запросов на сценарий в каждой фазе')
+        parser.add_argument(
+            '--scenario', action='append', choices=list(benchmark.SCENARIOS),
+            help='Только этот сценарий (можно несколько раз)',
+        )
+        parser.add_argument(
+            '--server', choices=('client', 'gunicorn', 'both'), default='client',
+            help='Тестовый клиент в процессе команды, локальный gunicorn или оба',
+        )
+        parser.add_argument('--workers', type=int, default=3, help='Воркеров gunicorn')
+        parser.add_argument('--concurrency', type=int, default=8, help='Параллельных запросов к gunicorn (тёплый кеш)')
+        parser.add_argument('--output', help='Файл результатов (по умолчанию benchmarks/<время>-<коммит>.json)')
+        parser.add_argument('--compare', help='JSON прошлого прогона: вывести ухудшения и завершиться с ошибкой')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Допустимое ухудшение времени и пропускной способности (доля, по умолчанию 0.2)',
+        )
+
+    def handle(self, *args, **options):
+        if options['server'] != 'client' and find_spec('gunicorn') is None:
+            raise CommandError('gunicorn не установлен (pip install gunicorn) — используйте --server client')
+        baseline = benchmark.load(options['compare']) if options['compare'] else None
+        scenarios = options['scenario'] or list(benchmark.SCENARIOS)
+
+        runs = {}
+        with tempfile.TemporaryDirectory(prefix='views-benchmark-') as directory, \
+                benchmark.scratch_environment(directory) as db_path, \
+                mock.patch.object(captcha_settings, 'CAPTCHA_TEST_MODE', True):
+            started = time.perf_counter()
+            dataset = benchmark.seed(
+                products=options['products'], prices=options['prices'], images_per_product=options['images'],
+                options=options['options'], works=options['works'],
+            )
+            self.stdout.write(f'Каталог создан за {time.perf_counter() - started:.1f} с')
+
+            if options['server'] in ('client', 'both'):
+                runs['client'] = self._run(benchmark.ClientDriver(), dataset, scenarios, options)
+            if options['server'] in ('gunicorn', 'both'):
+                with self._gunicorn(directory, db_path, options) as driver:
+                    runs['gunicorn'] = self._run(driver, dataset, scenarios, options)
+
+        result = {
+            'commit': self._commit(),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'dataset': {key: options[key] for key in ('products', 'prices', 'images', 'options', 'works')},
+            'requests': options['requests'],
+            'gunicorn': {'workers': options['workers'], 'concurrency': options['concurrency']},
+            'runs': runs,
+        }
+        output = Path(options['output'] or self._default_output(result))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, ensure_ascii=False, indent=2) + '\n')
+        self.stdout.write(self.style.SUCCESS(f'Результаты: {output}'))
+
+        if baseline is not None:
+            self._compare(baseline, result, options['threshold'])
+
+    def _run(self, driver, dataset, scenarios, options):
+        self.stdout.write(
+            f'\n{driver.name}\n{"сценарий":<22}{"фаза":<6}{"зап/с":>9}{"p50, мс":>10}{"p95, мс":>10}'
+            f'{"p99, мс":>10}{"SQL":>7}{"кеш":>7}{"ошибок":>8}'
+        )
+        results = {}
+        for scenario in scenarios:
+            results[scenario] = benchmark.run_scenario(driver, dataset, scenario, options['requests'])
+            for phase, stats in results[scenario].items():
+                hit_rate = '—' if stats['cache_hit_rate'] is None else f'{stats["cache_hit_rate"]:.0%}'
+                self.stdout.write(
+                    f'{scenario:<22}{phase:<6}{stats["rps"]:>9.1f}{stats["p50_ms"]:>10.2f}{stats["p95_ms"]:>10.2f}'
+                    f'{stats["p99_ms"]:>10.2f}{stats["queries_per_request"]:>7.1f}{hit_rate:>7}{stats["errors"]:>8}'
+                )
+        return results
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    @contextmanager
+    def _gunicorn(self, directory, db_path, options):
+        """gunicorn на временной базе и HttpDriver к нему"""
+        token = benchmark.new_token()
+        module = benchmark.server_settings_module(directory, db_path, token)
+        port = self._free_port()
+        # Сервер открывает базу сам; соединения команды к этому моменту не нужны
+        connections.close_all()
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': module,
+            'PYTHONPATH': os.pathsep.join([directory, str(settings.BASE_DIR), os.environ.get('PYTHONPATH', '')]),
+        }
+        process = subprocess.Popen(benchmark.server_command(port, options['workers']), cwd=settings.BASE_DIR, env=env)
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                if process.poll() is not None:
+                    raise CommandError(f'gunicorn завершился с кодом {process.returncode}')
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise CommandError('gunicorn не начал принимать соединения за 30 с')
+                    time.sleep(0.2)
+            driver = benchmark.HttpDriver(port, token, concurrency=options['concurrency'])
+            driver.csrf_token()  # до замеров: запрос страницы заказа не попадёт в сценарий
+            yield driver
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    @staticmethod
+    def _commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return 'unknown'
+
+    @staticmethod
+    def _default_output(result):
+        stamp = timezone.localtime().strftime('%Y%m%d-%H%M%S')
+        return Path(settings.BASE_DIR) / 'benchmarks' / f'{stamp}-{result["commit"]}.json'
+
+    def _compare(self, baseline, result, threshold):
+        regressions = benchmark.compare(baseline, result, threshold)
+        self.stdout.write(f'\nСравнение с {baseline.get("commit", "?")} ({baseline.get("created_at", "?")})')
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('Ухудшений нет'))
+            return
+        for server, scenario, phase, key, was, now in regressions:
+            self.stdout.write(self.style.ERROR(f'  {server} {scenario} {phase}: {key} {was} -> {now}'))
+        raise CommandError(f'Ухудшений: {len(regressions)}')
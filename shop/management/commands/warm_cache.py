@@ -0,0 +1,38 @@
+# shop/management/commands/warm_cache.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop import cache_bus, warmup
+
+
+class Command(BaseCommand):
+    help = 'Прогрев кеша страниц и данных: в процессе команды с замером времени и во всех воркерах через шину'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            default=settings.CACHE_WARMUP_PARALLEL,
+            help='Страниц одновременно',
+        )
+        parser.add_argument(
+            '--slowest',
+            type=int,
+            default=5,
+            help='Сколько самых медленных страниц показать',
+        )
+
+    def handle(self, *args, **options):
+        results, elapsed = warmup.warm(parallel=options['parallel'])
+        self.stdout.write(
+            f'Прогрето страниц: {len(results)} за {elapsed:.2f} с (потоков: {options["parallel"]})'
+        )
+        for path, status, seconds in sorted(results, key=lambda result: -result[2])[:options['slowest']]:
+            self.stdout.write(f'  {seconds * 1000:8.1f} мс  {path}')
+        failed = [(path, status) for path, status, _ in results if status >= 400]
+        for path, status in failed:
+            self.stdout.write(self.style.ERROR(f'  {status}  {path}'))
+
+        # L1 свой в каждом воркере: они прогреются сами по сигналу, страницы возьмут из общего L2
+        cache_bus.invalidate([warmup.WARMUP_KEY])
+        self.stdout.write(self.style.SUCCESS('Воркеры получили сигнал прогрева через шину инвалидации'))
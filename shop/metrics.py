@@ -0,0 +1,424 @@
+# shop/metrics.py
+"""
+Метрики производительности: гистограммы и счётчики
+
+Каждый воркер считает свои значения в памяти. Границы корзин — верхние
+(значение, равное границе, попадает в её корзину), последняя корзина — всё,
+что больше самой большой границы.
+
+Чтобы /metrics/ показывал все воркеры gunicorn, а не тот, что обработал
+запрос, каждый процесс периодически записывает снимок своих метрик в общий
+файл SQLite (settings.METRICS_PATH, строка на процесс, см. start_flusher).
+При выдаче снимки всех процессов складываются (aggregate) и выводятся в
+текстовом формате Prometheus (render_prometheus). Снимки завершившихся
+процессов при записи сливаются в одну строку RETIRED: счётчики не убывают
+после перезапуска воркера, а файл не растёт с каждым перезапуском.
+Обнуляет их только очистка файла.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Секунды: от 1 мс до 2.5 с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Запросов к БД за HTTP-запрос
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Байты тела ответа: от 1 КБ до 1 МБ
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_snapshots (
+    process TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+# Все метрики процесса по имени, в порядке объявления
+REGISTRY = {}
+
+_local = threading.local()
+# Потоки, чьи наблюдения не учитываются (см. muted)
+_muted = threading.local()
+_flusher_lock = threading.Lock()
+_flusher_pid = None
+# Имя процесса в файле снимков: pid повторяется после перезапуска, время старта — нет
+_process = None
+# Строка с суммой снимков завершившихся процессов
+RETIRED = 'retired'
+_dirty = False
+
+
+@contextmanager
+def muted():
+    """
+    Не учитывать наблюдения текущего потока: служебные рендеры прогрева
+    (shop/warmup.py) не должны попадать в метрики запросов посетителей
+    """
+    previous = getattr(_muted, 'active', False)
+    _muted.active = True
+    try:
+        yield
+    finally:
+        _muted.active = previous
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, description, labels=('label',)):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+        REGISTRY[name] = self
+
+    def snapshot(self):
+        raise NotImplementedError
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter(_Metric):
+    """Счётчик, который только растёт; метка — строка или кортеж по числу labels"""
+
+    type = 'counter'
+
+    def inc(self, label, amount=1):
+        global _dirty
+        if getattr(_muted, 'active', False):
+            return
+        with self._lock:
+            self._series[label] = self._series.get(label, 0) + amount
+        _dirty = True
+
+    def snapshot(self):
+        """{метка: значение} — копия на момент вызова"""
+        with self._lock:
+            return dict(self._series)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS, labels=('label',)):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, label, seconds):
+        global _dirty
+        if getattr(_muted, 'active', False):
+            return
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][index] += 1
+            series['sum'] += seconds
+            series['count'] += 1
+        _dirty = True
+
+    def snapshot(self):
+        """{метка: {'counts': [...], 'sum': с, 'count': n}} — копия на момент вызова"""
+        with self._lock:
+            return {
+                label: {**series, 'counts': list(series['counts'])}
+                for label, series in self._series.items()
+            }
+
+    def quantile(self, series, q):
+        """Оценка квантиля сверху: граница корзины, в которую он попадает"""
+        rank = q * series['count']
+        seen = 0
+        for bound, count in zip(self.buckets, series['counts']):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+template_render_seconds = Histogram(
+    'shop_template_render_seconds', 'Время рендера шаблона верхнего уровня',
+    labels=('template',),
+)
+request_seconds = Histogram(
+    'shop_request_duration_seconds', 'Время обработки запроса по view',
+    labels=('view',),
+)
+request_db_queries = Histogram(
+    'shop_request_db_queries', 'Запросов к БД за HTTP-запрос по view',
+    buckets=QUERY_COUNT_BUCKETS, labels=('view',),
+)
+request_db_seconds = Histogram(
+    'shop_request_db_seconds', 'Суммарное время запросов к БД за HTTP-запрос по view',
+    labels=('view',),
+)
+response_size_bytes = Histogram(
+    'shop_response_size_bytes', 'Размер тела ответа до сжатия по view (потоковые ответы не учитываются)',
+    buckets=SIZE_BUCKETS, labels=('view',),
+)
+cache_requests = Counter(
+    'shop_cache_requests_total', 'Обращения к кешу по семействам ключей: hit, stale (устаревшее значение) или miss',
+    labels=('family', 'result'),
+)
+
+
+_FAMILY_SUFFIX_RE = re.compile(r'_\d+$')
+
+
+def key_family(key):
+    """
+    Семейство ключа кеша для метки метрики
+
+    'product_detail_12' -> 'product_detail_*', 'page:3f2a…' -> 'page:*',
+    'products_catalog' -> 'products_catalog'. Так число меток не растёт
+    вместе с числом товаров и страниц.
+    """
+    prefix, sep, _ = key.partition(':')
+    if sep:
+        return f'{prefix}:*'
+    return _FAMILY_SUFFIX_RE.sub('_*', key)
+
+
+def record_cache_request(key, result):
+    """Наблюдатель обращений к кешу (shop.utils.observe)"""
+    cache_requests.inc((key_family(key), result))
+
+
+class QueryTimer:
+    """
+    Обёртка для connection.execute_wrapper(): число и время запросов к БД
+
+    Использование:
+    timer = QueryTimer()
+    with connection.execute_wrapper(timer):
+        ...
+    timer.count, timer.seconds
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+# ============================================
+# Сбор со всех воркеров
+# ============================================
+
+def _metrics_path():
+    return str(getattr(settings, 'METRICS_PATH', settings.BASE_DIR / 'metrics.sqlite3'))
+
+
+def _connection():
+    """Соединение с файлом снимков (отдельное на поток, пересоздаётся после fork и смены пути)"""
+    path = _metrics_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid() or _local.path != path:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = path
+    return conn
+
+
+def _process_name():
+    global _process
+    if _process is None or not _process.startswith(f'{os.getpid()}:'):
+        _process = f'{os.getpid()}:{time.time():.6f}'
+    return _process
+
+
+def _label_key(label):
+    return list(label) if isinstance(label, tuple) else [label]
+
+
+def dump():
+    """Снимок метрик процесса в виде, пригодном для JSON: {имя: [[значения меток], данные], ...}"""
+    return {
+        name: [[_label_key(label), data] for label, data in metric.snapshot().items()]
+        for name, metric in REGISTRY.items()
+    }
+
+
+def _merge(metric, total, data):
+    if metric.type == 'counter':
+        return (total or 0) + data
+    if total is None:
+        return {**data, 'counts': list(data['counts'])}
+    if len(total['counts']) != len(data['counts']):
+        return total  # снимок процесса со старыми границами корзин
+    total['counts'] = [a + b for a, b in zip(total['counts'], data['counts'])]
+    total['sum'] += data['sum']
+    total['count'] += data['count']
+    return total
+
+
+def aggregate(dumps):
+    """Сумма снимков нескольких процессов: {имя: {кортеж значений меток: данные}}"""
+    result = {name: {} for name in REGISTRY}
+    for snapshot in dumps:
+        for name, series in snapshot.items():
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            for label, data in series:
+                label = tuple(label)
+                result[name][label] = _merge(metric, result[name].get(label), data)
+    return result
+
+
+def _alive(pid):
+    if pid == os.getpid() or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)  # сигнал 0 только проверяет, что процесс есть
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # процесс другого пользователя
+    return True
+
+
+def _as_dump(aggregated):
+    return {name: [[_label_key(label), data] for label, data in series.items()] for name, series in aggregated.items()}
+
+
+def _retire_dead(conn):
+    """Слить снимки завершившихся процессов в строку RETIRED"""
+    rows = conn.execute('SELECT process, pid FROM metric_snapshots WHERE process != ?', (RETIRED,)).fetchall()
+    dead = [process for process, pid in rows if not _alive(pid)]
+    if not dead:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        placeholders = ','.join('?' * len(dead))
+        # Внутри транзакции: тот же снимок мог уже слить другой процесс
+        dumps = [json.loads(data) for (data,) in conn.execute(
+            f'SELECT data FROM metric_snapshots WHERE process IN ({placeholders}) OR process = ?', (*dead, RETIRED),
+        )]
+        conn.execute(f'DELETE FROM metric_snapshots WHERE process IN ({placeholders})', dead)
+        conn.execute(
+            'INSERT INTO metric_snapshots (process, pid, updated_at, data) VALUES (?, 0, ?, ?) '
+            'ON CONFLICT(process) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data',
+            (RETIRED, time.time(), json.dumps(_as_dump(aggregate(dumps)))),
+        )
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def flush():
+    """Записать снимок метрик текущего процесса в общий файл"""
+    global _dirty
+    _dirty = False
+    try:
+        conn = _connection()
+        conn.execute(
+            'INSERT INTO metric_snapshots (process, pid, updated_at, data) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(process) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data',
+            (_process_name(), os.getpid(), time.time(), json.dumps(dump())),
+        )
+    except sqlite3.Error:
+        _dirty = True
+        logger.warning('Не удалось записать снимок метрик', exc_info=True)
+        return
+    try:
+        _retire_dead(conn)
+    except sqlite3.Error:
+        logger.warning('Не удалось слить снимки завершившихся процессов', exc_info=True)
+
+
+def collect():
+    """Метрики всех процессов: снимки из файла, для текущего — свежие значения из памяти"""
+    current = _process_name()
+    dumps = [dump()]
+    try:
+        rows = _connection().execute('SELECT process, data FROM metric_snapshots').fetchall()
+    except sqlite3.Error:
+        logger.warning('Не удалось прочитать снимки метрик, показан только текущий процесс', exc_info=True)
+        rows = []
+    dumps.extend(json.loads(data) for process, data in rows if process != current)
+    return aggregate(dumps)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return f'{value:g}' if isinstance(value, float) else str(value)
+
+
+def render_prometheus(aggregated):
+    """Текстовый формат экспозиции Prometheus 0.0.4"""
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.description}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for label, data in sorted(aggregated.get(name, {}).items()):
+            if metric.type == 'counter':
+                lines.append(f'{name}{_labels(metric.labels, label)} {_number(data)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, data['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(metric.labels, label, [("le", _number(float(bound)))])} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(metric.labels, label, [("le", "+Inf")])} {data["count"]}')
+            lines.append(f'{name}_sum{_labels(metric.labels, label)} {_number(float(data["sum"]))}')
+            lines.append(f'{name}_count{_labels(metric.labels, label)} {data["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _run(interval):
+    while True:
+        time.sleep(interval)
+        if _dirty:
+            flush()
+
+
+def start_flusher():
+    """Запустить фоновую запись снимков в текущем процессе (повторный вызов ничего не делает)"""
+    global _flusher_pid
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', None)
+    if not interval or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        threading.Thread(target=_run, args=(interval,), name='metrics-flusher', daemon=True).start()
+        atexit.register(flush)
+        _flusher_pid = os.getpid()
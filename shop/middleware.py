@@ -0,0 +1,127 @@
+# shop/middleware.py
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+
+from . import cache_bus, compression, metrics, routers
+
+
+class CacheInvalidationMiddleware:
+    """Применяет инвалидации кеша из других воркеров до обработки запроса"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        cache_bus.sync()
+        return self.get_response(request)
+
+
+class ReadReplicaMiddleware:
+    """Безопасные запросы вне админки читают из базы только для чтения (shop/routers.py)"""
+
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._admin_prefix = None
+
+    def __call__(self, request):
+        if self._admin_prefix is None:
+            self._admin_prefix = reverse('admin:index')
+        if request.method in self.safe_methods and not request.path.startswith(self._admin_prefix):
+            with routers.read_from_replica():
+                return self.get_response(request)
+        return self.get_response(request)
+
+
+class CompressionMiddleware:
+    """
+    Сжатие ответов вместо GZipMiddleware
+
+    Страница из кеша приходит с готовыми вариантами тела
+    (response.precompressed, см. shop/page_cache.py) — всю страницу заново
+    не сжимаем. Остальные ответы сжимаются целиком и сохраняют
+    Content-Length, потоковые и больше STREAM_THRESHOLD — по мере отдачи.
+    """
+
+    # Меньше сжимать невыгодно: заголовки gzip съедят выигрыш
+    min_length = 200
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < self.min_length:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        precompressed = getattr(response, 'precompressed', None)
+        offered = tuple(precompressed) if precompressed else compression.available_encodings()
+        encoding = compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''), offered)
+        if encoding is None:
+            return response
+
+        if precompressed:
+            response.content = precompressed[encoding]()
+            response.headers['Content-Length'] = str(len(response.content))
+        elif response.streaming:
+            response.streaming_content = compression.compress_stream(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        elif len(response.content) > compression.STREAM_THRESHOLD:
+            response = self._to_streaming(response, compression.compress_content(response.content, encoding))
+        else:
+            response.content = compression.compress(response.content, encoding)
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # Сжатое тело побайтно другое: строгий ETag получает суффикс кодировки
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = compression.encoded_etag(etag, encoding)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def _to_streaming(self, response, content):
+        streaming = StreamingHttpResponse(content, status=response.status_code, reason=response.reason_phrase)
+        for header, value in response.items():
+            if header.lower() != 'content-length':
+                streaming.headers[header] = value
+        streaming.cookies = response.cookies
+        return streaming
+
+
+class RequestMetricsMiddleware:
+    """
+    Время ответа, запросы к БД и размер ответа по view (shop/metrics.py)
+
+    Стоит после CompressionMiddleware: размер считается до сжатия, а
+    запросы к БД — все, включая сессии и аутентификацию.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = metrics.QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'  # 404 и ответы до маршрутизации
+        metrics.request_seconds.observe(view, elapsed)
+        metrics.request_db_queries.observe(view, timer.count)
+        metrics.request_db_seconds.observe(view, timer.seconds)
+        if not response.streaming:
+            metrics.response_size_bytes.observe(view, len(response.content))
+        return response
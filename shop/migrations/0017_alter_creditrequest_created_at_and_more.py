@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_remove_product_height_remove_product_rest_room_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='creditrequest',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Дата создания'),
+        ),
+        migrations.AlterField(
+            model_name='orderrequest',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False, verbose_name='Дата создания'),
+        ),
+    ]
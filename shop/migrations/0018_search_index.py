@@ -0,0 +1,33 @@
+from django.db import migrations
+
+# Копия схемы на момент миграции: миграция не зависит от кода shop.search.
+# Основы слов пишет стеммер приложения, поэтому токенайзер только режет по словам.
+# Индекс заполняется после миграций (shop.search.fill_after_migrate) тем же
+# стеммером, которым разбираются запросы.
+CREATE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS shop_search USING fts5("
+    "title, body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS shop_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_alter_creditrequest_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:14
+
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+# Копия разбора размеров на момент миграции: код приложения может измениться,
+# а миграция должна заполнять поля так же, как при её создании
+_NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)?')
+CENTIMETRES_FROM = Decimal(20)
+_PRECISION = Decimal('0.01')
+
+
+def parse_meters(value):
+    numbers = []
+    for number in _NUMBER_RE.findall(value or ''):
+        try:
+            numbers.append(Decimal(number.replace(',', '.')))
+        except InvalidOperation:
+            continue
+    if not numbers:
+        return None
+    meters = max(numbers)
+    if meters >= CENTIMETRES_FROM:
+        meters /= 100
+    return meters.quantize(_PRECISION)
+
+
+DIMENSION_FIELDS = {
+    'total_length': 'length_m',
+    'steam_room_length': 'steam_room_m',
+    'rest_room': 'rest_room_m',
+    'height': 'height_m',
+    'width': 'width_m',
+}
+
+
+def fill_dimensions(apps, schema_editor):
+    ProductPrice = apps.get_model('shop', 'ProductPrice')
+    prices = list(ProductPrice.objects.all())
+    for price in prices:
+        for text_field, number_field in DIMENSION_FIELDS.items():
+            setattr(price, number_field, parse_meters(getattr(price, text_field)))
+    ProductPrice.objects.bulk_update(prices, list(DIMENSION_FIELDS.values()), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productprice',
+            name='height_m',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=6, null=True, verbose_name='Высота, м'),
+        ),
+        migrations.AddField(
+            model_name='productprice',
+            name='length_m',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=6, null=True, verbose_name='Длина, м'),
+        ),
+        migrations.AddField(
+            model_name='productprice',
+            name='rest_room_m',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=6, null=True, verbose_name='Комната отдыха, м'),
+        ),
+        migrations.AddField(
+            model_name='productprice',
+            name='steam_room_m',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=6, null=True, verbose_name='Длина парной, м'),
+        ),
+        migrations.AddField(
+            model_name='productprice',
+            name='width_m',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=6, null=True, verbose_name='Ширина, м'),
+        ),
+        migrations.AddIndex(
+            model_name='productprice',
+            index=models.Index(fields=['length_m'], name='shop_produc_length__3cfb93_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productprice',
+            index=models.Index(fields=['steam_room_m'], name='shop_produc_steam_r_065619_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productprice',
+            index=models.Index(fields=['price'], name='shop_produc_price_366ba9_idx'),
+        ),
+        migrations.RunPython(fill_dimensions, migrations.RunPython.noop),
+    ]
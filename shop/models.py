@@ -1,7 +1,111 @@
+import re
+from decimal import Decimal, InvalidOperation
+
 from django.db import models
-from django.core.cache import cache
+from django.utils import timezone
 from django.utils.functional import cached_property
 
+from .signals import bulk_changed, tracked_fields
+from .utils import cache_fetch
+
+_NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)?')
+# Число не меньше этого — сантиметры («170/195» в комнате отдыха)
+CENTIMETRES_FROM = Decimal(20)
+_PRECISION = Decimal('0.01')
+
+
+def parse_meters(value):
+    """
+    Размер из текста поля ProductPrice в метрах или None
+
+    Из нескольких вариантов («2.2/2.25») берётся наибольший: подходит
+    под фильтр «от», если подходит хотя бы один вариант планировки.
+    """
+    numbers = []
+    for number in _NUMBER_RE.findall(value or ''):
+        try:
+            numbers.append(Decimal(number.replace(',', '.')))
+        except InvalidOperation:
+            continue
+    if not numbers:
+        return None
+    meters = max(numbers)
+    if meters >= CENTIMETRES_FROM:
+        meters /= 100
+    return meters.quantize(_PRECISION)
+
+
+class BulkSignalQuerySet(models.QuerySet):
+    """QuerySet, сообщающий о массовых операциях без сигналов (bulk_changed, shop/signals.py)"""
+
+    def update(self, **kwargs):
+        if not bulk_changed.has_listeners(self.model):
+            return super().update(**kwargs)
+        fields = tracked_fields(self.model)
+        affected = list(self.only('pk', *fields))
+        rows = super().update(**kwargs)
+        if rows:
+            if set(kwargs) & set(fields):
+                # Объект мог перейти к другим ключам (другой товар) — подписчикам нужны оба состояния
+                affected += self.model._base_manager.filter(pk__in=[obj.pk for obj in affected]).only('pk', *fields)
+            bulk_changed.send(sender=self.model, instances=affected, fields=set(kwargs))
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            bulk_changed.send(sender=self.model, instances=objs, fields=None)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if rows:
+            bulk_changed.send(sender=self.model, instances=objs, fields=set(fields))
+        return rows
+
+
+class ProductPriceQuerySet(BulkSignalQuerySet):
+    """Числовые размеры *_m заполняются и при массовых операциях, а не только в save()"""
+
+    def update(self, **kwargs):
+        dimensions = self.model.DIMENSION_FIELDS
+        computed = [field for field in kwargs if field in dimensions and hasattr(kwargs[field], 'resolve_expression')]
+        for text_field in set(kwargs) & set(dimensions):
+            if text_field not in computed:
+                kwargs[dimensions[text_field]] = parse_meters(kwargs[text_field])
+        if not computed:
+            return super().update(**kwargs)
+        # Значение выражения (F(), Concat()) известно только после записи — разбираем заново
+        pks = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        prices = list(self.model._base_manager.filter(pk__in=pks).only('pk', *computed))
+        for price in prices:
+            for text_field in computed:
+                setattr(price, dimensions[text_field], parse_meters(getattr(price, text_field)))
+        self.model._base_manager.bulk_update(prices, [dimensions[field] for field in computed], batch_size=500)
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.normalize_dimensions()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        dimensions = self.model.DIMENSION_FIELDS
+        changed = set(fields) & set(dimensions)
+        if changed:
+            objs = list(objs)
+            for obj in objs:
+                obj.normalize_dimensions()
+            fields = [*fields, *(dimensions[field] for field in changed if dimensions[field] not in fields)]
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
 class Product(models.Model):
     title = models.CharField('Название', max_length=200, db_index=True)
     price = models.DecimalField('Цена', max_digits=10, decimal_places=0)
@@ -10,6 +114,8 @@ class Product(models.Model):
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
     is_featured = models.BooleanField('Популярная модель', default=False, db_index=True)
 
+    objects = BulkSignalQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
@@ -26,18 +132,6 @@ class Product(models.Model):
         """Кешированное форматирование цены"""
         return f"{self.price:,} ₽".replace(',', ' ')
 
-    def save(self, *args, **kwargs):
-        """Очистка кеша при сохранении"""
-        super().save(*args, **kwargs)
-        # Очистка всех связанных кешей
-        cache.delete_many([
-            'products_all',
-            'products_featured',
-            'products_catalog',
-            f'product_{self.pk}',
-            f'product_detail_{self.pk}',
-        ])
-
 
 class CreditRequest(models.Model):
     """Модель для хранения заявок на консультацию по кредиту."""
@@ -50,7 +144,8 @@ class CreditRequest(models.Model):
     fio = models.CharField('ФИО клиента', max_length=200)
     phone = models.CharField('Телефон клиента', max_length=20)
     status = models.CharField('Статус заявки', max_length=20, choices=STATUS_CHOICES, default='new')
-    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    # Не auto_now_add: заявка из очереди (shop/ingest.py) сохраняет время подачи
+    created_at = models.DateTimeField('Дата создания', default=timezone.now, editable=False)
 
     class Meta:
         verbose_name = 'Заявка на кредит'
@@ -79,23 +174,49 @@ class ProductPrice(models.Model):
     height = models.CharField('Высота (м)', max_length=50, blank=True, help_text='Например: 2.4')
     width = models.CharField('Ширина (м)', max_length=50, blank=True, help_text='Например: 5')
 
+    # Те же размеры числами в метрах для фильтра каталога (shop/facets.py), заполняются при
+    # сохранении и массовых операциях (ProductPriceQuerySet)
+    length_m = models.DecimalField('Длина, м', max_digits=6, decimal_places=2, null=True, editable=False)
+    steam_room_m = models.DecimalField('Длина парной, м', max_digits=6, decimal_places=2, null=True, editable=False)
+    rest_room_m = models.DecimalField('Комната отдыха, м', max_digits=6, decimal_places=2, null=True, editable=False)
+    height_m = models.DecimalField('Высота, м', max_digits=6, decimal_places=2, null=True, editable=False)
+    width_m = models.DecimalField('Ширина, м', max_digits=6, decimal_places=2, null=True, editable=False)
+
+    # Текстовое поле -> числовое
+    DIMENSION_FIELDS = {
+        'total_length': 'length_m',
+        'steam_room_length': 'steam_room_m',
+        'rest_room': 'rest_room_m',
+        'height': 'height_m',
+        'width': 'width_m',
+    }
+
+    objects = ProductPriceQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Цена товара'
         verbose_name_plural = 'Цены товара'
         ordering = ['order', 'price']
         indexes = [
             models.Index(fields=['product', 'order']),
+            models.Index(fields=['length_m']),
+            models.Index(fields=['steam_room_m']),
+            models.Index(fields=['price']),
         ]
 
     def __str__(self):
         return f"{self.product.title} - {self.name} - {self.price} ₽"
 
+    def normalize_dimensions(self):
+        for text_field, number_field in self.DIMENSION_FIELDS.items():
+            setattr(self, number_field, parse_meters(getattr(self, text_field)))
+
     def save(self, *args, **kwargs):
+        self.normalize_dimensions()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(self.DIMENSION_FIELDS):
+            kwargs['update_fields'] = {*update_fields, *self.DIMENSION_FIELDS.values()}
         super().save(*args, **kwargs)
-        # Очистка кеша продукта при изменении цены
-        cache.delete_many([
-            f'product_detail_{self.product.pk}',
-        ])
 
 class ProductImage(models.Model):
     product = models.ForeignKey(
@@ -107,6 +228,8 @@ class ProductImage(models.Model):
     image = models.ImageField('Изображение', upload_to='product_images/')
     order = models.PositiveIntegerField('Порядок', default=0, db_index=True)
 
+    objects = BulkSignalQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Изображение товара'
         verbose_name_plural = 'Изображения товара'
@@ -118,13 +241,6 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"Фото для {self.product.title}"
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Очистка кеша продукта при добавлении изображения
-        cache.delete_many([
-            f'product_detail_{self.product.pk}',
-        ])
-
 class GlobalOption(models.Model):
     CATEGORY_CHOICES = [
         ('exterior', '🏗️ Внешняя отделка и конструкция'),
@@ -153,6 +269,8 @@ class GlobalOption(models.Model):
     is_active = models.BooleanField('Активно', default=True, db_index=True)
     order = models.PositiveIntegerField('Порядок сортировки', default=0, db_index=True)
 
+    objects = BulkSignalQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Глобальная дополнительная услуга'
         verbose_name_plural = 'Глобальные дополнительные услуги'
@@ -169,16 +287,12 @@ class GlobalOption(models.Model):
         """Кешированное форматирование цены"""
         return f"{self.price:,} ₽".replace(',', ' ')
 
-    def save(self, *args, **kwargs):
-        """Очистка кеша при сохранении"""
-        super().save(*args, **kwargs)
-        cache.delete('global_options_active')
-        cache.delete('global_options_grouped')
-
 class WorkPhoto(models.Model):
     image = models.ImageField('Фотография', upload_to='works/')
     created_at = models.DateTimeField('Дата создания', auto_now_add=True, db_index=True)
 
+    objects = BulkSignalQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Фотография работы'
         verbose_name_plural = 'Фотографии работ'
@@ -196,7 +310,8 @@ class OrderRequest(models.Model):
     email = models.EmailField('Email', db_index=True)
     message = models.TextField('Сообщение', blank=True)
     order_details = models.TextField('Детали заказа', blank=True)
-    created_at = models.DateTimeField('Дата создания', auto_now_add=True, db_index=True)
+    # Не auto_now_add: заявка из очереди (shop/ingest.py) сохраняет время подачи
+    created_at = models.DateTimeField('Дата создания', default=timezone.now, editable=False, db_index=True)
 
     class Meta:
         verbose_name = 'Заявка'
@@ -216,6 +331,8 @@ class CompanyInfo(models.Model):
     email = models.EmailField('Email', blank=True)
     address = models.CharField('Адрес', max_length=300, blank=True)
 
+    objects = BulkSignalQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Информация о компании'
         verbose_name_plural = 'Информация о компании'
@@ -227,14 +344,9 @@ class CompanyInfo(models.Model):
         if not self.pk and CompanyInfo.objects.exists():
             raise ValueError('Можно создать только одну запись информации о компании')
         super().save(*args, **kwargs)
-        cache.delete('company_info')
 
     @classmethod
     def get_cached(cls):
         """Получить информацию о компании из кеша"""
-        info = cache.get('company_info')
-        if info is None:
-            info = cls.objects.first()
-            if info:
-                cache.set('company_info', info, 60 * 60 * 24)  # 24 часа
-        return info
+        # Отсутствие записи тоже кешируется: None — попадание, а не промах
+        return cache_fetch('company_info', cls.objects.first, soft_ttl=60 * 60 * 24)  # 24 часа
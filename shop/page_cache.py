@@ -0,0 +1,269 @@
+# shop/page_cache.py
+"""
+Кеш готовых HTML-страниц для анонимных GET-запросов
+
+Рендер главной (≈118 КБ) и карточки товара стоит дороже запросов к БД,
+поэтому страница целиком кладётся в кеш по пути и значениям параметров,
+которые объявил view (семейство 'page:*', сбрасывается сигналами из
+shop/invalidation.py). Остальные параметры (utm_*, случайные) ключ не
+меняют: иначе каждый такой адрес заводил бы свою запись. Персональные фрагменты
+вырезаются при сохранении и подставляются при каждой отдаче:
+- CSRF-токен заменяется заглушкой, при отдаче — get_token(request);
+- «дыры» {% page_hole 'name' %} (капча, текущая дата) перерисовываются
+  зарегистрированными через register_hole() функциями.
+ETag страницы — от её ключа и поколения кеша страниц в шине инвалидации
+(cache_bus.version_for): любое изменение данных сбрасывает 'page:*' и
+меняет ETag. Поэтому 304 отдаётся до обращения к кешу, даже если
+страницы в нём уже нет. Сжатые варианты получают свой строгий ETag с
+суффиксом кодировки (shop/compression.py). В ключ входит отпечаток
+выкладки (deploy_digest: исходники шаблонов и манифест статики): после
+деплоя с новой разметкой старые записи и ETag перестают совпадать без
+clear_cache. Страницы с дырами отдаются без ETag и Last-Modified: 304
+оставил бы у посетителя прежнюю капчу и вчерашнюю дату.
+Статичные куски тела хранятся и сжатыми: CompressionMiddleware отдаёт их
+без повторного сжатия всей страницы (см. shop/compression.py).
+"""
+import hashlib
+import os
+import re
+import time
+from dataclasses import dataclass
+from functools import lru_cache, wraps
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import HttpResponse, HttpResponseNotModified
+from django.middleware.csrf import get_token
+from django.template import engines
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags
+
+from . import cache_bus, compression
+from .utils import cache_fetch, make_cache_key
+
+CSRF_PLACEHOLDER = '__PAGE_CACHE_CSRF_TOKEN__'
+_CSRF_INPUT_RE = re.compile(r'name="csrfmiddlewaretoken" value="([A-Za-z0-9]+)"')
+_HOLE_RE = re.compile(r'<!--hole:(?P<name>[\w-]+)-->.*?<!--/hole:(?P=name)-->', re.S)
+# Места персональных фрагментов в сохранённом теле
+_DYNAMIC_RE = re.compile(
+    re.escape(CSRF_PLACEHOLDER) + r'|<!--hole:(?P<hole>[\w-]+)--><!--/hole:(?P=hole)-->'
+)
+
+# Имя дыры -> функция(request), возвращающая HTML фрагмента
+HOLE_RENDERERS = {}
+
+
+def register_hole(name, renderer):
+    """Зарегистрировать персональный фрагмент страницы, не попадающий в кеш"""
+    HOLE_RENDERERS[name] = renderer
+
+
+def render_hole(name, request):
+    # Прогрев (shop/warmup.py) только заполняет кеш, а содержимое дыры при
+    # сохранении всё равно вырезается: капчу для него не генерируем
+    html = '' if getattr(request, 'cache_warmup', False) else HOLE_RENDERERS[name](request)
+    return f'<!--hole:{name}-->{html}<!--/hole:{name}-->'
+
+
+@dataclass(frozen=True)
+class PageEntry:
+    """Снимок страницы в кеше; неизменяемый — L1 кеша отдаёт его без копии"""
+    # Статичные куски хранятся и сжатыми, см. shop/compression.py
+    segments: tuple
+    # Без персональных фрагментов тело одинаково для всех — сжато целиком
+    br: bytes | None
+    content_type: str
+    last_modified: int
+
+    @property
+    def has_holes(self):
+        return any(kind == 'hole' for kind, _, _ in self.segments)
+
+
+def _segments(content):
+    """
+    Тело страницы -> ((вид, значение, сжатое), ...): ('text', байты, raw deflate),
+    ('csrf', None, None), ('hole', имя, None)
+    """
+    segments = []
+    position = 0
+    for match in _DYNAMIC_RE.finditer(content):
+        if match.start() > position:
+            text = content[position:match.start()].encode()
+            segments.append(('text', text, compression.deflate_segment(text)))
+        if match['hole']:
+            segments.append(('hole', match['hole'], None))
+        else:
+            segments.append(('csrf', None, None))
+        position = match.end()
+    if position < len(content):
+        text = content[position:].encode()
+        segments.append(('text', text, compression.deflate_segment(text)))
+    return tuple(segments)
+
+
+def _freeze(request, response):
+    """Снимок ответа для кеша или None, если ответ кешировать нельзя"""
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return None
+    if response.has_header('Cache-Control') or response.has_header('Vary'):
+        return None
+    if response.charset.lower() not in ('utf-8', 'utf8'):
+        return None
+    content = response.content.decode(response.charset)
+
+    match = _CSRF_INPUT_RE.search(content)
+    if match:
+        content = content.replace(match.group(1), CSRF_PLACEHOLDER)
+    elif request.META.get('CSRF_COOKIE_USED'):
+        return None  # токен выведен не в форме — не умеем его вырезать
+    content = _HOLE_RE.sub(lambda m: f'<!--hole:{m["name"]}--><!--/hole:{m["name"]}-->', content)
+
+    segments = _segments(content)
+    return PageEntry(
+        segments=segments,
+        br=(
+            compression.brotli_compress(content.encode())
+            if compression.brotli and all(kind == 'text' for kind, _, _ in segments) else None
+        ),
+        content_type=response['Content-Type'],
+        # Запись перерисовывается после любой инвалидации, так что данные
+        # не могли измениться раньше момента рендера
+        last_modified=int(time.time()),
+    )
+
+
+@lru_cache(maxsize=None)
+def deploy_digest():
+    """
+    Отпечаток выкладки: исходники шаблонов и манифест статики
+
+    Считается один раз на процесс: шаблоны и статика меняются только с
+    деплоем, а после него воркеры перезапускаются.
+    """
+    digest = hashlib.sha1()
+    for engine in engines.all():
+        for directory in getattr(getattr(engine, 'engine', None), 'template_dirs', ()):
+            for root, dirs, files in os.walk(directory):
+                dirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    digest.update(f'{os.path.relpath(path, directory)}\0'.encode())
+                    with open(path, 'rb') as fh:
+                        digest.update(fh.read())
+    read_manifest = getattr(staticfiles_storage, 'read_manifest', None)
+    manifest = read_manifest() if read_manifest else None
+    digest.update((manifest or '').encode())
+    return digest.hexdigest()[:16]
+
+
+def _etag(key):
+    """Строгий ETag страницы: меняется с каждым сбросом её ключа, семейства 'page:*' или всего кеша"""
+    return '"%s"' % hashlib.sha1(f'{key}:{cache_bus.version_for(key)}'.encode()).hexdigest()[:32]
+
+
+def _matching_etag(request, etag):
+    """ETag из If-None-Match, совпавший с etag (в том числе вариант сжатия), или None"""
+    for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        if tag == '*' or compression.base_etag(tag) == etag:
+            return etag if tag == '*' else tag
+    return None
+
+
+def _validators(response, etag=None, last_modified=None):
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Браузер хранит копию, но перепроверяет её (304) при каждом визите
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _thaw(request, entry, etag):
+    pieces = []
+    for kind, value, deflated in entry.segments:
+        if kind == 'text':
+            pieces.append((value, deflated))
+        elif kind == 'csrf':
+            pieces.append((get_token(request).encode(), None))
+        else:
+            pieces.append((render_hole(value, request).encode(), None))
+    response = HttpResponse(b''.join(raw for raw, _ in pieces), content_type=entry.content_type)
+    # Готовые варианты тела для CompressionMiddleware (shop/middleware.py)
+    response.precompressed = {'gzip': lambda: compression.gzip_join(pieces)}
+    if entry.br is not None:
+        response.precompressed['br'] = lambda: entry.br
+    if entry.has_holes:
+        return _validators(response)  # без валидаторов: дыры перерисовываются при каждом визите
+    return _validators(response, etag, entry.last_modified)
+
+
+def page_key(path, params=()):
+    """Ключ страницы: отпечаток выкладки, путь и [(параметр, значения)] в порядке имён"""
+    return make_cache_key('page', deploy_digest(), path, *sorted(params))
+
+
+def _request_key(request, params):
+    return page_key(request.path, [
+        (name, tuple(request.GET.getlist(name))) for name in params if name in request.GET
+    ])
+
+
+def _is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    user = getattr(request, 'user', None)
+    return user is None or not user.is_authenticated
+
+
+def cache_page_anonymous(soft_ttl=60 * 60, hard_ttl=60 * 60 * 6, params=()):
+    """
+    Декоратор: кеширование отрендеренной страницы для анонимных посетителей
+
+    params — GET-параметры, от которых зависит страница: только они входят
+    в ключ кеша. Параметр, который view читает, но не объявил, отдаст
+    посетителю чужую страницу.
+
+    Использование:
+    @cache_page_anonymous(params=('length', 'price'))
+    def catalog(request): ...
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            rendered = {}
+
+            def render():
+                rendered['response'] = view(request, *args, **kwargs)
+                return _freeze(request, rendered['response'])
+
+            key = _request_key(request, params)
+            etag = _etag(key)
+            matched = _matching_etag(request, etag)
+            if matched is not None:
+                # Копия браузера совпадает с текущим поколением — кеш страниц не нужен
+                return _validators(HttpResponseNotModified(), matched)
+
+            entry = cache_fetch(key, render, soft_ttl=soft_ttl, hard_ttl=hard_ttl, cache_none=False)
+            if entry is None:
+                return rendered['response']
+            if entry.has_holes:
+                return _thaw(request, entry, etag)
+
+            # If-Modified-Since без If-None-Match; без условных заголовков — заготовка (200)
+            conditional = get_conditional_response(
+                request, last_modified=entry.last_modified,
+                response=_validators(HttpResponse(), etag, entry.last_modified),
+            )
+            if conditional.status_code != 200:
+                return conditional  # 304
+            return _thaw(request, entry, etag)
+
+        return wrapper
+
+    return decorator
+
@@ -0,0 +1,56 @@
+# shop/pagination.py
+"""
+Курсорная (keyset) пагинация
+
+Вместо OFFSET следующая страница выбирается условием «после последней
+записи предыдущей» по индексированному полю, поэтому стоимость запроса
+не растёт с номером страницы. Ничья по полю разрешается по id; в SQLite
+индекс по created_at уже содержит rowid, так что сортировка
+(created_at DESC, id DESC) идёт по индексу.
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([value.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(datetime, pk) или None для пустого и битого курсора"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        value = parse_datetime(value)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if value is None or not isinstance(pk, int):
+        return None
+    return value, pk
+
+
+def keyset_page(queryset, cursor, size, field='created_at'):
+    """
+    Страница по убыванию field: (объекты, курсор следующей страницы или '')
+
+    Использование:
+    photos, next_cursor = keyset_page(WorkPhoto.objects.all(), request.GET.get('after'), 24)
+    """
+    queryset = queryset.order_by(f'-{field}', '-id')
+    position = decode_cursor(cursor)
+    if position is not None:
+        value, pk = position
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+    items = list(queryset[:size + 1])
+    if len(items) <= size:
+        return items, ''
+    items = items[:size]
+    last = items[-1]
+    return items, encode_cursor(getattr(last, field), last.pk)
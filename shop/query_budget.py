@@ -0,0 +1,192 @@
+# shop/query_budget.py
+"""
+Бюджеты запросов к БД для view и списков админки
+
+Бюджет — наибольшее число запросов (по всем алиасам БД) и их суммарное
+время за один вызов:
+
+    @query_budget(queries=4, ms=50)
+    def catalog(request): ...
+
+    with QueryBudget(queries=2, name='импорт'):
+        ...
+
+Для админки — QueryBudgetAdminMixin и changelist_budget = (запросов, мс).
+
+Что делать при превышении, задаёт settings.QUERY_BUDGET_MODE: 'raise' —
+исключение QueryBudgetExceeded, 'log' — WARNING в лог shop, None —
+проверка выключена и ничего не стоит (так в продакшене). Тесты идут в
+режиме 'raise' (shop/test_runner.py). Исключение — только за число
+запросов: время зависит от машины, и превышение по миллисекундам даже в
+режиме 'raise' лишь пишется в лог. В отчёте —
+повторяющиеся запросы (один SQL больше одного раза — признак N+1) с местом
+вызова: строка кода проекта и, если запрос сделан при рендере, строка
+шаблона.
+"""
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Длина SQL в отчёте
+SQL_PREVIEW = 300
+# Обёртки проекта, которые сами ничего не запрашивают: место вызова ищется дальше по стеку
+_WRAPPER_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template_backend.py'),
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Превышен бюджет запросов (режим 'raise')"""
+
+
+def _mode():
+    return getattr(settings, 'QUERY_BUDGET_MODE', None)
+
+
+def _location(frame):
+    """
+    Место запроса: 'shop/views.py:110 in catalog; шаблон shop/catalog.html:42'
+
+    Строка кода — ближайший к запросу кадр проекта (не Django и не
+    site-packages), шаблон — ближайший узел шаблона при рендере.
+    """
+    root = str(settings.BASE_DIR) + os.sep
+    code = template = None
+    while frame is not None and (code is None or template is None):
+        filename = frame.f_code.co_filename
+        if template is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template = f'{origin.template_name}:{token.lineno}'
+        if (code is None and filename.startswith(root) and filename not in _WRAPPER_FILES
+                and 'site-packages' not in filename):
+            code = f'{os.path.relpath(filename, root)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    parts = [code or '?']
+    if template:
+        parts.append(f'шаблон {template}')
+    return '; '.join(parts)
+
+
+class QueryBudget(ContextDecorator):
+    """Бюджет запросов на блок кода или вызов функции"""
+
+    def __init__(self, queries=None, ms=None, name=None):
+        self.queries = queries
+        self.ms = ms
+        self.name = name
+        self.executed = []  # [(sql, секунды, место вызова)]
+        self._stack = None
+
+    def _recreate_cm(self):
+        # Отдельный экземпляр на вызов: декорированную view вызывают параллельно
+        return type(self)(self.queries, self.ms, self.name)
+
+    def __call__(self, func):
+        if self.name is None:
+            self.name = f'{func.__module__}.{func.__qualname__}'
+        wrapper = super().__call__(func)
+        wrapper.query_budget = self
+        return wrapper
+
+    def _record(self, execute, sql, params, many, context):
+        if sql.startswith('PRAGMA'):
+            # Настройка нового соединения (shop/sqlite_tuning.py), а не работа view
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.executed.append((sql, time.perf_counter() - started, _location(sys._getframe(1))))
+
+    def __enter__(self):
+        if not _mode():
+            return self
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self._stack is None:
+            return False
+        self._stack.close()
+        self._stack = None
+        if exc_type is None:
+            self.check()
+        return False
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, seconds, _ in self.executed)
+
+    def count_exceeded(self):
+        return self.queries is not None and len(self.executed) > self.queries
+
+    def exceeded(self):
+        time_over = self.ms is not None and self.seconds * 1000 > self.ms
+        return self.count_exceeded() or time_over
+
+    def report(self):
+        lines = [
+            f'Превышен бюджет запросов {self.name}: {len(self.executed)} запросов '
+            f'(бюджет {self.queries}), {self.seconds * 1000:.1f} мс (бюджет {self.ms})'
+        ]
+        repeated = Counter(sql for sql, _, _ in self.executed)
+        duplicates = [(sql, count) for sql, count in repeated.most_common() if count > 1]
+        if duplicates:
+            lines.append('Повторяющиеся запросы:')
+        for sql, count in duplicates:
+            lines.append(f'  {count}× {sql[:SQL_PREVIEW]}')
+            places = Counter(place for query, _, place in self.executed if query == sql)
+            lines.extend(f'      {times}× {place}' for place, times in places.most_common())
+        if not duplicates:
+            lines.append('Запросы:')
+            lines.extend(
+                f'  {seconds * 1000:.2f} мс {sql[:SQL_PREVIEW]}\n      {place}'
+                for sql, seconds, place in self.executed
+            )
+        return '\n'.join(lines)
+
+    def check(self):
+        if not self.exceeded():
+            return
+        if _mode() == 'raise' and self.count_exceeded():
+            raise QueryBudgetExceeded(self.report())
+        logger.warning(self.report())
+
+
+def query_budget(queries=None, ms=None, name=None):
+    """Декоратор view: @query_budget(queries=4, ms=50)"""
+    return QueryBudget(queries, ms, name)
+
+
+class QueryBudgetAdminMixin:
+    """
+    Бюджет запросов списка объектов в админке: changelist_budget = (запросов, мс)
+
+    Шаблон списка рендерится внутри бюджета: запросы из шаблона (N+1 в
+    list_display, __str__) тоже учитываются.
+    """
+    changelist_budget = None
+
+    def changelist_view(self, request, extra_context=None):
+        if self.changelist_budget is None:
+            return super().changelist_view(request, extra_context)
+        queries, ms = self.changelist_budget
+        with QueryBudget(queries, ms, name=f'admin:{self.opts.app_label}_{self.opts.model_name}_changelist'):
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        return response
@@ -0,0 +1,127 @@
+# shop/quotes.py
+"""
+Расчёт стоимости бани с опциями на сервере
+
+Цены размеров (ProductPrice) и активных опций (GlobalOption) держатся в
+памяти процесса в виде словарей, поэтому расчёт — несколько обращений к
+dict без запросов к БД. Индекс перестраивается при первом расчёте после
+изменения данных: зависимые модели сбрасывают семейство 'quote_index:*'
+(см. CACHE_DEPENDENCIES), а его поколение в шине инвалидации служит
+номером версии индекса в каждом воркере.
+"""
+import threading
+
+from . import cache_bus
+from .utils import format_price
+
+# Семейство в шине инвалидации: ключей в кеше нет, важно только поколение
+INDEX_KEY = 'quote_index:'
+
+_lock = threading.Lock()
+# (версия, индекс) одной парой, чтобы читатели без блокировки не видели их вразнобой
+_state = (None, None)
+
+
+class QuoteError(ValueError):
+    """Неизвестный или неактивный размер/опция"""
+
+
+def _build_index():
+    from .models import GlobalOption, Product, ProductPrice
+
+    # Все товары, а не только с размерами: товар без цен заказывают с пометкой «размер уточняется»
+    products = {pk: {'id': pk, 'title': title} for pk, title in Product.objects.values_list('pk', 'title')}
+    sizes = {
+        size.pk: (size.product_id, size.name, int(size.price))
+        for size in ProductPrice.objects.order_by('product_id', 'order', 'price')
+    }
+    options = {
+        option.pk: (option.name, int(option.price))
+        for option in GlobalOption.objects.filter(is_active=True)
+    }
+    return {'products': products, 'sizes': sizes, 'options': options}
+
+
+def get_index():
+    """Индекс цен текущей версии (строится при первом обращении и после изменений)"""
+    global _state
+
+    version = cache_bus.version_for(INDEX_KEY)
+    index_version, index = _state
+    if index is not None and index_version == version:
+        return index
+    with _lock:
+        index_version, index = _state
+        if index is None or index_version != version:
+            index = _build_index()
+            _state = (version, index)
+        return index
+
+
+def _options(index, option_ids):
+    options = []
+    seen = set()
+    for option_id in option_ids:
+        try:
+            option_id = int(option_id)
+            name, price = index['options'][option_id]
+        except (KeyError, TypeError, ValueError):
+            raise QuoteError(f'Неизвестная опция: {option_id}') from None
+        if option_id in seen:
+            continue
+        seen.add(option_id)
+        options.append({'id': option_id, 'name': name, 'price': price, 'formatted_price': format_price(price)})
+    return options
+
+
+def quote(size_id, option_ids=()):
+    """
+    Итоговая стоимость с разбивкой по позициям
+
+    Использование:
+    result = quote(12, [3, 7])
+    result['total'], result['formatted_total']
+    """
+    index = get_index()
+    try:
+        product_id, size_name, size_price = index['sizes'][int(size_id)]
+    except (KeyError, TypeError, ValueError):
+        raise QuoteError(f'Неизвестный размер: {size_id}') from None
+
+    options = _options(index, option_ids)
+    total = size_price + sum(option['price'] for option in options)
+    return {
+        'product': index['products'][product_id],
+        'size': {
+            'id': int(size_id),
+            'name': size_name,
+            'price': size_price,
+            'formatted_price': format_price(size_price),
+        },
+        'options': options,
+        'total': total,
+        'formatted_total': format_price(total),
+    }
+
+
+def describe(result):
+    """Текст для OrderRequest.order_details из результата quote()"""
+    lines = [result['product']['title'], result['size']['name']]
+    if result['options']:
+        lines.extend(f'➕ {option["name"]}' for option in result['options'])
+    else:
+        lines.append('(без дополнительных опций)')
+    lines.extend(['', f'💰 Итого: {result["formatted_total"]}'])
+    return '\n'.join(lines)
+
+
+def describe_product(product_id, option_ids=()):
+    """Текст для OrderRequest.order_details: товар без выбранного размера (ссылка «Заказать» из каталога)"""
+    index = get_index()
+    try:
+        product = index['products'][int(product_id)]
+    except (KeyError, TypeError, ValueError):
+        raise QuoteError(f'Неизвестный товар: {product_id}') from None
+    lines = [product['title'], '(размер уточняется)']
+    lines.extend(f'➕ {option["name"]}' for option in _options(index, option_ids))
+    return '\n'.join(lines)
@@ -0,0 +1,59 @@
+# shop/routers.py
+"""
+Чтение публичных страниц через соединение только для чтения
+
+Алиас 'replica' — тот же файл SQLite, открытый с mode=ro (или реплика
+PostgreSQL, если база переедет). ReadReplicaMiddleware включает чтение
+с реплики для безопасных запросов (GET/HEAD/OPTIONS) вне админки, и
+каталог читается, не пересекаясь с соединением, которое пишет заявки и
+сохранения из админки. Всё остальное — записи, админка, фоновые потоки,
+команды manage.py — работает с основной базой.
+
+Первая запись в запросе закрепляет его за основной базой: следующие
+чтения увидят только что записанное (и незакоммиченное в транзакции).
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.db import connections
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+@contextmanager
+def read_from_replica():
+    """Чтения внутри блока идут на реплику (до первой записи)"""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def _replica_available():
+    # В тестах реплика — зеркало основной базы (TEST MIRROR): тот же NAME,
+    # а данные теста видны только соединению основной базы
+    if REPLICA not in connections:
+        return False
+    return connections[REPLICA].settings_dict['NAME'] != connections[PRIMARY].settings_dict['NAME']
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and _replica_available():
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        # read-after-write: до конца запроса читаем то, что записали
+        _use_replica.set(False)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
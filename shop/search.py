@@ -0,0 +1,346 @@
+# shop/search.py
+"""
+Полнотекстовый поиск по товарам и опциям
+
+Индекс — виртуальная таблица SQLite FTS5 shop_search (миграция 0018):
+в документе товара название, описание и названия размеров (ProductPrice),
+в документе опции — название, описание и категория. FTS5 не умеет
+русскую морфологию, поэтому в индекс пишутся основы слов (стеммер Snowball
+для русского языка ниже), а запрос разбирается тем же стеммером. Каждое
+слово запроса ищется как префикс основы: «бан» находит «баня», «бани»,
+«банный» — этого хватает и для подсказок при вводе.
+
+Индекс обновляется по сигналам сохранения и удаления и по bulk_changed
+массовых операций (по образцу invalidation.py: изменения копятся до коммита
+и применяются одной транзакцией). Пустой индекс заполняется после migrate,
+заново — командой rebuild_search_index (после правки стеммера или загрузки
+данных в обход ORM).
+
+На других СУБД индекса нет: поиск падает обратно на icontains по названию.
+"""
+import re
+import threading
+
+from django.apps import apps as django_apps
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+
+from .signals import bulk_changed, track_fields
+
+TABLE = 'shop_search'
+# Тип документа -> остаток rowid: rowid = pk * len(KINDS) + номер типа
+KINDS = ('product', 'option')
+# Короче — слишком много совпадений по префиксу, подсказки бесполезны
+MIN_QUERY_LENGTH = 2
+# Совпадений, среди которых выбираются самые релевантные (см. ids)
+RANK_CANDIDATES = 300
+
+_WORD_RE = re.compile(r'\w+')
+
+# --- Стеммер Snowball для русского языка ---------------------------------
+
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+_ADJECTIVE = ((), (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+))
+_PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+_REFLEXIVE = ((), ('ся', 'сь'))
+_VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+    (
+        'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым',
+        'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю',
+    ),
+)
+_NOUN = ((), (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий',
+    'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю',
+    'ия', 'ья', 'я',
+))
+
+
+def _strip(part, endings):
+    """
+    Снять самое длинное окончание из endings = (после а/я, без условия)
+
+    Окончания первой группы снимаются, только если перед ними а или я
+    (сама буква остаётся). None — окончание не найдено или условие не выполнено.
+    """
+    after_a, plain = endings
+    best = max((e for e in after_a + plain if part.endswith(e)), key=len, default=None)
+    if best is None:
+        return None
+    rest = part[:-len(best)]
+    if best in after_a and best not in plain and not rest.endswith(('а', 'я')):
+        return None
+    return rest
+
+
+def _regions(word):
+    """Начало RV (после первой гласной) и R2 в слове"""
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in _VOWELS and word[i - 1] in _VOWELS), len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in _VOWELS and word[i - 1] in _VOWELS), len(word))
+    return rv, r2
+
+
+def stem(word):
+    """Основа русского слова (алгоритм Snowball); слова без гласных не меняются"""
+    word = word.lower().replace('ё', 'е')
+    rv, r2 = _regions(word)
+    head, part = word[:rv], word[rv:]
+
+    # Шаг 1: деепричастие, иначе возвратность и прилагательное/глагол/существительное
+    rest = _strip(part, _PERFECTIVE_GERUND)
+    if rest is None:
+        reflexive = _strip(part, _REFLEXIVE)
+        if reflexive is not None:
+            part = reflexive
+        rest = _strip(part, _ADJECTIVE)
+        if rest is not None:
+            participle = _strip(rest, _PARTICIPLE)
+            if participle is not None:
+                rest = participle
+        else:
+            rest = _strip(part, _VERB)
+            if rest is None:
+                rest = _strip(part, _NOUN)
+    if rest is not None:
+        part = rest
+
+    # Шаг 2
+    if part.endswith('и'):
+        part = part[:-1]
+
+    # Шаг 3: словообразовательное окончание в R2
+    for ending in ('ость', 'ост'):
+        if part.endswith(ending) and rv + len(part) - len(ending) >= r2:
+            part = part[:-len(ending)]
+            break
+
+    # Шаг 4: превосходная степень, двойная н, мягкий знак
+    for ending in ('ейше', 'ейш'):
+        if part.endswith(ending):
+            part = part[:-len(ending)]
+            if part.endswith('нн'):
+                part = part[:-1]
+            break
+    else:
+        if part.endswith('нн') or part.endswith('ь'):
+            part = part[:-1]
+    return head + part
+
+
+def stems(text):
+    return [stem(word) for word in _WORD_RE.findall(text or '')]
+
+
+# --- Документы ------------------------------------------------------------
+
+def _rowid(kind, pk):
+    return pk * len(KINDS) + KINDS.index(kind)
+
+
+def _documents(kind, pks, apps=django_apps):
+    """{pk: (название, текст)} для существующих объектов; apps — реестр моделей (для миграций)"""
+    if kind == 'product':
+        Product = apps.get_model('shop', 'Product')
+        ProductPrice = apps.get_model('shop', 'ProductPrice')
+        products = Product.objects.all() if pks is None else Product.objects.filter(pk__in=pks)
+        documents = {pk: [title, description] for pk, title, description in products.values_list('pk', 'title', 'description')}
+        for product_id, name in ProductPrice.objects.filter(product_id__in=documents).values_list('product_id', 'name'):
+            documents[product_id].append(name)
+        return {pk: (title, ' '.join(rest)) for pk, (title, *rest) in documents.items()}
+
+    GlobalOption = apps.get_model('shop', 'GlobalOption')
+    labels = dict(GlobalOption._meta.get_field('category').choices)
+    # Неактивные тоже в индексе: их ищут в админке, на сайте они отфильтровываются
+    options = GlobalOption.objects.all()
+    if pks is not None:
+        options = options.filter(pk__in=pks)
+    return {
+        pk: (name, f'{description} {labels.get(category, "")}')
+        for pk, name, description, category in options.values_list('pk', 'name', 'description', 'category')
+    }
+
+
+def _write(cursor, kind, pks, documents):
+    cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(_rowid(kind, pk),) for pk in pks])
+    cursor.executemany(
+        f'INSERT INTO {TABLE} (rowid, title, body) VALUES (%s, %s, %s)',
+        [
+            (_rowid(kind, pk), ' '.join(stems(title)), ' '.join(stems(body)))
+            for pk, (title, body) in documents.items()
+        ],
+    )
+
+
+def _connection(model_label='shop.Product', write=True):
+    model = django_apps.get_model(model_label)
+    return connections[router.db_for_write(model) if write else router.db_for_read(model)]
+
+
+def is_available(connection=None):
+    return (connection or _connection(write=False)).vendor == 'sqlite'
+
+
+def reindex(items):
+    """Переписать документы {(тип, pk), ...}: удалённые объекты уходят из индекса"""
+    connection = _connection()
+    if not is_available(connection) or not items:
+        return
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for kind in KINDS:
+            pks = {pk for item_kind, pk in items if item_kind == kind}
+            if pks:
+                _write(cursor, kind, pks, _documents(kind, pks))
+
+
+def rebuild(apps=django_apps, connection=None):
+    """Заполнить индекс заново; возвращает число документов"""
+    connection = connection or _connection()
+    if not is_available(connection):
+        return 0
+    total = 0
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        for kind in KINDS:
+            documents = _documents(kind, None, apps)
+            _write(cursor, kind, (), documents)
+            total += len(documents)
+        # Слить сегменты индекса в один: быстрее поиск
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return total
+
+
+# --- Поиск ----------------------------------------------------------------
+
+def match_expression(query):
+    """Запрос FTS5: каждое слово — префикс основы, слова через AND; '' — искать нечего"""
+    return ' '.join(f'"{term}"*' for term in stems(query) if term)
+
+
+def ids(kind, query, limit=None):
+    """
+    pk объектов типа kind по запросу
+
+    С limit — самые релевантные первыми: сначала совпадения в названии,
+    затем во всём документе. bm25 считается только для первых
+    RANK_CANDIDATES совпадений — на коротком префиксе, который есть почти
+    в каждом документе, ранжирование всех строк стоило бы десятки
+    миллисекунд. Без limit (админка) — все совпадения без ранжирования.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+    connection = _connection(write=False)
+    if not is_available(connection):
+        return _fallback_ids(kind, query, limit)
+    size = len(KINDS)
+    where = f'{TABLE} MATCH %s AND rowid %% {size} = %s'
+    with connection.cursor() as cursor:
+        if limit is None:
+            cursor.execute(f'SELECT rowid FROM {TABLE} WHERE {where}', [expression, KINDS.index(kind)])
+            return [rowid // size for (rowid,) in cursor.fetchall()]
+        found = []
+        for stage in (f'title : ({expression})', expression):
+            cursor.execute(
+                f'SELECT rowid FROM ('
+                f'SELECT rowid, bm25({TABLE}, 10.0, 1.0) AS score FROM {TABLE} WHERE {where} '
+                f'LIMIT {RANK_CANDIDATES}) ORDER BY score LIMIT %s',
+                [stage, KINDS.index(kind), limit],
+            )
+            found += [rowid // size for (rowid,) in cursor.fetchall() if rowid // size not in found]
+            if len(found) >= limit:
+                break
+        return found[:limit]
+
+
+def _fallback_ids(kind, query, limit):
+    model = django_apps.get_model('shop', 'Product' if kind == 'product' else 'GlobalOption')
+    field = 'title' if kind == 'product' else 'name'
+    pks = model.objects.filter(**{f'{field}__icontains': query.strip()}).values_list('pk', flat=True)
+    return list(pks[:limit] if limit is not None else pks)
+
+
+def search(query, limit=8):
+    """Карточки товаров и опции по запросу: {'products': (CardDTO, ...), 'options': (OptionDTO, ...)}"""
+    from .dto import CardDTO, OptionDTO
+    from .models import GlobalOption, Product
+
+    if len(query.strip()) < MIN_QUERY_LENGTH:
+        return {'products': (), 'options': ()}
+    product_ids = ids('product', query, limit)
+    option_ids = ids('option', query, limit)
+    cards = {card.id: card for card in CardDTO.for_products(Product.objects.filter(pk__in=product_ids))}
+    options = {option.pk: option for option in GlobalOption.objects.filter(pk__in=option_ids, is_active=True)}
+    return {
+        'products': tuple(cards[pk] for pk in product_ids if pk in cards),
+        'options': tuple(OptionDTO.from_model(options[pk]) for pk in option_ids if pk in options),
+    }
+
+
+# --- Обновление по сигналам ---------------------------------------------
+
+# Модель -> (тип документа, поле с pk документа)
+INDEXED_MODELS = {
+    'shop.Product': ('product', 'pk'),
+    'shop.ProductPrice': ('product', 'product_id'),
+    'shop.GlobalOption': ('option', 'pk'),
+}
+
+_pending = threading.local()
+
+
+def _flush():
+    items = getattr(_pending, 'items', None)
+    if items:
+        _pending.items = set()
+        reindex(items)
+
+
+def schedule(kind, *pks):
+    """Отложить переиндексацию документов до коммита текущей транзакции"""
+    if not pks:
+        return
+    if not hasattr(_pending, 'items'):
+        _pending.items = set()
+    _pending.items.update((kind, pk) for pk in pks)
+    transaction.on_commit(_flush)
+
+
+def _on_save_or_delete(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return  # loaddata
+    kind, field = INDEXED_MODELS[sender._meta.label]
+    schedule(kind, getattr(instance, field))
+
+
+def _on_bulk_changed(sender, instances, **kwargs):
+    kind, field = INDEXED_MODELS[sender._meta.label]
+    schedule(kind, *{getattr(instance, field) for instance in instances})
+
+
+def fill_after_migrate(sender, apps, using, **kwargs):
+    """Заполнить пустой индекс после migrate (таблицу создаёт миграция 0018)"""
+    connection = connections[using]
+    if not is_available(connection) or TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT 1 FROM {TABLE} LIMIT 1')
+        if cursor.fetchone() is None:
+            rebuild(apps, connection)
+
+
+def connect_signals():
+    for label, (_, field) in INDEXED_MODELS.items():
+        model = django_apps.get_model(label)
+        uid = f'search-index-{label}'
+        post_save.connect(_on_save_or_delete, sender=model, dispatch_uid=uid)
+        post_delete.connect(_on_save_or_delete, sender=model, dispatch_uid=uid)
+        bulk_changed.connect(_on_bulk_changed, sender=model, dispatch_uid=uid)
+        if field != 'pk':
+            track_fields(label, [field])
+    post_migrate.connect(fill_after_migrate, sender=django_apps.get_app_config('shop'), dispatch_uid='search-index-fill')
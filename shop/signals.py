@@ -0,0 +1,26 @@
+# shop/signals.py
+"""
+Сигнал массовых операций с моделями
+
+QuerySet.update(), bulk_create() и bulk_update() не отправляют post_save,
+поэтому о них сообщает bulk_changed — его отправляет BulkSignalQuerySet
+(shop/models.py). Подписчики (инвалидация кеша, поисковый индекс)
+подключаются в ShopConfig.ready(): модели не импортируют ни кеш, ни поиск.
+"""
+from django.dispatch import Signal
+
+# sender — модель; instances — затронутые объекты; fields — изменённые
+# поля (None — новые объекты, bulk_create)
+bulk_changed = Signal()
+
+# Метка модели -> поля, которые подписчикам нужны у затронутых объектов
+_tracked = {}
+
+
+def track_fields(label, fields):
+    """Загружать fields у объектов, затронутых update(), перед отправкой bulk_changed"""
+    _tracked.setdefault(label, set()).update(fields)
+
+
+def tracked_fields(model):
+    return sorted(_tracked.get(model._meta.label, ()))
@@ -0,0 +1,100 @@
+# shop/sqlite_tuning.py
+"""
+Настройка соединений SQLite для продакшена
+
+В процессе сервера (enable, banyana_fresh/wsgi.py) при каждом новом
+соединении с базой SQLite (сигнал connection_created) выполняются PRAGMA
+из settings.SQLITE_PRAGMAS. Главная из них — journal_mode=WAL: читатели
+больше не ждут писателя, а писатель не ждёт читателей. Соединения переиспользуются между запросами (CONN_MAX_AGE), так
+что настройка выполняется один раз на соединение, а не на каждый запрос.
+Команды manage.py (check, makemigrations, test) базу не перенастраивают:
+journal_mode=WAL переписывает заголовок файла и оставляет рядом -wal/-shm.
+
+Долгоживущие соединения не закрываются, поэтому PRAGMA optimize (обновление
+статистики планировщика) и контрольная точка WAL запускаются периодически
+фоновым потоком (start_maintenance, banyana_fresh/wsgi.py).
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+_maintenance_lock = threading.Lock()
+_maintenance_pid = None
+
+
+def apply_pragmas(cursor, pragmas):
+    """Выполнить PRAGMA из словаря {'journal_mode': 'WAL', ...} на курсоре DB-API"""
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_read_only(connection):
+    """Открыто ли соединение только для чтения (NAME вида file:...?mode=ro)"""
+    return 'mode=ro' in str(connection.settings_dict['NAME'])
+
+
+def configure_connection(sender, connection, **kwargs):
+    """Обработчик connection_created: PRAGMA для каждого нового соединения SQLite"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if is_read_only(connection):
+        # Режим журнала — свойство файла, его включает соединение на запись
+        pragmas = {name: value for name, value in pragmas.items() if name != 'journal_mode'}
+    if pragmas:
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, pragmas)
+
+
+def enable():
+    """Настраивать новые соединения SQLite (вызывается в воркере, banyana_fresh/wsgi.py)"""
+    connection_created.connect(configure_connection, dispatch_uid='shop.sqlite_tuning')
+
+
+def maintain(alias='default'):
+    """
+    PRAGMA optimize и пассивная контрольная точка WAL
+
+    PASSIVE не ждёт читателей и писателей: переносит в базу то, что может,
+    остальное — в следующий раз. Размер файла -wal ограничивает
+    journal_size_limit.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'sqlite' or is_read_only(connection):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA optimize')
+        cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        return cursor.fetchone()  # (занято, страниц в WAL, перенесено страниц)
+
+
+def _run(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            for alias in connections:
+                maintain(alias)
+        except Exception:
+            logger.exception('Ошибка обслуживания SQLite')
+        finally:
+            close_old_connections()
+
+
+def start_maintenance():
+    """Запустить фоновый поток обслуживания в текущем процессе (повторный вызов ничего не делает)"""
+    global _maintenance_pid
+    interval = getattr(settings, 'SQLITE_MAINTENANCE_INTERVAL', None)
+    if not interval or _maintenance_pid == os.getpid():
+        return
+    with _maintenance_lock:
+        if _maintenance_pid == os.getpid():
+            return
+        threading.Thread(target=_run, args=(interval,), name='sqlite-maintenance', daemon=True).start()
+        _maintenance_pid = os.getpid()
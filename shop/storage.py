@@ -0,0 +1,32 @@
+# shop/storage.py
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+from . import bundles
+
+
+class ManifestStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    Статика с хешем содержимого в имени и сжатыми копиями (WhiteNoise)
+
+    WhiteNoise отдаёт такие файлы с Cache-Control: max-age=315360000,
+    immutable. Пока манифеста нет (collectstatic не запускали — тесты,
+    первый запуск), отдаётся исходное имя. Если манифест есть, а файла в
+    нём нет (бандл собрали после collectstatic), рендер падает с ValueError:
+    иначе страница молча ссылалась бы на файл без хеша в имени.
+    collectstatic не запускается с несобранными или устаревшими бандлами.
+    """
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            outdated = bundles.outdated(bundles.expected_files(bundles.collect_sources()))
+            if outdated:
+                raise bundles.BundleError(
+                    'Бандлы не собраны или устарели: ' + ', '.join(outdated)
+                    + '. Запустите manage.py build_bundles перед collectstatic'
+                )
+        yield from super().post_process(paths, dry_run, **options)
@@ -0,0 +1,36 @@
+# shop/template_backend.py
+"""
+Бэкенд шаблонов Django с замером времени рендера
+
+Время рендера каждого шаблона верхнего уровня (вместе с extends/include)
+попадает в гистограмму metrics.template_render_seconds с именем шаблона
+в качестве метки.
+"""
+import time
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from . import metrics
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_render_seconds.observe(
+                self.template.name or '<string>', time.perf_counter() - started,
+            )
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
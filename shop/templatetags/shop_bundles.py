@@ -0,0 +1,58 @@
+# shop/templatetags/shop_bundles.py
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from shop import bundles
+
+register = template.Library()
+
+
+class BundleNode(template.Node):
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self.css, self.js = bundles.extract(text)
+        # Проверяется один раз: скомпилированный шаблон живёт в cached loader
+        self.built = {
+            kind: bundles.is_built(name, kind, source)
+            for kind, source in (('css', self.css), ('js', self.js))
+        }
+
+    def render(self, context):
+        if not any(self.built.values()):
+            return self.text
+        parts = []
+        if self.css:
+            parts.append(
+                format_html('<link rel="stylesheet" href="{}">', static(bundles.bundle_path(self.name, 'css')))
+                if self.built['css'] else f'<style>{self.css}</style>'
+            )
+        if self.js:
+            parts.append(
+                format_html('<script src="{}"></script>', static(bundles.bundle_path(self.name, 'js')))
+                if self.built['js'] else f'<script>{self.js}</script>'
+            )
+        return '\n'.join(parts)
+
+
+@register.tag
+def bundle(parser, token):
+    """
+    Встроенные стили и скрипты страницы, которые build_bundles выносит в static/
+
+    Внутри — только <style> и <script> без шаблонного синтаксиса.
+
+    Использование: {% load shop_bundles %}{% bundle 'catalog' %}<style>…</style>{% endbundle %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2 or bits[1][0] not in '\'"' or bits[1][0] != bits[1][-1]:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' принимает имя бандла строкой в кавычках")
+    nodelist = parser.parse(('endbundle',))
+    parser.delete_first_token()
+    if any(not isinstance(node, template.base.TextNode) for node in nodelist):
+        raise template.TemplateSyntaxError('Внутри bundle не должно быть шаблонных тегов и переменных')
+    try:
+        return BundleNode(bits[1][1:-1], ''.join(node.s for node in nodelist))
+    except bundles.BundleError as exc:
+        raise template.TemplateSyntaxError(str(exc)) from exc
@@ -0,0 +1,68 @@
+# shop/templatetags/shop_cache.py
+import hashlib
+
+from django import template
+from django.utils.safestring import mark_safe
+
+from shop.page_cache import render_hole
+from shop.utils import MISS, cache_get, cache_set, make_cache_key
+
+register = template.Library()
+
+# Статичные фрагменты меняются только с деплоем, TTL — страховка
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+
+@register.simple_tag(takes_context=True)
+def page_hole(context, name):
+    """
+    Персональный фрагмент страницы, который не попадает в кеш страниц
+
+    Использование: {% load shop_cache %}{% page_hole 'credit_captcha' %}
+    """
+    return mark_safe(render_hole(name, context['request']))
+
+
+class FragmentNode(template.Node):
+    def __init__(self, nodelist, name, timeout, generation):
+        self.nodelist = nodelist
+        self.name = name
+        self.timeout = timeout
+        self.generation = generation
+
+    def render(self, context):
+        key = make_cache_key('fragment', self.name.resolve(context), self.generation)
+        value = cache_get(key)
+        if value is MISS:
+            value = self.nodelist.render(context)
+            cache_set(key, value, self.timeout)
+        return value
+
+
+@register.tag
+def fragment(parser, token):
+    """
+    Статичный фрагмент шаблона: рендерится один раз и дальше берётся из кеша
+
+    Поколение фрагмента — хеш его исходника, поэтому после деплоя с
+    изменённой разметкой старая запись просто перестаёт читаться. Внутри не
+    должно быть данных запроса, пользователя и моделей.
+
+    Использование: {% load shop_cache %}{% fragment 'faq' %}...{% endfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) not in (2, 3):
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' принимает имя фрагмента и необязательный таймаут в секундах"
+        )
+    # Токены хранятся в обратном порядке: разобранные снимаются с конца списка
+    remaining = parser.tokens[:]
+    nodelist = parser.parse(('endfragment',))
+    body = remaining[len(parser.tokens):]
+    parser.delete_first_token()
+
+    source = hashlib.sha1()
+    for tok in reversed(body):
+        source.update(f'{tok.token_type.value}:{tok.contents}\0'.encode())
+    timeout = int(bits[2]) if len(bits) == 3 else FRAGMENT_TIMEOUT
+    return FragmentNode(nodelist, parser.compile_filter(bits[1]), timeout, source.hexdigest()[:16])
@@ -0,0 +1,33 @@
+# shop/templatetags/shop_images.py
+from django import template
+from django.utils.html import format_html_join
+
+from shop import images
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(value, width):
+    """{{ product.image_url|thumbnail:480 }} — URL копии не уже 480px"""
+    return images.thumbnail_url(value, int(width))
+
+
+@register.filter
+def srcset(value, fmt=None):
+    """{{ product.image_url|srcset }} или {{ product.image_url|srcset:'webp' }}"""
+    return images.srcset(value, fmt)
+
+
+@register.simple_tag
+def image_sources(value, sizes):
+    """
+    <source> для AVIF/WebP внутри <picture>
+
+    Использование:
+    <picture>{% image_sources product.image_url '(max-width: 600px) 100vw, 400px' %}<img ...></picture>
+    """
+    return format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((mime, value_srcset, sizes) for mime, value_srcset in images.sources(value)),
+    )
@@ -0,0 +1,36 @@
+# shop/test_runner.py
+"""
+Запуск тестов без обращения к рабочим файлам проекта
+
+Шина инвалидации, общий кеш (L2), очередь заявок, метрики и media —
+файлы рядом с проектом, которыми пользуются запущенные воркеры. Тесты
+очищают кеш и публикуют инвалидации: на рабочих файлах это стёрло бы
+общий кеш воркеров и оставило бы в нём страницы из тестовой базы. Поэтому
+на время прогона все эти пути указывают во временный каталог
+(те же, что у нагрузочного прогона, см. shop/benchmark.py).
+
+Бюджеты запросов (shop/query_budget.py) в тестах проверяются в режиме
+'raise': N+1 в любой view, которую открывает тест, роняет прогон. Django
+запускает тесты с DEBUG=False, и режим из settings был бы выключен.
+"""
+import tempfile
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+from .benchmark import scratch_paths
+
+
+class IsolatedTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._scratch = tempfile.TemporaryDirectory(prefix='shop-tests-')
+        self._scratch_settings = override_settings(
+            QUERY_BUDGET_MODE='raise', **scratch_paths(self._scratch.name)
+        )
+        self._scratch_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._scratch_settings.disable()
+        self._scratch.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1147 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import pickle
+import posixpath
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from captcha.models import CaptchaStore
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import F
+from django.http import HttpResponse
+from django.template import engines
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    bundles, cache_bus, cache_inspect, compression, dto, facets, images, ingest, invalidation, metrics, page_cache,
+    pagination, quotes, routers, search, sqlite_tuning, urls, warmup,
+)
+from .cache_backends import SQLiteCache, _Entry, _LocalTier
+from .management.commands import build_image_derivatives
+from .middleware import CompressionMiddleware, ReadReplicaMiddleware
+from .models import (
+    CompanyInfo, CreditRequest, GlobalOption, OrderRequest, Product, ProductImage, ProductPrice, WorkPhoto,
+    parse_meters,
+)
+from .query_budget import QueryBudget, QueryBudgetAdminMixin, QueryBudgetExceeded
+from .storage import ManifestStaticFilesStorage
+from .utils import MISS, cache_fetch, cache_get, cache_set
+
+
+def publish_elsewhere(key):
+    """Инвалидация, опубликованная другим процессом: строка в файле шины (общий кеш он очищает сам)"""
+    conn = cache_bus._connection()
+    (current,) = conn.execute('SELECT COALESCE(MAX(generation), 0) FROM cache_generations').fetchone()
+    conn.execute(
+        'INSERT INTO cache_generations (key, generation) VALUES (?, ?) '
+        'ON CONFLICT(key) DO UPDATE SET generation = excluded.generation',
+        (key, current + 1),
+    )
+    return current + 1
+
+
+class ProductCardQueriesTests(TestCase):
+    """Карточки каталога и главной строятся без запроса на каждый товар"""
+
+    def add_products(self, count):
+        for _ in range(count):
+            number = Product.objects.count() + 1
+            product = Product.objects.create(
+                title=f'Баня {number}', price=100000 * number, description='Описание ' * 40,
+                is_featured=True,
+            )
+            ProductPrice.objects.create(product=product, name='3x3', price=90000 * number, order=1)
+            ProductPrice.objects.create(product=product, name='3x4', price=120000 * number, order=2)
+            ProductImage.objects.create(product=product, image=f'product_images/{number}.jpg')
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_cards_in_one_query(self):
+        self.add_products(5)
+        with self.assertNumQueries(1):
+            cards = dto.CardDTO.for_products(Product.objects.order_by('id'))
+        first = cards[0]
+        self.assertEqual(first.from_price, 90000)
+        self.assertEqual(first.formatted_from_price, '90 000 ₽')
+        self.assertEqual(first.image_url, '/media/product_images/1.jpg')
+        self.assertEqual(len(first.excerpt), dto.CARD_EXCERPT_LENGTH)
+
+    def test_query_count_does_not_grow_with_products(self):
+        for url in (reverse('catalog'), reverse('index')):
+            with self.subTest(url=url):
+                self.add_products(2)
+                few = self.count_queries(url)
+                self.add_products(10)
+                self.assertEqual(self.count_queries(url), few)
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class QueryBudgetTests(TestCase):
+    """Страницы и списки админки укладываются в объявленные бюджеты запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(1, 6):
+            product = Product.objects.create(
+                title=f'Баня {number}', price=100000 * number, description='Описание', is_featured=True,
+            )
+            ProductPrice.objects.create(product=product, name='3x3', price=90000 * number, total_length='3')
+            ProductImage.objects.create(product=product, image=f'product_images/{number}.jpg')
+            GlobalOption.objects.create(name=f'Печь {number}', price=1000 * number, category='heating')
+            WorkPhoto.objects.create(image=f'works/{number}.jpg')
+        cls.product = product
+        cls.price = product.prices.get()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_exceeded_budget_reports_duplicates(self):
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            with QueryBudget(queries=2, name='проверка'):
+                for product in Product.objects.all():
+                    product.prices.first()
+        report = str(raised.exception)
+        self.assertIn('проверка: 6 запросов (бюджет 2)', report)
+        self.assertIn('5×', report)
+        self.assertIn('shop/tests.py', report)
+
+    def test_slow_queries_only_logged(self):
+        with mock.patch.object(QueryBudget, 'seconds', 1.0), self.assertLogs('shop.query_budget', 'WARNING'):
+            with QueryBudget(queries=10, ms=1, name='медленно'):
+                Product.objects.count()
+
+    def test_every_view_and_changelist_has_budget(self):
+        for pattern in urls.urlpatterns:
+            if isinstance(pattern, URLPattern):
+                with self.subTest(view=pattern.name):
+                    self.assertTrue(hasattr(pattern.callback, 'query_budget'))
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label == 'shop':
+                with self.subTest(admin=type(model_admin).__name__):
+                    self.assertIsInstance(model_admin, QueryBudgetAdminMixin)
+                    self.assertIsNotNone(model_admin.changelist_budget)
+
+    def test_pages_within_budget(self):
+        pages = [
+            reverse('index'), reverse('about'), reverse('catalog'), f"{reverse('catalog')}?length=3-4",
+            reverse('product_detail', args=[self.product.pk]), reverse('works'), reverse('works_page'),
+            reverse('contact'), f"{reverse('order')}?size={self.price.pk}", reverse('additional_services'),
+            f"{reverse('search')}?q=баня", f"{reverse('search_api')}?q=печь",
+            f"{reverse('quote')}?size={self.price.pk}",
+        ]
+        for url in pages:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_changelists_within_budget(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label == 'shop':
+                url = reverse(f'admin:shop_{model._meta.model_name}_changelist')
+                with self.subTest(url=url):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class QueryBudgetModeTests(TestCase):
+    """Бюджеты view проверяются во всех тестах, а не только в QueryBudgetTests"""
+
+    def test_tests_run_in_raise_mode(self):
+        self.assertEqual(settings.QUERY_BUDGET_MODE, 'raise')
+
+
+class WarmupTests(TestCase):
+    """Прогрев перерисовывает страницы, зависящие от сброшенных ключей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(title=f'Баня {number}', price=100000, description='Описание')
+            for number in range(1, 4)
+        ]
+
+    def test_pages_for_keys(self):
+        detail = reverse('product_detail', args=[self.products[0].pk])
+        self.assertEqual(warmup.pages_for([f'product_detail_{self.products[0].pk}']), [detail])
+        self.assertEqual(warmup.pages_for(['products_catalog', 'products_featured']), [reverse('index'), reverse('catalog')])
+        self.assertEqual(len(warmup.pages_for(['product_detail_*'])), len(self.products))
+        self.assertEqual(len(warmup.pages_for([cache_bus.ALL_KEYS])), len(warmup.PAGES) + len(self.products))
+        self.assertEqual(warmup.pages_for(['unknown_key']), [])
+
+    def test_pages_for_model_keys_with_page_family(self):
+        product = self.products[0]
+        # Ключи сохранения товара (CACHE_DEPENDENCIES) вместе с 'page:*'
+        keys = invalidation.keys_for(Product, [product])
+        self.assertIn('page:*', keys)
+        self.assertEqual(
+            warmup.pages_for(keys),
+            [reverse('index'), reverse('catalog'), reverse('product_detail', args=[product.pk])],
+        )
+        self.assertEqual(len(warmup.pages_for(['page:*'])), len(warmup.PAGES) + len(self.products))
+
+    def test_warm_fills_page_cache(self):
+        cache.clear()
+        results, _ = warmup.warm(parallel=1)  # в потоке теста: данные теста видны только его соединению
+        self.assertTrue(all(status == 200 for _, status, _ in results))
+        for path in (reverse('catalog'), reverse('product_detail', args=[self.products[-1].pk])):
+            with self.subTest(path=path):
+                self.assertIsNot(cache_get(page_cache.page_key(path)), MISS)
+
+    def test_warm_has_no_visitor_side_effects(self):
+        cache.clear()
+        before = {name: metric.snapshot() for name, metric in metrics.REGISTRY.items()}
+        results, _ = warmup.warm([reverse('index'), reverse('about')], parallel=1)
+        self.assertEqual([status for _, status, _ in results], [200, 200])
+        self.assertEqual({name: metric.snapshot() for name, metric in metrics.REGISTRY.items()}, before)
+        self.assertFalse(CaptchaStore.objects.exists())
+        # Посетитель получает капчу из дыры закешированной страницы
+        self.assertContains(self.client.get(reverse('index')), 'captcha')
+        self.assertTrue(CaptchaStore.objects.exists())
+
+
+class QuoteTests(TestCase):
+    """Расчёт стоимости на сервере и детали заказа из проверенных данных"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(title='Баня-бочка', price=100000, description='Описание')
+        cls.size = ProductPrice.objects.create(product=cls.product, name='2.2 × 4', price=250000)
+        cls.stove = GlobalOption.objects.create(name='Печь', price=30000, category='steam_furniture')
+        cls.light = GlobalOption.objects.create(name='Свет', price=5500, category='lighting')
+        cls.hidden = GlobalOption.objects.create(name='Снято', price=1, category='lighting', is_active=False)
+
+    def setUp(self):
+        cache_bus.invalidate([f'{quotes.INDEX_KEY}*'])  # индекс в памяти процесса от других тестов
+
+    def test_total_with_options(self):
+        result = quotes.quote(self.size.pk, [self.stove.pk, str(self.light.pk), self.stove.pk])
+        self.assertEqual([option['id'] for option in result['options']], [self.stove.pk, self.light.pk])
+        self.assertEqual(result['total'], 285500)
+        self.assertEqual(result['formatted_total'], '285 500 ₽')
+        self.assertEqual(quotes.quote(self.size.pk)['total'], 250000)
+
+    def test_unknown_or_inactive_items_rejected(self):
+        for size, options in ((0, []), ('x', []), (self.size.pk, [self.hidden.pk]), (self.size.pk, ['1;2'])):
+            with self.subTest(size=size, options=options):
+                with self.assertRaises(quotes.QuoteError):
+                    quotes.quote(size, options)
+
+    def test_order_details_only_from_verified_data(self):
+        order = reverse('order')
+        response = self.client.get(order, {'details': 'Итого: 1 ₽'})
+        self.assertEqual(response.context['order_details'], '')
+
+        response = self.client.get(order, {'size': self.size.pk, 'option': [self.stove.pk], 'details': 'Итого: 1 ₽'})
+        self.assertIn('💰 Итого: 280 000 ₽', response.context['order_details'])
+        self.assertNotIn('Итого: 1 ₽', response.context['order_details'])
+
+        response = self.client.get(order, {'product': self.product.pk})
+        self.assertEqual(response.context['order_details'], 'Баня-бочка\n(размер уточняется)')
+
+    def test_order_for_product_without_prices(self):
+        product = Product.objects.create(title='Баня под заказ', price=0, description='Описание')
+        response = self.client.get(reverse('order'), {'product': product.pk, 'option': [self.light.pk]})
+        self.assertEqual(response.context['order_details'], 'Баня под заказ\n(размер уточняется)\n➕ Свет')
+
+    def test_order_for_unknown_items_not_found(self):
+        for params in ({'product': 0}, {'size': 0}, {'size': self.size.pk, 'option': [self.hidden.pk]}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse('order'), params).status_code, 404)
+
+
+class MetricsSnapshotTests(TestCase):
+    """Снимки завершившихся процессов сливаются в одну строку"""
+
+    def test_dead_processes_folded_into_retired_row(self):
+        conn = metrics._connection()
+        conn.execute('DELETE FROM metric_snapshots')
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+        pid = int(finished.stdout)
+        snapshot = json.dumps({metrics.cache_requests.name: [[['retired_test', 'hit'], 2]]})
+        for start in range(3):
+            conn.execute('INSERT INTO metric_snapshots VALUES (?, ?, ?, ?)', (f'{pid}:{start}', pid, 0, snapshot))
+
+        metrics.flush()
+        metrics.flush()
+        rows = {process for (process,) in conn.execute('SELECT process FROM metric_snapshots')}
+        self.assertEqual(rows, {metrics._process_name(), metrics.RETIRED})
+        self.assertEqual(metrics.collect()[metrics.cache_requests.name][('retired_test', 'hit')], 6)
+
+
+class CompressionTests(TestCase):
+    """Сжатие ответов: длина у обычных ответов, умеренный Brotli при заполнении кеша"""
+
+    def respond(self, body):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        return CompressionMiddleware(lambda request: HttpResponse(body))(request)
+
+    def test_regular_response_keeps_length(self):
+        body = 'Баня-бочка из кедра. ' * 500
+        response = self.respond(body)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content).decode(), body)
+
+    def test_large_response_streamed(self):
+        body = 'Баня-бочка из кедра. ' * 500
+        with mock.patch.object(compression, 'STREAM_THRESHOLD', 1024):
+            response = self.respond(body)
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(), body)
+
+    def test_page_cache_fill_uses_moderate_brotli(self):
+        cache.clear()
+        self.addCleanup(cache.clear)  # в кеше осталась бы страница с поддельным Brotli
+        with mock.patch.object(compression, 'brotli') as brotli:
+            brotli.compress.return_value = b'br'
+            self.client.get(reverse('about'))
+        self.assertEqual(brotli.compress.call_args.kwargs['quality'], compression.BROTLI_PRECOMPRESS_QUALITY)
+        self.assertLessEqual(compression.BROTLI_PRECOMPRESS_QUALITY, 6)
+
+
+class PageCacheTests(TestCase):
+    """Кеш страниц: ключ, персональные фрагменты, условные запросы"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_key_uses_declared_params_only(self):
+        catalog = reverse('catalog')
+        self.client.get(catalog, {'utm_source': 'mail', 'fbclid': 'x'})
+        self.assertIsNot(cache_get(page_cache.page_key(catalog)), MISS)
+
+        self.client.get(f'{catalog}?price=-300000&utm_source=mail&length=4-5')
+        key = page_cache.page_key(catalog, [('price', ('-300000',)), ('length', ('4-5',))])
+        self.assertIsNot(cache_get(key), MISS)
+        self.assertEqual(key, page_cache.page_key(catalog, [('length', ('4-5',)), ('price', ('-300000',))]))
+
+    def test_csrf_token_injected_per_visitor(self):
+        tokens = []
+        for _ in range(2):
+            response = Client().get(reverse('index'))
+            content = response.content.decode()
+            self.assertNotIn(page_cache.CSRF_PLACEHOLDER, content)
+            tokens.append(page_cache._CSRF_INPUT_RE.search(content)[1])
+        self.assertNotEqual(*tokens)
+        entry = cache_get(page_cache.page_key(reverse('index')))[1]
+        self.assertIn(('csrf', None, None), entry.segments)
+
+    def test_not_modified_without_cache_entry(self):
+        catalog = reverse('catalog')
+        response = self.client.get(catalog, HTTP_ACCEPT_ENCODING='gzip')
+        etag = response['ETag']
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertRegex(etag, r'^"[0-9a-f]+-gzip"$')  # строгий, свой у сжатого варианта
+
+        cache.clear()
+        response = self.client.get(catalog, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIs(cache_get(page_cache.page_key(catalog)), MISS)
+
+        cache_bus.invalidate(['page:*'])
+        self.assertEqual(self.client.get(catalog, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+    def test_deploy_changes_key_and_etag(self):
+        catalog = reverse('catalog')
+        etag = self.client.get(catalog)['ETag']
+        self.assertEqual(self.client.get(catalog, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with mock.patch.object(page_cache, 'deploy_digest', return_value='новая выкладка'):
+            response = self.client.get(catalog, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_page_with_holes_never_not_modified(self):
+        product = Product.objects.create(title='Баня 1', price=100000, description='Описание')
+        url = reverse('product_detail', args=[product.pk])
+        for _ in range(2):  # рендер и отдача из кеша
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('ETag'))
+            self.assertFalse(response.has_header('Last-Modified'))
+            self.assertIn(timezone.localdate().strftime('%d.%m.%Y'), response.content.decode())
+        self.assertTrue(cache_get(page_cache.page_key(url))[1].has_holes)
+
+
+class FragmentCacheTests(TestCase):
+    """Кеш фрагментов шаблона и замер времени рендера шаблонов"""
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, body, **context):
+        source = "{% load shop_cache %}{% fragment 'test_fragment' %}" + body + '{% endfragment %}'
+        [engine] = engines.all()
+        return engine.from_string(source).render(context)
+
+    def test_second_render_from_cache(self):
+        self.assertEqual(self.render('{{ value }}', value='первый'), 'первый')
+        self.assertEqual(self.render('{{ value }}', value='второй'), 'первый')
+
+    def test_changed_source_changes_key(self):
+        self.assertEqual(self.render('старая разметка'), 'старая разметка')
+        self.assertEqual(self.render('новая разметка'), 'новая разметка')
+        self.assertEqual(self.render('старая разметка'), 'старая разметка')
+
+    def test_render_time_per_template(self):
+        def count(template):
+            return metrics.template_render_seconds.snapshot().get(template, {}).get('count', 0)
+
+        before = {name: count(name) for name in ('shop/about.html', 'base.html')}
+        self.assertEqual(self.client.get(reverse('about')).status_code, 200)
+        self.assertEqual(count('shop/about.html'), before['shop/about.html'] + 1)
+        self.assertEqual(count('base.html'), before['base.html'])  # extends входит во время страницы
+
+
+class BulkInvalidationTests(TestCase):
+    """Массовые операции сбрасывают зависимый кеш через bulk_changed"""
+
+    def setUp(self):
+        cache.clear()
+        self.first = Product.objects.create(title='Баня 1', price=100000, description='Описание')
+        self.second = Product.objects.create(title='Баня 2', price=200000, description='Описание')
+
+    def test_update_invalidates_old_and_new_product(self):
+        price = ProductPrice.objects.create(product=self.first, name='3x3', price=90000)
+        for product in (self.first, self.second):
+            cache_set(f'product_detail_{product.pk}', 'карточка', 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductPrice.objects.filter(pk=price.pk).update(product=self.second)
+        for product in (self.first, self.second):
+            self.assertIs(cache_get(f'product_detail_{product.pk}'), MISS)
+
+    def test_bulk_create_and_bulk_update_invalidate(self):
+        cache_set('products_catalog', 'каталог', 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            [price] = ProductPrice.objects.bulk_create([ProductPrice(product=self.first, name='3x3', price=1)])
+        self.assertIs(cache_get('products_catalog'), MISS)
+
+        cache_set(f'product_detail_{self.first.pk}', 'карточка', 60)
+        price.price = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductPrice.objects.bulk_update([price], ['price'])
+        self.assertIs(cache_get(f'product_detail_{self.first.pk}'), MISS)
+
+
+class DtoCodecTests(TestCase):
+    """DTO для кеша: упаковка в байты и обратно без потерь"""
+
+    def test_round_trip(self):
+        product = Product.objects.create(title='Баня-бочка', price=250000, description='Описание')
+        ProductPrice.objects.create(product=product, name='2.2 × 4', price=250000, total_length='4')
+        ProductImage.objects.create(product=product, image='product_images/1.jpg')
+        product = Product.objects.prefetch_related('prices', 'images').get()
+        detail = dto.ProductDTO.from_model(product)
+        cards = dto.CardDTO.for_products(Product.objects.all())
+
+        for value in (detail, cards, {'product': detail, 'related': cards}, (), None):
+            with self.subTest(value=type(value).__name__):
+                self.assertEqual(dto.unpack(dto.pack(value)), value)
+        restored = dto.unpack(dto.pack(detail))
+        self.assertIsInstance(restored.prices[0], dto.PriceDTO)
+        self.assertEqual(restored.images[0].url, '/media/product_images/1.jpg')
+        self.assertEqual(dto.unpack(dto.pack(cards))[0].formatted_price, '250 000 ₽')
+
+    def test_cache_fetch_stores_packed_bytes(self):
+        cache.clear()
+        card = dto.CardDTO(id=1, title='Баня', excerpt='', image_url='', base_price=1, from_price=1)
+        self.assertEqual(cache_fetch('products_catalog', lambda: (card,), soft_ttl=60, codec=dto), (card,))
+        _, stored = cache.get('products_catalog', version=cache_bus.version_for('products_catalog'))
+        self.assertIsInstance(stored, bytes)
+        self.assertEqual(cache_fetch('products_catalog', lambda: (), soft_ttl=60, codec=dto), (card,))
+
+
+class KeysetPaginationTests(TestCase):
+    """Курсорная пагинация галереи работ"""
+
+    @classmethod
+    def setUpTestData(cls):
+        WorkPhoto.objects.bulk_create([WorkPhoto(image=f'works/{number}.jpg') for number in range(7)])
+        # Ничьи по created_at разрешаются по id
+        WorkPhoto.objects.filter(pk__in=list(WorkPhoto.objects.values_list('pk', flat=True)[:4])).update(
+            created_at=timezone.now() - timedelta(days=1),
+        )
+
+    def test_cursor_round_trip(self):
+        moment = timezone.now()
+        self.assertEqual(pagination.decode_cursor(pagination.encode_cursor(moment, 42)), (moment, 42))
+
+    def test_tampered_cursor_rejected(self):
+        valid = pagination.encode_cursor(timezone.now(), 42)
+        forged = [
+            valid[:-3], valid + '!', 'не base64', base64.urlsafe_b64encode(b'not json').decode(),
+            base64.urlsafe_b64encode(json.dumps(['2026-01-01T00:00:00', '1 OR 1=1']).encode()).decode(),
+            base64.urlsafe_b64encode(json.dumps(['вчера', 1]).encode()).decode(),
+            base64.urlsafe_b64encode(json.dumps({'value': 1}).encode()).decode(),
+        ]
+        for cursor in forged:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(pagination.decode_cursor(cursor))
+
+    def test_pages_cover_all_photos_once(self):
+        seen, cursor = [], ''
+        while True:
+            photos, cursor = pagination.keyset_page(WorkPhoto.objects.all(), cursor, 3)
+            seen += [photo.pk for photo in photos]
+            if not cursor:
+                break
+        expected = list(WorkPhoto.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_tampered_cursor_serves_first_page(self):
+        cache.clear()
+        first = self.client.get(reverse('works_page')).json()
+        response = self.client.get(reverse('works_page'), {'after': 'подделка'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), first)
+
+
+class CacheBusTests(TestCase):
+    """Шина инвалидации: поколения ключей, версии семейств, сверка процессов"""
+
+    def setUp(self):
+        cache.clear()
+        cache_bus.sync()
+
+    def test_key_from_other_process_applied_on_sync(self):
+        cache_set('company_info', 'старое', 60)
+        publish_elsewhere('company_info')
+        cache.shared.delete('company_info', version=cache_bus.version_for('company_info'))
+        self.assertEqual(cache_get('company_info'), 'старое')  # до сверки процесс не знает о сбросе
+        cache_bus.sync()
+        self.assertIs(cache_get('company_info'), MISS)
+
+    def test_family_generation_becomes_version(self):
+        self.assertIsNone(cache_bus.version_for('gallery_test_1'))
+        cache_set('gallery_test_1', 'старое', 60)
+        cache_set('company_info', 'контакты', 60)
+
+        cache_bus.invalidate(['gallery_test_*'])
+        version = cache_bus.version_for('gallery_test_1')
+        self.assertIsNotNone(version)
+        self.assertEqual(cache_bus.version_for('gallery_test_2'), version)
+        self.assertIs(cache_get('gallery_test_1'), MISS)
+        self.assertEqual(cache_get('company_info'), 'контакты')
+
+        generation = publish_elsewhere('gallery_test_*')
+        cache_bus.sync()
+        self.assertEqual(cache_bus.version_for('gallery_test_1'), generation + 1)
+
+    def test_full_clear_bumps_every_version(self):
+        before = cache_bus.version_for('company_info')
+        cache_bus.invalidate(['gallery_test_*'])
+        generation = publish_elsewhere(cache_bus.ALL_KEYS)
+        cache_bus.sync()
+        # Значения, записанные до очистки с прежними версиями, больше не читаются
+        for key in ('company_info', 'gallery_test_1'):
+            with self.subTest(key=key):
+                self.assertNotEqual(cache_bus.version_for(key), before)
+                self.assertEqual(cache_bus.version_for(key), generation + 1)
+
+    def test_fresh_process_loads_family_generations(self):
+        cache_bus.invalidate(['gallery_test_*'])
+        version = cache_bus.version_for('gallery_test_1')
+        with mock.patch.object(cache_bus, '_watermark', None), mock.patch.object(cache_bus, '_families', {}):
+            self.assertIsNone(cache_bus.version_for('gallery_test_1'))
+            cache_bus.sync()
+            self.assertEqual(cache_bus.version_for('gallery_test_1'), version)
+
+
+    def test_same_size_publishes_all_applied(self):
+        # Повторные публикации одного ключа не меняют размер файла шины
+        for value in ('первое', 'второе'):
+            with self.subTest(value=value):
+                cache_set('company_info', value, 60)
+                publish_elsewhere('company_info')
+                cache.shared.delete('company_info', version=cache_bus.version_for('company_info'))
+                cache_bus.sync()
+                self.assertIs(cache_get('company_info'), MISS)
+
+    def test_own_publish_not_reapplied_on_sync(self):
+        cache_bus.invalidate(['company_info'])
+        with mock.patch.object(cache_bus, '_apply_locally') as apply_locally:
+            cache_bus.sync()
+        apply_locally.assert_not_called()
+
+
+class CacheFetchTests(TestCase):
+    """cache_fetch: блокировка пересчёта, stale-while-revalidate, промахи"""
+
+    def setUp(self):
+        cache.clear()
+
+    def store(self, key, value, fresh_for):
+        """Запись в формате cache_fetch: (свежо_до, значение)"""
+        cache.set(key, (time.time() + fresh_for, value), 60, version=cache_bus.version_for(key))
+
+    def hold_lock(self, key):
+        self.assertTrue(cache.add(f'{key}:lock', 1, 30, version=cache_bus.version_for(key)))
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'каталог'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache_fetch('products_catalog', compute, soft_ttl=60)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['каталог'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_served_while_other_request_refreshes(self):
+        self.store('products_catalog', 'старое', fresh_for=-1)
+        self.hold_lock('products_catalog')
+        compute = mock.Mock(return_value='новое')
+        self.assertEqual(cache_fetch('products_catalog', compute, soft_ttl=60), 'старое')
+        compute.assert_not_called()
+
+        cache.delete('products_catalog:lock', version=cache_bus.version_for('products_catalog'))
+        self.assertEqual(cache_fetch('products_catalog', compute, soft_ttl=60), 'новое')
+        self.assertEqual(cache_fetch('products_catalog', compute, soft_ttl=60), 'новое')
+        compute.assert_called_once()
+
+    def test_miss_computes_itself_when_lock_owner_hangs(self):
+        self.hold_lock('products_catalog')
+        self.assertEqual(cache_fetch('products_catalog', lambda: 'своё', soft_ttl=60, wait=0.1), 'своё')
+
+    def test_company_info_cached(self):
+        CompanyInfo.objects.create(description='О компании', phone='+79990000000')
+        self.assertEqual(CompanyInfo.get_cached().phone, '+79990000000')
+        with self.assertNumQueries(0):
+            self.assertEqual(CompanyInfo.get_cached().phone, '+79990000000')
+
+    def test_empty_results_are_hits(self):
+        for key, empty in (('products_featured', []), ('company_info', None), ('gallery', {})):
+            with self.subTest(key=key):
+                compute = mock.Mock(return_value=empty)
+                self.assertEqual(cache_fetch(key, compute, soft_ttl=60), empty)
+                self.assertEqual(cache_fetch(key, compute, soft_ttl=60), empty)
+                compute.assert_called_once()
+
+        compute = mock.Mock(return_value=None)
+        cache_fetch('company_info_none', compute, soft_ttl=60, cache_none=False)
+        cache_fetch('company_info_none', compute, soft_ttl=60, cache_none=False)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_cache_get_tells_miss_from_falsy_value(self):
+        self.assertIs(cache_get('products_featured'), MISS)
+        self.assertEqual(cache_get('products_featured', default=()), ())
+        for value in ([], 0, '', None):
+            with self.subTest(value=value):
+                cache_set('products_featured', value, 60)
+                self.assertEqual(cache_get('products_featured'), value)
+
+    def test_value_invalidated_during_compute_is_not_stored(self):
+        def compute():
+            cache_bus.invalidate(['products_catalog'])  # коммит и инвалидация во время расчёта
+            return 'по старым данным'
+
+        self.assertEqual(cache_fetch('products_catalog', compute, soft_ttl=60), 'по старым данным')
+        self.assertIs(cache.get('products_catalog', MISS), MISS)
+        self.assertEqual(cache_fetch('products_catalog', lambda: 'новое', soft_ttl=60), 'новое')
+        self.assertEqual(cache_fetch('products_catalog', lambda: 'лишний расчёт', soft_ttl=60), 'новое')
+
+    def test_invalidation_from_other_process_during_compute(self):
+        cache_bus.sync()
+
+        def compute():
+            publish_elsewhere('company_info')  # другой процесс сохранил данные
+            return 'по старым данным'
+
+        cache_fetch('company_info', compute, soft_ttl=60)
+        self.assertIs(cache_get('company_info'), MISS)
+
+
+class BundleTests(TestCase):
+    """Минификация бандлов и проверка сборки перед collectstatic"""
+
+    def test_minify_js_keeps_literals(self):
+        source = (
+            '    // комментарий\n'
+            '    const card = `<div>\n'
+            '        // не комментарий\n'
+            '        ${ price ? `<b>\n'
+            '          ${price}</b>` : "" }\n'
+            '    </div>`;\n'
+            "    const quote = /['`]/g;\n"
+            "    const text = 'слово\\\n"
+            "        продолжение';  \n"
+            '\n'
+            '    if (card) { show(card); }\n'
+        )
+        self.assertEqual(bundles.minify_js(source), (
+            'const card = `<div>\n'
+            '        // не комментарий\n'
+            '        ${ price ? `<b>\n'
+            '          ${price}</b>` : "" }\n'
+            '    </div>`;\n'
+            "const quote = /['`]/g;\n"
+            "const text = 'слово\\\n"
+            "        продолжение';\n"
+            'if (card) { show(card); }'
+        ))
+
+    def test_missing_manifest_entry_fails_loudly(self):
+        storage = ManifestStaticFilesStorage(location=tempfile.gettempdir())
+        self.assertEqual(storage.stored_name('bundles/catalog.js'), 'bundles/catalog.js')  # манифеста ещё нет
+        storage.hashed_files = {'css/style.css': 'css/style.0123456789ab.css'}
+        with self.assertRaises(ValueError):
+            storage.stored_name('bundles/catalog.js')
+
+    def test_collectstatic_refuses_outdated_bundles(self):
+        with tempfile.TemporaryDirectory() as static_root, override_settings(STATIC_ROOT=static_root):
+            with mock.patch.object(bundles, 'outdated', return_value=['bundles/catalog.js']):
+                with self.assertRaisesMessage(bundles.BundleError, 'bundles/catalog.js'):
+                    call_command('collectstatic', interactive=False, verbosity=0)
+
+
+class SearchTests(TestCase):
+    """Стеммер, разбор запроса FTS5 и обновление индекса"""
+
+    def test_stem(self):
+        for word, expected in (
+            ('баня', 'бан'), ('бани', 'бан'), ('банный', 'бан'), ('парилками', 'парилк'),
+            ('красивейший', 'красив'), ('ёлка', 'елк'), ('3x3', '3x3'),
+        ):
+            with self.subTest(word=word):
+                self.assertEqual(search.stem(word), expected)
+
+    def test_match_expression_escapes_fts_syntax(self):
+        self.assertEqual(search.match_expression('Баня" OR title:* NEAR('), '"бан"* "or"* "title"* "near"*')
+        self.assertEqual(search.match_expression('"*:()'), '')
+        # Синтаксис FTS5 из запроса не доходит до MATCH: поиск не падает
+        self.assertEqual(search.ids('product', 'title:* OR "'), [])
+
+    def test_bulk_operations_reindex(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            [product] = Product.objects.bulk_create([Product(title='Баня-бочка', price=1, description='Описание')])
+        self.assertEqual(search.ids('product', 'бочки'), [product.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=product.pk).update(title='Купель')
+        self.assertEqual(search.ids('product', 'бочки'), [])
+        self.assertEqual(search.ids('product', 'купели'), [product.pk])
+
+        price = ProductPrice.objects.create(product=product, name='Парная', price=1)
+        price.name = 'Терраса'
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductPrice.objects.bulk_update([price], ['name'])
+        self.assertEqual(search.ids('product', 'террасой'), [product.pk])
+
+    def test_empty_index_filled_after_migrate(self):
+        product = Product.objects.create(title='Баня-бочка', price=1, description='Описание')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABLE}')
+        search.fill_after_migrate(sender=None, apps=django_apps, using='default')
+        self.assertEqual(search.ids('product', 'бочка'), [product.pk])
+
+
+class CacheInspectTests(TestCase):
+    """Сводка кеша по семействам ключей и сброс по шаблону"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_inventory_counts_families(self):
+        cache_set('product_detail_1', {'title': 'Баня'}, 60)
+        cache_set('product_detail_2', {'title': 'Баня'}, 60)
+        cache_set('company_info', {'phone': '+7'}, 60)
+        families = cache_inspect.inventory()
+        self.assertEqual(families['product_detail_*']['entries'], 2)
+        self.assertEqual(families['product_detail_*']['dead'], 0)
+        self.assertIsNotNone(families['company_info']['newest'])
+
+        cache_bus.invalidate(['product_*'])
+        families = cache_inspect.inventory()
+        self.assertEqual(families['product_detail_*']['dead'], 2)
+        self.assertEqual(families['company_info']['dead'], 0)
+
+    def test_latest_family_wins(self):
+        cache_bus.invalidate(['product_detail_*'])
+        cache_set('product_detail_1', 'старое', 60)
+        cache_bus.invalidate(['product_*'])
+        self.assertIs(cache_get('product_detail_1'), MISS)
+
+
+class TwoTierCacheTests(TestCase):
+    """L1 в памяти процесса перед общим L2"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_local_tier_evicts_least_recent_by_size(self):
+        tier = _LocalTier(max_entries=10, max_bytes=100)
+        for key in ('a', 'b', 'c'):
+            tier.put(key, _Entry('x', b'x' * 40, 'stamp', None, 0, 0))
+        self.assertEqual(list(tier.entries), ['b', 'c'])
+        tier.get('b', 0)
+        tier.put('d', _Entry('x', b'x' * 40, 'stamp', None, 0, 0))
+        self.assertEqual(list(tier.entries), ['b', 'd'])
+        self.assertEqual(tier.size, 80)
+
+    def test_bus_invalidation_drops_only_local_copy(self):
+        cache_set('company_info', {'phone': '+7'}, 60)
+        cache_bus._apply_locally(['company_info'], published=False)
+        self.assertEqual(cache.entries(), [])
+        self.assertEqual(cache_get('company_info'), {'phone': '+7'})  # из L2
+
+    def test_local_copy_revalidated_by_stamp(self):
+        cache.set('company_info', 'старое')
+        # Другой воркер перезаписал значение в L2
+        cache.shared.set_many({
+            'company_info': ('другой штамп', None, 0, pickle.dumps('новое')),
+            'company_info:stamp': 'другой штамп',
+        })
+        self.assertEqual(cache.get('company_info'), 'старое')
+        with mock.patch.object(caches['default'], '_revalidate_after', 0):
+            self.assertEqual(cache.get('company_info'), 'новое')
+
+    def test_revalidation_reads_only_stamp(self):
+        cache.set('company_info', 'значение')
+        with mock.patch.object(caches['default'], '_revalidate_after', 0), \
+                mock.patch.object(type(cache.shared), 'get', wraps=cache.shared.get) as shared_get:
+            self.assertEqual(cache.get('company_info'), 'значение')
+        self.assertEqual([call.args[0] for call in shared_get.call_args_list], ['company_info:stamp'])
+
+    def test_immutable_values_are_shared_mutable_copied(self):
+        cache.set('product_ids', (1, 2, 3))
+        self.assertIs(cache.get('product_ids'), cache.get('product_ids'))
+        cache.set('company_info', {'phone': '+7'})
+        cache.get('company_info')['phone'] = 'изменён'
+        self.assertEqual(cache.get('company_info'), {'phone': '+7'})
+
+    def test_sqlite_add_is_exclusive_until_expiry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shared = SQLiteCache(f'{directory}/cache.sqlite3', {})
+            self.assertTrue(shared.add('lock', 1, 60))
+            self.assertFalse(shared.add('lock', 2, 60))
+            shared.set('lock', 1, 0)  # истекла
+            self.assertTrue(shared.add('lock', 3, 60))
+            self.assertEqual(shared.get('lock'), 3)
+
+    def test_write_time_kept_with_entry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shared = SQLiteCache(f'{directory}/cache.sqlite3', {})
+            shared.set('company_info', {'phone': '+7'}, 60)
+            [(_, _, _, written)] = shared.entries()
+            self.assertIsNotNone(written)
+
+
+@override_settings(IMAGE_DERIVATIVES={'SIZES': (160, 480), 'FORMATS': ('webp',)})
+class ImageDerivativeTests(TestCase):
+    """Копии изображений: запись без дублей, удаление, проверка наличия при рендере"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        images._known.clear()
+        images._missing.clear()
+        self.name = self.save_image('works/derivatives.jpg')
+
+    def save_image(self, name):
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'green').save(buffer, 'JPEG')
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def files(self, name):
+        directory, filename = posixpath.split(name)
+        root = posixpath.splitext(filename)[0]
+        return sorted(f for f in default_storage.listdir(directory)[1] if f.startswith(root) or f.startswith('.tmp'))
+
+    def test_racing_workers_leave_no_duplicates(self):
+        images.generate_derivatives(self.name)
+        # Второй воркер проверил наличие копий до того, как первый их записал
+        with mock.patch.object(images, '_exists', return_value=False):
+            self.assertEqual(len(images.generate_derivatives(self.name)), 4)
+        self.assertEqual(self.files(self.name), [
+            'derivatives.160w.jpg', 'derivatives.160w.webp', 'derivatives.480w.jpg', 'derivatives.480w.webp',
+            'derivatives.jpg',
+        ])
+
+    def test_derivatives_deleted_on_change_and_delete(self):
+        with mock.patch.object(images, '_submit', lambda task, name: task(name)):
+            with self.captureOnCommitCallbacks(execute=True):
+                photo = WorkPhoto.objects.create(image=self.name)
+            self.assertEqual(len(self.files(self.name)), 5)
+
+            replacement = self.save_image('works/replacement.jpg')
+            photo.image = replacement
+            with self.captureOnCommitCallbacks(execute=True):
+                photo.save()
+            self.assertEqual(self.files(self.name), ['derivatives.jpg'])
+            self.assertEqual(len(self.files(replacement)), 5)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                photo.delete()
+            self.assertEqual(self.files(replacement), ['replacement.jpg'])
+
+    def test_shared_original_keeps_derivatives(self):
+        images.generate_derivatives(self.name)
+        WorkPhoto.objects.create(image=self.name)
+        with mock.patch.object(images, '_submit', lambda task, name: task(name)):
+            with self.captureOnCommitCallbacks(execute=True):
+                WorkPhoto.objects.create(image=self.name).delete()
+        self.assertEqual(len(self.files(self.name)), 5)
+
+    def test_missing_derivatives_not_rechecked_on_every_render(self):
+        with mock.patch.object(default_storage, 'exists', return_value=False) as exists:
+            self.assertEqual(images.srcset(self.name), '')
+            images.srcset(self.name)
+            self.assertEqual(exists.call_count, 2)
+            # Генерация в любом процессе сбрасывает кеш страниц — и память об отсутствии
+            cache_bus.invalidate(['page:*'])
+            images.srcset(self.name)
+            self.assertEqual(exists.call_count, 4)
+
+
+class DerivativeProgressTests(TestCase):
+    """Прогресс build_image_derivatives: дозапись по строке и продолжение после прерывания"""
+
+    def test_resume_after_interrupted_write(self):
+        command = build_image_derivatives.Command()
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/progress.json'
+            with command._open_progress(path, 'sig', set()) as progress:
+                for name in ('works/1.jpg', 'works/2.jpg'):
+                    command._save_progress(progress, name)
+            with open(path, 'a', encoding='utf-8') as fh:
+                fh.write('"works/3.j')  # запуск прервали посреди записи
+            done = command._load_progress(path, 'sig')
+            self.assertEqual(done, {'works/1.jpg', 'works/2.jpg'})
+            self.assertEqual(command._load_progress(path, 'другие размеры'), set())
+
+            with command._open_progress(path, 'sig', done) as progress:
+                command._save_progress(progress, 'works/3.jpg')
+            self.assertEqual(command._load_progress(path, 'sig'), {'works/1.jpg', 'works/2.jpg', 'works/3.jpg'})
+
+
+class IngestQueueTests(TestCase):
+    """Очередь заявок: перенос в БД пачками, испорченная заявка не держит остальные"""
+
+    def setUp(self):
+        ingest._connection().execute('DELETE FROM submissions')
+        # Переносит тест, а не фоновый поток со своим соединением
+        self.enterContext(mock.patch.object(ingest, 'start_drainer'))
+
+    def test_enqueued_requests_drained_with_submit_time(self):
+        submitted = timezone.now() - timedelta(minutes=5)
+        with mock.patch.object(ingest.timezone, 'now', return_value=submitted):
+            ingest.enqueue(CreditRequest, fio='Иванов', phone='+79990000000')
+        ingest.enqueue(OrderRequest, fio='Петров', phone='+79990000001', email='p@example.com')
+        self.assertFalse(CreditRequest.objects.exists())
+        self.assertEqual([row['model'] for row in ingest.pending()], ['shop.CreditRequest', 'shop.OrderRequest'])
+
+        self.assertEqual(ingest.drain_all(), 2)
+        self.assertEqual(ingest.pending(), [])
+        self.assertEqual(CreditRequest.objects.get().created_at, submitted)
+        self.assertEqual(OrderRequest.objects.get().email, 'p@example.com')
+
+    def test_broken_request_stays_in_queue(self):
+        ingest.enqueue(CreditRequest, fio='Иванов', phone='+79990000000')
+        ingest._connection().execute(
+            'INSERT INTO submissions (model, payload, created_at) VALUES (?, ?, ?)',
+            ('shop.CreditRequest', json.dumps({'no_such_field': 1}), timezone.now().isoformat()),
+        )
+        ingest.enqueue(CreditRequest, fio='Сидоров', phone='+79990000002')
+
+        ingest.drain_all()
+        self.assertEqual(sorted(CreditRequest.objects.values_list('fio', flat=True)), ['Иванов', 'Сидоров'])
+        [broken] = ingest.pending()
+        self.assertEqual(broken['attempts'], 1)
+        self.assertIn('no_such_field', broken['last_error'])
+        self.assertEqual(ingest.drain(), 0)  # повтор только после истечения аренды
+
+
+class SQLiteTuningTests(TestCase):
+    """PRAGMA для новых соединений SQLite"""
+
+    def connection(self, name):
+        conn = mock.MagicMock(vendor='sqlite', settings_dict={'NAME': name})
+        return conn, conn.cursor.return_value.__enter__.return_value
+
+    def test_pragmas_applied_to_file(self):
+        path = posixpath.join(tempfile.mkdtemp(), 'tuned.sqlite3')
+        conn = sqlite3.connect(path)
+        self.addCleanup(conn.close)
+        sqlite_tuning.apply_pragmas(conn.cursor(), settings.SQLITE_PRAGMAS)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone(), (1,))  # NORMAL
+
+    def test_read_only_connection_keeps_journal_mode(self):
+        writer, writer_cursor = self.connection('/srv/db.sqlite3')
+        reader, reader_cursor = self.connection('file:/srv/db.sqlite3?mode=ro')
+        for conn in (writer, reader):
+            sqlite_tuning.configure_connection(sender=None, connection=conn)
+        executed = [call.args[0] for call in writer_cursor.execute.call_args_list]
+        self.assertIn('PRAGMA journal_mode = WAL', executed)
+        executed = [call.args[0] for call in reader_cursor.execute.call_args_list]
+        self.assertNotIn('PRAGMA journal_mode = WAL', executed)
+        self.assertIn('PRAGMA synchronous = NORMAL', executed)
+
+    def test_only_server_switches_database_to_wal(self):
+        path = posixpath.join(tempfile.mkdtemp(), 'tuned.sqlite3')
+
+        def journal_mode():
+            wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': path}, alias='scratch')
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    return cursor.fetchone()[0]
+            finally:
+                wrapper.close()
+
+        self.assertEqual(journal_mode(), 'delete')  # manage.py, тесты
+        sqlite_tuning.enable()  # banyana_fresh/wsgi.py
+        self.addCleanup(connection_created.disconnect, dispatch_uid='shop.sqlite_tuning')
+        self.assertEqual(journal_mode(), 'wal')
+
+    def test_other_vendors_untouched(self):
+        conn = mock.Mock(vendor='postgresql')
+        sqlite_tuning.configure_connection(sender=None, connection=conn)
+        conn.cursor.assert_not_called()
+
+
+class ReadReplicaRouterTests(TestCase):
+    """Публичные GET читают с реплики, первая запись возвращает чтения на основную базу"""
+
+    def setUp(self):
+        self.router = routers.ReadReplicaRouter()
+        self.enterContext(mock.patch.object(routers, '_replica_available', return_value=True))
+
+    def test_reads_inside_block_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        with routers.read_from_replica():
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.assertEqual(self.router.db_for_write(CreditRequest), 'default')
+            self.assertEqual(self.router.db_for_read(Product), 'default')  # read-after-write
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_middleware_skips_admin_and_unsafe_methods(self):
+        seen = []
+        middleware = ReadReplicaMiddleware(lambda request: seen.append(self.router.db_for_read(Product)))
+        factory = RequestFactory()
+        for request in (factory.get(reverse('catalog')), factory.get(reverse('admin:index')),
+                        factory.post(reverse('contact'))):
+            middleware(request)
+        self.assertEqual(seen, ['replica', 'default', 'default'])
+
+
+class TestIsolationTests(TestCase):
+    """Тесты не открывают рабочие файлы шины, общего кеша, очереди и метрик"""
+
+    REAL_FILES = ('cache.sqlite3', 'cache_bus.sqlite3', 'ingest_queue.sqlite3', 'metrics.sqlite3')
+
+    def test_service_files_are_never_opened(self):
+        real = {str(settings.BASE_DIR / name) for name in self.REAL_FILES}
+        opened = []
+        connect = sqlite3.connect
+
+        def spy(path, *args, **kwargs):
+            opened.append(str(path))
+            return connect(path, *args, **kwargs)
+
+        errors = []
+
+        def touch_everything():
+            # Новый поток — новые соединения: каждый модуль заново открывает свой файл
+            try:
+                cache.set('company_info', {'phone': '+7'})
+                cache.get('company_info')
+                cache_bus.invalidate(['company_info'])
+                ingest.pending()
+                metrics.flush()
+                cache_inspect.request_reports(0)
+            except Exception as exc:
+                errors.append(exc)
+
+        with mock.patch('sqlite3.connect', spy):
+            thread = threading.Thread(target=touch_everything)
+            thread.start()
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertGreaterEqual(len(set(opened)), len(self.REAL_FILES))
+        self.assertFalse(real & set(opened), opened)
+
+
+class FacetTests(TestCase):
+    """Разбор размеров и выбранных диапазонов фасетного фильтра"""
+
+    def test_bulk_operations_fill_meters(self):
+        product = Product.objects.create(title='Баня', price=100000, description='Описание')
+        [price] = ProductPrice.objects.bulk_create([
+            ProductPrice(product=product, name='3x3', price=1, total_length='5.5'),
+        ])
+        price.refresh_from_db()
+        self.assertEqual(price.length_m, Decimal('5.50'))
+
+        ProductPrice.objects.filter(pk=price.pk).update(total_length='6', rest_room='170/195')
+        price.refresh_from_db()
+        self.assertEqual((price.length_m, price.rest_room_m), (Decimal('6.00'), Decimal('1.95')))
+
+        ProductPrice.objects.filter(pk=price.pk).update(steam_room_length=F('total_length'))
+        price.refresh_from_db()
+        self.assertEqual(price.steam_room_m, Decimal('6.00'))
+
+        price.height = '2.4'
+        ProductPrice.objects.bulk_update([price], ['height'])
+        price.refresh_from_db()
+        self.assertEqual(price.height_m, Decimal('2.40'))
+
+    def test_parse_meters(self):
+        self.assertEqual(parse_meters('5.5'), Decimal('5.50'))
+        self.assertEqual(parse_meters('2,2/2.25'), Decimal('2.25'))
+        self.assertEqual(parse_meters('170/195'), Decimal('1.95'))
+        self.assertIsNone(parse_meters('по запросу'))
+
+    def test_selection_accepts_declared_buckets_only(self):
+        self.assertEqual(facets.parse_selection({'length': '4-5', 'steam': '2.5-'}), {
+            'length': (4, 5), 'steam': (Decimal('2.5'), None),
+        })
+        for value in ('nan-', 'Infinity-', '3.0001-7', '-', '4', '4-5-6'):
+            with self.subTest(value=value):
+                self.assertEqual(facets.parse_selection({'length': value}), {})
+
+    def test_catalog_ignores_malformed_range(self):
+        for value in ('nan-', 'Infinity-'):
+            with self.subTest(value=value):
+                self.assertEqual(self.client.get(reverse('catalog'), {'length': value}).status_code, 200)
@@ -7,9 +7,15 @@ urlpatterns = [
     path('catalog/', views.catalog, name='catalog'),
     path('product/<int:pk>/', views.product_detail, name='product_detail'),
     path('works/', views.works, name='works'),
+    path('works/page/', views.works_page, name='works_page'),
     path('contact/', views.contact, name='contact'),
     path('order/', views.order, name='order'),
     path('order/success/', views.order_success, name='order_success'),
     path('additional-services/', views.additional_services, name='additional_services'),
     path('credit-request/', views.credit_request_view, name='credit_request'),
+    path('search/', views.search_view, name='search'),
+    path('api/quote/', views.quote_view, name='quote'),
+    path('api/search/', views.search_api, name='search_api'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('metrics/templates/', views.template_stats, name='template_stats'),
 ]
@@ -2,14 +2,81 @@
 """
 Утилиты для оптимизации проекта
 """
+import hashlib
+import time
+
 from django.core.cache import cache
+from django.db.models import Model
 from functools import wraps
 
+from . import cache_bus
+
+
+# Маркер промаха: в отличие от None, пустой список или пустой словарь
+# не спутать с отсутствием значения в кеше
+MISS = object()
+
+# Наблюдатели обращений к кешу: callback(key, result), result — 'hit', 'stale' или 'miss'
+_observers = []
+
+
+def observe(callback):
+    """Сообщать callback о каждом обращении cache_get / cache_fetch (метрики, shop/apps.py)"""
+    if callback not in _observers:
+        _observers.append(callback)
+
+
+def _observed(key, result):
+    for callback in _observers:
+        callback(key, result)
 
-def cache_result(timeout=300, key_prefix=''):
+
+def _stable_repr(value):
+    """Детерминированное представление аргумента для ключа кеша"""
+    if isinstance(value, Model):
+        return f'{value._meta.label}:{value.pk}'
+    if isinstance(value, dict):
+        return '{' + ','.join(
+            f'{_stable_repr(k)}:{_stable_repr(v)}' for k, v in sorted(value.items(), key=lambda i: repr(i[0]))
+        ) + '}'
+    if isinstance(value, (set, frozenset)):
+        return '{' + ','.join(sorted(_stable_repr(v) for v in value)) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_stable_repr(v) for v in value) + ']'
+    return repr(value)
+
+
+def make_cache_key(prefix, *args, **kwargs):
+    """
+    Ключ кеша из префикса и стабильного хеша аргументов
+
+    В отличие от str(args) не зависит от порядка kwargs и id() объектов
+    и не превышает ограничений бэкендов на длину ключа.
+    """
+    if not args and not kwargs:
+        return prefix
+    digest = hashlib.sha1(_stable_repr((args, kwargs)).encode()).hexdigest()[:20]
+    return f'{prefix}:{digest}'
+
+
+def cache_get(key, default=MISS):
+    """Значение из кеша (с учётом версии семейства) или MISS при промахе"""
+    value = cache.get(key, MISS, version=cache_bus.version_for(key))
+    _observed(key, 'miss' if value is MISS else 'hit')
+    return default if value is MISS else value
+
+
+def cache_set(key, value, timeout):
+    cache.set(key, value, timeout, version=cache_bus.version_for(key))
+
+
+def cache_result(timeout=300, key_prefix='', cache_none=True):
     """
     Декоратор для кеширования результатов функций
 
+    None и пустые значения тоже кешируются (cache_none=False отключает
+    кеширование None).
+
     Использование:
     @cache_result(timeout=600, key_prefix='my_func')
     def my_function(arg1, arg2):
@@ -19,17 +86,18 @@ def cache_result(timeout=300, key_prefix=''):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Создаем ключ кеша из имени функции и аргументов
-            cache_key = f"{key_prefix}:{func.__name__}:{str(args)}:{str(kwargs)}"
+            # Создаем ключ кеша из имени функции и хеша аргументов
+            cache_key = make_cache_key(f'{key_prefix}:{func.__module__}.{func.__qualname__}', *args, **kwargs)
 
             # Пытаемся получить из кеша
-            result = cache.get(cache_key)
-            if result is not None:
+            result = cache_get(cache_key)
+            if result is not MISS:
                 return result
 
             # Вычисляем и кешируем
             result = func(*args, **kwargs)
-            cache.set(cache_key, result, timeout)
+            if result is not None or cache_none:
+                cache_set(cache_key, result, timeout)
             return result
 
         return wrapper
@@ -37,16 +105,70 @@ def cache_result(timeout=300, key_prefix=''):
     return decorator
 
 
-def clear_model_cache(model_name):
-    """Очистка кеша для конкретной модели"""
-    patterns = {
-        'Product': ['products_all', 'products_featured', 'products_catalog'],
-        'GlobalOption': ['global_options_active', 'global_options_grouped'],
-        'CompanyInfo': ['company_info'],
-    }
+def cache_fetch(key, compute, soft_ttl, hard_ttl=None, lock_timeout=30, wait=5, cache_none=True,
+                codec=None):
+    """
+    Получение значения из кеша с stale-while-revalidate и защитой от лавины
+
+    В кеше хранится пара (свежо_до, значение) со сроком жизни hard_ttl.
+    До soft_ttl значение считается свежим. После — его продолжают отдавать,
+    пока один запрос пересчитывает значение под блокировкой cache.add();
+    остальные не ждут и не идут в БД. При полном промахе пересчитывает
+    тоже только владелец блокировки, остальные ждут до `wait` секунд.
+    Пустые результаты (None, [], {}) — такие же попадания, как и любые
+    другие; cache_none=False не сохраняет None. codec — объект с pack() /
+    unpack() (например, shop.dto), в котором значение хранится в кеше.
+
+    Использование:
+    products = cache_fetch('products_catalog', load_products, soft_ttl=60 * 60)
+    """
+    hard_ttl = hard_ttl or soft_ttl * 6
+    version = cache_bus.version_for(key)
+    lock_key = f'{key}:lock'
+
+    def refresh():
+        with cache_bus.watch(key) as watched:
+            value = compute()
+            if value is not None or cache_none:
+                # Ключ сбросили, пока шёл расчёт: значение могло быть посчитано
+                # по данным до коммита — отдаём его, но в кеш не кладём
+                cache_bus.sync()
+                if not watched.invalidated:
+                    stored = codec.pack(value) if codec is not None else value
+                    cache.set(key, (time.time() + soft_ttl, stored), hard_ttl, version=version)
+        return value
+
+    def load(stored):
+        return codec.unpack(stored) if codec is not None else stored
+
+    entry = cache.get(key, MISS, version=version)
+    if entry is not MISS:
+        fresh_until, stored = entry
+        if time.time() < fresh_until:
+            _observed(key, 'hit')
+            return load(stored)
+        _observed(key, 'stale')
+        if not cache.add(lock_key, 1, lock_timeout, version=version):
+            return load(stored)  # пересчитывает другой запрос, отдаём устаревшее
+        try:
+            return refresh()
+        finally:
+            cache.delete(lock_key, version=version)
 
-    keys = patterns.get(model_name, [])
-    cache.delete_many(keys)
+    _observed(key, 'miss')
+    deadline = time.time() + wait
+    while not cache.add(lock_key, 1, lock_timeout, version=version):
+        if time.time() >= deadline:
+            return refresh()  # владелец блокировки завис — считаем сами
+        time.sleep(0.05)
+        entry = cache.get(key, MISS, version=version)
+        if entry is not MISS:
+            return load(entry[1])
+    try:
+        entry = cache.get(key, MISS, version=version)
+        return load(entry[1]) if entry is not MISS else refresh()
+    finally:
+        cache.delete(lock_key, version=version)
 
 
 def format_price(price):
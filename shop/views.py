@@ -1,8 +1,17 @@
+import logging
+import os
+
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.core.cache import cache
+from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Prefetch
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.formats import date_format
+from django.views.decorators.cache import never_cache
 from collections import defaultdict
 
 from .models import (
@@ -10,38 +19,63 @@ from .models import (
     OrderRequest, CompanyInfo, GlobalOption, CreditRequest
 )
 from .forms import OrderForm, CreditForm
+from . import dto, facets, images, ingest, metrics, quotes, search
+from .page_cache import cache_page_anonymous, register_hole
+from .pagination import decode_cursor, keyset_page
+from .query_budget import query_budget
+from .utils import cache_fetch, make_cache_key
 
+logger = logging.getLogger(__name__)
 
-def get_grouped_options():
-    """Утилита для группировки опций по категориям с кешированием"""
-    cached_data = cache.get('global_options_grouped')
-    if cached_data:
-        return cached_data
+# Результатов каждого типа на странице поиска и в подсказках при вводе
+SEARCH_PAGE_LIMIT = 24
+SEARCH_SUGGEST_LIMIT = 6
+
+# Персональные фрагменты кешированных страниц (см. shop/page_cache.py)
+register_hole('credit_captcha', lambda request: str(CreditForm()['captcha']))
+register_hole('today', lambda request: date_format(timezone.localdate(), 'd.m.Y'))
+
+
+def _load_grouped_options():
     global_options = GlobalOption.objects.filter(is_active=True).select_related().order_by('category', 'order', 'name')
     options_by_category = defaultdict(lambda: {'name': '', 'options': []})
     for option in global_options:
         category_key = option.category
         if not options_by_category[category_key]['name']:
             options_by_category[category_key]['name'] = option.get_category_display()
-        options_by_category[category_key]['options'].append(option)
-    result = dict(options_by_category)
-    cache.set('global_options_grouped', result, 60 * 15)
-    return result
+        options_by_category[category_key]['options'].append(dto.OptionDTO.from_model(option))
+    return {
+        category_key: {'name': data['name'], 'options': tuple(data['options'])}
+        for category_key, data in options_by_category.items()
+    }
 
 
+def get_grouped_options():
+    """Утилита для группировки опций по категориям с кешированием"""
+    # Ключи сбрасываются сигналами (shop/invalidation.py), TTL — страховка
+    return cache_fetch(
+        'global_options_grouped', _load_grouped_options,
+        soft_ttl=60 * 60, hard_ttl=60 * 60 * 6, codec=dto,
+    )
+
+
+@query_budget(queries=10, ms=100)
+@cache_page_anonymous()
 def index(request):
     """Главная страница"""
     # ← ИСПРАВЛЕНО: Используем is_featured=True для популярных моделей
-    popular_products = cache.get('products_featured')
-    if not popular_products:
-        popular_products = list(
+    popular_products = cache_fetch(
+        'products_featured',
+        lambda: dto.CardDTO.for_products(
             Product.objects
             .filter(is_featured=True)  # ← ТОЛЬКО отмеченные как популярные
-            .select_related()
-            .prefetch_related('prices', 'images')
-            .order_by('-id')[:6]
-        )
-        cache.set('products_featured', popular_products, 60 * 5)
+            .order_by('-id'),
+            limit=6,
+        ),
+        soft_ttl=60 * 60,
+        hard_ttl=60 * 60 * 6,
+        codec=dto,
+    )
 
     credit_form = CreditForm()
 
@@ -51,71 +85,141 @@ def index(request):
     })
 
 
+@query_budget(queries=4, ms=50)
+@cache_page_anonymous()
 def about(request):
     info = CompanyInfo.get_cached()
     return render(request, 'shop/about.html', {'info': info})
 
 
+@query_budget(queries=6, ms=100)
+@cache_page_anonymous(params=facets.PARAMS)
 def catalog(request):
-    products = cache.get('products_catalog')
-    if not products:
-        products = list(
-            Product.objects
-            .select_related()
-            .prefetch_related('prices', 'images')
-            .all()
+    selection = facets.parse_selection(request.GET)
+    if selection:
+        # Отфильтрованный список целиком лежит в кеше страницы по адресу с параметрами
+        products = dto.CardDTO.for_products(
+            Product.objects.filter(pk__in=facets.matching_prices(selection).values('product_id')).order_by('id')
         )
-        cache.set('products_catalog', products, 60 * 5)
-    return render(request, 'shop/catalog.html', {'products': products})
+    else:
+        products = cache_fetch(
+            'products_catalog',
+            lambda: dto.CardDTO.for_products(Product.objects.order_by('id')),
+            soft_ttl=60 * 60,
+            hard_ttl=60 * 60 * 6,
+            codec=dto,
+        )
+    return render(request, 'shop/catalog.html', {
+        'products': products,
+        'facets': facets.facet_counts(selection),
+        'is_filtered': bool(selection),
+    })
 
 
+@query_budget(queries=6, ms=50)
+@cache_page_anonymous()
 def product_detail(request, pk):
-    cache_key = f'product_detail_{pk}'
-    cached_data = cache.get(cache_key)
-    if cached_data:
-        context = cached_data
-    else:
-        product = get_object_or_404(
+    def load_product():
+        return dto.ProductDTO.from_model(get_object_or_404(
             Product.objects
-            .select_related()
             .prefetch_related(
                 Prefetch('prices', queryset=ProductPrice.objects.order_by('order')),
                 Prefetch('images', queryset=ProductImage.objects.order_by('order'))
             ),
             pk=pk
-        )
-        prices = product.prices.all()
-        options_by_category = get_grouped_options()
-        context = {
-            'product': product,
-            'prices': prices,
-            'options_by_category': options_by_category,
-        }
-        cache.set(cache_key, context, 60 * 10)
-    return render(request, 'shop/product_detail.html', context)
+        ))
+
+    # Семейство product_detail_* версионируется шиной (сбрасывается при правке опций)
+    product = cache_fetch(
+        f'product_detail_{pk}', load_product,
+        soft_ttl=60 * 60, hard_ttl=60 * 60 * 6, codec=dto,
+    )
+    return render(request, 'shop/product_detail.html', {
+        'product': product,
+        'prices': product.prices,
+        'options_by_category': get_grouped_options(),
+    })
+
+
+def _works_page(cursor):
+    """Страница галереи работ из кеша: (фото, курсор следующей страницы)"""
+    if decode_cursor(cursor) is None:
+        cursor = ''  # битый курсор — первая страница, без лишних ключей в кеше
+
+    def load():
+        photos, next_cursor = keyset_page(WorkPhoto.objects.all(), cursor, settings.WORKS_PAGE_SIZE)
+        return tuple(dto.PhotoDTO.from_model(photo) for photo in photos), next_cursor
 
+    # Семейство works_page:* сбрасывается при добавлении и удалении фото
+    return cache_fetch(
+        make_cache_key('works_page', cursor), load,
+        soft_ttl=60 * 60, hard_ttl=60 * 60 * 6, codec=dto,
+    )
 
+
+@query_budget(queries=4, ms=50)
+@cache_page_anonymous(params=('after',))
 def works(request):
-    photos = WorkPhoto.objects.all()[:50]
-    return render(request, 'shop/works.html', {'photos': photos})
+    photos, next_cursor = _works_page(request.GET.get('after', ''))
+    return render(request, 'shop/works.html', {'photos': photos, 'next_cursor': next_cursor})
+
+
+@query_budget(queries=3, ms=50)
+def works_page(request):
+    """JSON со следующей страницей галереи для бесконечной прокрутки"""
+    photos, next_cursor = _works_page(request.GET.get('after', ''))
+    return JsonResponse({
+        'photos': [
+            {
+                'id': photo.id,
+                'url': photo.url,
+                'thumb': images.thumbnail_url(photo.url, 480),
+                'srcset': images.srcset(photo.url),
+                'sources': [{'type': mime, 'srcset': value} for mime, value in images.sources(photo.url)],
+            }
+            for photo in photos
+        ],
+        'next': next_cursor or None,
+    })
 
 
+@query_budget(queries=4, ms=50)
+@cache_page_anonymous()
 def contact(request):
     info = CompanyInfo.get_cached()
     return render(request, 'shop/contact.html', {'info': info})
 
 
+def _order_details(params):
+    """
+    Детали заказа по ссылке из калькулятора или каталога
+
+    Текст строится только из размеров, товаров и опций, найденных в базе, с
+    актуальными ценами: произвольный текст из адреса в заявку не попадает.
+    Неизвестный размер, товар или опция — QuoteError.
+    """
+    if 'size' in params:
+        return quotes.describe(quotes.quote(params['size'], params.getlist('option')))
+    if 'product' in params:
+        return quotes.describe_product(params['product'], params.getlist('option'))
+    return ''
+
+
+@query_budget(queries=6, ms=50)
 def order(request):
-    order_details = request.GET.get('details', '')
+    try:
+        order_details = _order_details(request.GET)
+    except quotes.QuoteError as exc:
+        # Ссылка на удалённый товар или снятую опцию: заявка без деталей ничего не скажет менеджеру
+        raise Http404(str(exc))
     if request.method == 'POST':
         form = OrderForm(request.POST)
         if not form.is_valid():
-            print("=" * 50)
-            print("ОШИБКИ ВАЛИДАЦИИ ФОРМЫ:")
-            print(form.errors)
-            print("=" * 50)
+            logger.info('Ошибки в форме заказа: %s', form.errors.as_json())
         if form.is_valid():
-            OrderRequest.objects.create(
+            # В очередь: в БД заявку перенесёт фоновый поток (shop/ingest.py)
+            ingest.enqueue(
+                OrderRequest,
                 fio=form.cleaned_data['fio'],
                 phone=form.cleaned_data['phone'],
                 email=form.cleaned_data['email'],
@@ -132,16 +236,19 @@ def order(request):
     })
 
 
+@query_budget(queries=2, ms=20)
 def order_success(request):
     return render(request, 'shop/order_success.html')
 
 
+@query_budget(queries=5, ms=50)
 def credit_request_view(request):
     """AJAX обработчик формы кредита"""
     if request.method == 'POST':
         form = CreditForm(request.POST)
         if form.is_valid():
-            CreditRequest.objects.create(
+            ingest.enqueue(
+                CreditRequest,
                 fio=form.cleaned_data['fio'],
                 phone=form.cleaned_data['phone']
             )
@@ -151,8 +258,102 @@ def credit_request_view(request):
     return JsonResponse({'success': False, 'message': 'Invalid request method.'}, status=405)
 
 
+@query_budget(queries=4, ms=20)
+def quote_view(request):
+    """Расчёт стоимости: ?size=<id ProductPrice>&option=<id>&option=<id>"""
+    try:
+        result = quotes.quote(request.GET.get('size'), request.GET.getlist('option'))
+    except quotes.QuoteError as exc:
+        return JsonResponse({'success': False, 'message': str(exc)}, status=400)
+    return JsonResponse({'success': True, **result})
+
+
+@query_budget(queries=8, ms=100)
+def search_view(request):
+    """Страница поиска: /search/?q=баня бочка"""
+    query = request.GET.get('q', '').strip()
+    return render(request, 'shop/search.html', {
+        'query': query,
+        'min_length': search.MIN_QUERY_LENGTH,
+        **search.search(query, limit=SEARCH_PAGE_LIMIT),
+    })
+
+
+@query_budget(queries=6, ms=50)
+def search_api(request):
+    """Подсказки при вводе: /api/search/?q=бан"""
+    query = request.GET.get('q', '').strip()
+    results = search.search(query, limit=SEARCH_SUGGEST_LIMIT)
+    options_url = reverse('additional_services')
+    return JsonResponse({
+        'success': True,
+        'query': query,
+        'products': [
+            {
+                'id': card.id,
+                'title': card.title,
+                'url': reverse('product_detail', args=[card.id]),
+                'price': f'от {card.formatted_from_price}' if card.from_price else 'Цена по запросу',
+            }
+            for card in results['products']
+        ],
+        'options': [
+            {'id': option.id, 'title': option.name, 'url': options_url, 'price': option.formatted_price}
+            for option in results['options']
+        ],
+    })
+
+
+@query_budget(queries=4, ms=50)
+@cache_page_anonymous()
 def additional_services(request):
     options_by_category = get_grouped_options()
     return render(request, 'shop/additional_services.html', {
         'options_by_category': options_by_category
     })
+
+
+@query_budget(queries=2, ms=20)
+@staff_member_required
+def template_stats(request):
+    """Время рендера шаблонов в текущем воркере: число, среднее, p50/p95 и корзины (мс)"""
+    histogram = metrics.template_render_seconds
+
+    def quantile_ms(series, q):
+        bound = histogram.quantile(series, q)
+        return None if bound == float('inf') else bound * 1000  # дольше последней корзины
+
+    stats = {}
+    for name, series in sorted(histogram.snapshot().items()):
+        stats[name] = {
+            'count': series['count'],
+            'mean_ms': round(series['sum'] * 1000 / series['count'], 3),
+            'p50_ms': quantile_ms(series, 0.5),
+            'p95_ms': quantile_ms(series, 0.95),
+            'buckets_ms': {
+                **{f'{bound * 1000:g}': count for bound, count in zip(histogram.buckets, series['counts'])},
+                'inf': series['counts'][-1],
+            },
+        }
+    return JsonResponse({'pid': os.getpid(), 'templates': stats})
+
+
+@query_budget(queries=2, ms=20)
+@never_cache
+def metrics_view(request):
+    """
+    Метрики всех воркеров в текстовом формате Prometheus
+
+    Доступ — персоналу или по заголовку Authorization: Bearer <METRICS_TOKEN>
+    (для сборщика Prometheus).
+    """
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_active and request.user.is_staff
+    if not authorized and token:
+        authorized = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(
+        metrics.render_prometheus(metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,211 @@
+# shop/warmup.py
+"""
+Прогрев кеша: данные и отрендеренные страницы до первого посетителя
+
+Без прогрева после старта и после каждой инвалидации первый посетитель
+каждой страницы ждёт холодный рендер, а в каждом воркере — ещё и чтение
+из общего кеша в свою память (L1, см. shop/cache_backends.py). Прогрев
+вызывает view публичных страниц внутри процесса — с кешем страниц, но без
+middleware: запросы прогрева не попадают в метрики (metrics.muted), не
+создают сессий и капч (дыры страниц не рендерятся, request.cache_warmup).
+По пути заполняются products_catalog, products_featured, product_detail_<pk>,
+global_options_grouped, company_info и остальные ключи, которые читают эти
+страницы. Страницы рендерятся параллельно в нескольких потоках.
+
+start_warmup() (banyana_fresh/wsgi.py) запускает в воркере фоновый поток:
+он прогревает кеш сразу после старта, затем каждые CACHE_WARMUP_INTERVAL
+секунд сверяется с шиной инвалидации (cache_bus.sync) и перерисовывает
+страницы, зависящие от сброшенных ключей, не дожидаясь посетителя.
+Команда warm_cache прогревает кеш своего процесса с замером времени и
+публикует в шине ключ WARMUP_KEY — по нему все воркеры прогреваются заново.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import Http404
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from . import cache_bus, metrics, routers
+
+logger = logging.getLogger(__name__)
+
+# Ключ-сигнал в шине: прогреть все страницы во всех воркерах
+WARMUP_KEY = 'cache_warmup'
+
+# Страницы без параметров, кешируемые целиком; главная и каталог — первыми
+PAGES = ('index', 'catalog', 'additional_services', 'works', 'about', 'contact')
+# Ключ -> страницы, которые его читают (карточки товаров — см. pages_for)
+KEY_PAGES = {
+    'products_featured': ('index',),
+    'products_catalog': ('catalog',),
+    'catalog_facets:*': ('catalog',),
+    'global_options_grouped': ('additional_services',),
+    'company_info': ('about', 'contact'),
+    'works_page:*': ('works',),
+}
+# Ключи, от которых зависят страницы всех товаров
+PRODUCT_PAGE_KEYS = {'product_detail_*', 'global_options_grouped'}
+_PRODUCT_DETAIL_RE = re.compile(r'product_detail_(\d+)')
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_pending = set()
+_warmup_pid = None
+
+
+def product_pages(pks=None):
+    from .models import Product
+    if pks is None:
+        pks = Product.objects.order_by('id').values_list('id', flat=True)
+    return [reverse('product_detail', args=[pk]) for pk in pks]
+
+
+def all_pages():
+    return [reverse(name) for name in PAGES] + product_pages()
+
+
+def pages_for(keys):
+    """
+    Адреса страниц, которые надо перерисовать после инвалидации keys
+
+    Сохранение модели сбрасывает и свои ключи данных, и весь кеш страниц
+    ('page:*', см. CACHE_DEPENDENCIES): перерисовываются страницы, которые
+    читают сброшенные данные. Все страницы — только по ALL_KEYS, WARMUP_KEY
+    или 'page:*' без ключей данных (например, после генерации копий
+    изображений, shop/images.py).
+    """
+    keys = set(keys)
+    if keys & {cache_bus.ALL_KEYS, WARMUP_KEY}:
+        return all_pages()
+    names = {name for key in keys for name in KEY_PAGES.get(key, ())}
+    pages = [reverse(name) for name in PAGES if name in names]
+    if keys & PRODUCT_PAGE_KEYS:
+        return pages + product_pages()
+    pks = sorted({int(match[1]) for match in map(_PRODUCT_DETAIL_RE.fullmatch, keys) if match})
+    if not pages and not pks and 'page:*' in keys:
+        return all_pages()
+    return pages + product_pages(pks)
+
+
+def _host():
+    # Запрос проверяет ALLOWED_HOSTS; подходит любой точный (не шаблон) адрес сайта
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.') and '*' not in host]
+    return hosts[0] if hosts else 'localhost'
+
+
+def _render(factory, path):
+    """Вызвать view страницы как для анонимного посетителя: код ответа"""
+    request = factory.get(path)
+    request.user = AnonymousUser()
+    request.cache_warmup = True
+    match = resolve(path)
+    try:
+        # Как ReadReplicaMiddleware для GET посетителя
+        with routers.read_from_replica():
+            response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+    except Http404:
+        return 404
+    except PermissionDenied:
+        return 403
+    except Exception:
+        logger.exception('Прогрев: ошибка на странице %s', path)
+        return 500
+    return response.status_code
+
+
+def _fetch(paths):
+    """Отрендерить страницы в текущем потоке: [(адрес, код ответа, секунды)]"""
+    factory = RequestFactory(HTTP_HOST=_host())
+    results = []
+    with metrics.muted():
+        for path in paths:
+            started = time.perf_counter()
+            status = _render(factory, path)
+            results.append((path, status, time.perf_counter() - started))
+    return results
+
+
+def _fetch_in_pool(paths):
+    try:
+        return _fetch(paths)
+    finally:
+        # Поток пула живёт только до конца прогрева: его соединения больше не нужны
+        connections.close_all()
+
+
+def warm(paths=None, parallel=None):
+    """
+    Прогреть кеш, запросив страницы paths (по умолчанию все) в parallel потоков
+
+    Возвращает ([(адрес, код ответа, секунды)], общее время в секундах).
+    """
+    paths = list(all_pages() if paths is None else paths)
+    parallel = max(1, min(parallel or settings.CACHE_WARMUP_PARALLEL, len(paths) or 1))
+    started = time.perf_counter()
+    if parallel == 1:
+        return _fetch(paths), time.perf_counter() - started
+    # Каждому потоку — своя часть адресов: главная и каталог уходят первыми
+    chunks = [paths[index::parallel] for index in range(parallel)]
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='cache-warmup') as pool:
+        results = [result for chunk in pool.map(_fetch_in_pool, chunks) for result in chunk]
+    return results, time.perf_counter() - started
+
+
+def _schedule(keys):
+    """Обработчик шины: запомнить сброшенные ключи и разбудить поток прогрева"""
+    with _lock:
+        _pending.update(keys)
+    _wakeup.set()
+
+
+def _warm_pending():
+    with _lock:
+        keys = set(_pending)
+        _pending.clear()
+        _wakeup.clear()
+    if not keys:
+        return
+    paths = pages_for(keys)
+    if not paths:
+        return
+    results, elapsed = warm(paths)
+    failed = [f'{path} ({status})' for path, status, _ in results if status >= 400]
+    logger.info('Кеш прогрет: %d страниц за %.2f с', len(results), elapsed)
+    if failed:
+        logger.warning('Прогрев: ошибки на страницах %s', ', '.join(failed))
+
+
+def _run(interval):
+    _schedule([WARMUP_KEY])
+    while True:
+        try:
+            cache_bus.sync()  # инвалидации других процессов придут в _schedule
+            _warm_pending()
+        except Exception:
+            logger.exception('Ошибка прогрева кеша')
+        _wakeup.wait(interval)
+
+
+def start_warmup():
+    """Запустить фоновый прогрев в текущем процессе (повторный вызов ничего не делает)"""
+    global _warmup_pid
+    interval = getattr(settings, 'CACHE_WARMUP_INTERVAL', None)
+    if not interval or _warmup_pid == os.getpid():
+        return
+    with _lock:
+        if _warmup_pid == os.getpid():
+            return
+        cache_bus.subscribe(_schedule)
+        threading.Thread(target=_run, args=(interval,), name='cache-warmup', daemon=True).start()
+        _warmup_pid = os.getpid()